@@ -10,75 +10,330 @@ import time
 import math
 import _thread
 import re
+import os
+import struct
+import binascii
+from array import array
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+# uasyncio provides sleep_ms(); CPython's asyncio only has sleep(seconds)
+async_sleep_ms = getattr(asyncio, 'sleep_ms', None) or (lambda ms: asyncio.sleep(ms / 1000))
 #Add your SSID ( Wifi Name) and the password here , to connect to wifi
 SSID = ''
 PASSWORD = ''
+WIFI_FILE = 'wifi.json'        # Last good access point and address, for fast reconnects
+WIFI_CACHE_IP = True           # Reuse the last DHCP lease as a static address (skips DHCP)
+WIFI_ATTEMPT_MS = 10000        # Give up on one association attempt after this long
+WIFI_BACKOFF_MS = 250          # Wait after a failed attempt; doubles each time
+WIFI_BACKOFF_MAX_MS = 30000
+WIFI_POLL_MS = 50              # How often a pending association is checked
+WIFI_LEARN_DELAY_MS = 10000    # Idle time before scanning for the BSSID to cache
 PORT = 8080
+MAX_CLIENTS = 8                # Connections served concurrently
+CLIENT_READ_TIMEOUT_MS = 5000  # Per-connection read deadline
+KEEPALIVE_IDLE_MS = 30000      # Idle time before a persistent connection is closed
+TELEOP_PORT = 8081             # UDP port for streamed joint setpoints
+TELEOP_POLL_MS = 5             # How often the teleop socket is drained
+TELEOP_DEADMAN_MS = 250        # Hold position if no setpoint arrives for this long
+COMMAND_QUEUE_SIZE = 8         # Commands waiting for the motion task
+RECV_BUFFER_SIZE = 1024        # Bytes read per request
+MOTION_POLL_MS = 20            # How often waiters check for a finished command
+JOB_HISTORY = 16               # Finished jobs kept for status queries
+JOB_EVENT_MS = 250             # Interval between progress events of a watched job
 
-def connect_wifi():
-    """Connect to WiFi with error handling for ESP32-C3"""
+# Logging
+#
+# Records go to a fixed-size ring in RAM that clients fetch with the "logs"
+# command (or GET /logs), and are echoed to the console while LOG_ECHO is on.
+# Call sites guard debug and info records with "if LOG_DEBUG:" / "if LOG_INFO:".
+# These are micropython.const values, so when one is 0 the compiler drops the
+# whole block: a disabled record costs nothing, not even formatting its text.
+try:
+    from micropython import const
+except ImportError:
+    const = lambda value: value
+
+DEBUG, INFO, WARN, ERROR = 0, 1, 2, 3
+LOG_LEVEL_NAMES = ('DEBUG', 'INFO', 'WARN', 'ERROR')
+LOG_DEBUG = const(0)           # 1 compiles in per-move detail (slows the motion loop)
+LOG_INFO = const(1)            # 0 keeps only warnings and errors
+LOG_ECHO = const(1)            # Also print records to the console; 0 for production
+LOG_RING_BYTES = 4096          # Most recent records kept for "logs"
+
+
+class LogRing:
+    """Preallocated byte ring holding the most recent log records"""
+
+    def __init__(self, size=LOG_RING_BYTES):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+        self.wrapped = False
+        self.records = 0
+
+    def write(self, data):
+        size = len(self.buf)
+        if len(data) > size // 4:
+            data = data[:size // 4 - 1] + b'\n'
+        end = self.pos + len(data)
+        if end < size:
+            self.mv[self.pos:end] = data
+        else:
+            first = size - self.pos
+            self.mv[self.pos:] = data[:first]
+            end -= size
+            self.mv[:end] = data[first:]
+            self.wrapped = True
+        self.pos = end
+        self.records += 1
+
+    def lines(self):
+        """Records in order, oldest first"""
+        if not self.wrapped:
+            data = bytes(self.buf[:self.pos])
+        else:
+            data = bytes(self.buf[self.pos:]) + bytes(self.buf[:self.pos])
+            data = data[data.find(b'\n') + 1:]  # Oldest record was partly overwritten
+        return str(data, 'utf-8', 'ignore').split('\n')[:-1]
+
+    def clear(self):
+        self.pos = 0
+        self.wrapped = False
+
+
+log_ring = LogRing()
+
+def log(level, message):
+    """Record a message at DEBUG, INFO, WARN or ERROR level"""
+    line = f"{time.ticks_ms()} {LOG_LEVEL_NAMES[level]} {message}\n"
+    log_ring.write(line.encode('utf-8'))
+    if LOG_ECHO:
+        print(line, end='')
+
+def logs_command(options):
+    """{"action": "logs"} returns the log ring; "clear": true empties it afterwards"""
+    result = {"status": "success", "records": log_ring.records, "logs": log_ring.lines()}
+    if options and options.get("clear"):
+        log_ring.clear()
+    return result
+
+# Boot timing
+#
+# ticks_ms() starts at 0 on reset, so each phase is marked in milliseconds
+# since power-on (or since the brownout that restarted the robot). Phases are
+# logged as they are reached and reported under "boot" by "metrics".
+
+boot_phases = {}           # Phase name -> ticks_ms() when it was reached
+
+def boot_phase(name):
+    """Mark a boot phase as reached; later marks of the same phase are ignored"""
+    if name in boot_phases:
+        return
+    boot_phases[name] = time.ticks_ms()
+    if LOG_INFO:
+        log(INFO, f'Boot phase {name} at {boot_phases[name]} ms')
+
+def boot_report():
+    """Boot phases in the order reached, the reset cause and the WiFi state"""
+    reset_cause = getattr(machine, 'reset_cause', None)
+    return {
+        "reset_cause": reset_cause() if reset_cause else None,
+        "phases_ms": dict(sorted(boot_phases.items(), key=lambda item: item[1])),
+        "wifi": wifi_state,
+    }
+
+boot_phase('imports')
+
+
+# WiFi
+#
+# The command server and the motion engine start first; WiFi associates in
+# the background. The access point (BSSID and channel) and the address of the
+# last good connection are cached in WIFI_FILE: a known BSSID and channel
+# skip the all-channel scan, and the cached address skips DHCP. The BSSID is
+# added later, once the robot is idle (see learn_bssid()). If the
+# cached parameters fail once they are dropped and a plain connect follows.
+# Failed attempts back off from WIFI_BACKOFF_MS up to WIFI_BACKOFF_MAX_MS.
+
+wifi_state = {"connected": False, "attempts": 0, "cached": False, "ifconfig": None}
+# Statuses that end an association attempt early; not every port defines all of them
+WIFI_FAILED = tuple([getattr(network, name) for name in ('STAT_NO_AP_FOUND', 'STAT_WRONG_PASSWORD',
+                                                        'STAT_CONNECT_FAIL') if hasattr(network, name)])
+
+def load_wifi_cache():
+    """The cached connection parameters for SSID, or None"""
     try:
-        # Initialize WiFi
-        wlan = network.WLAN(network.STA_IF)
-        
-        # Deactivate first to ensure clean state
-        wlan.active(False)
-        time.sleep(1)
-        
-        # Activate WiFi
-        wlan.active(True)
-        time.sleep(2)  # Give WiFi time to initialize
-        
-        print('WiFi initialized, attempting connection...')
-        wlan.connect(SSID, PASSWORD)
-        
-        # Wait for connection
-        while not wlan.isconnected():
-            time.sleep(0.1)
-            
-        print('Connected to WiFi:', wlan.ifconfig())
+        with open(WIFI_FILE) as f:
+            cache = json.load(f)
+        if cache.get('ssid') == SSID:
+            return cache
+    except OSError:
+        pass
+    except (ValueError, TypeError, AttributeError) as e:
+        log(WARN, f'Ignoring corrupt WiFi cache: {e}')
+    return None
+
+def write_wifi_cache(cache):
+    """Write the WiFi cache to flash (write-then-rename, so never torn)"""
+    try:
+        tmp_file = WIFI_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_file, WIFI_FILE)
         return True
-        
     except OSError as e:
-        print('WiFi Internal Error:', e)
-        print('This is a common ESP32-C3 issue. Trying alternative approach...')
-        
-        # Alternative approach: reset and try again
+        log(WARN, f'Failed to cache WiFi parameters: {e}')
+        return False
+
+def save_wifi_cache(wlan, cache):
+    """
+    Remember the channel and address just used, if they changed; returns the
+    cache. The BSSID is kept only if the connect used it (see learn_bssid()).
+    """
+    try:
+        fresh = {'ssid': SSID, 'bssid': cache.get('bssid') if cache else None,
+                 'channel': wlan.config('channel'), 'ifconfig': list(wlan.ifconfig())}
+    except (OSError, ValueError) as e:
+        log(WARN, f'Failed to read WiFi parameters: {e}')
+        return cache
+    if fresh != cache:
+        write_wifi_cache(fresh)
+    return fresh
+
+async def learn_bssid(wlan, cache):
+    """
+    Add the access point's BSSID to the WiFi cache, for the next boot
+
+    The ESP32 port has no config('bssid'), so it comes from a scan, which
+    blocks the event loop for a second or two. The scan waits until the
+    robot is not in use: WIFI_LEARN_DELAY_MS after connecting, with no client
+    connected, no motion and no teleop. It is needed once per access point.
+    """
+    try:
+        bssid = wlan.config('bssid')
+    except (OSError, ValueError):
+        await async_sleep_ms(WIFI_LEARN_DELAY_MS)
+        while active_clients or motion_engine.busy():
+            await async_sleep_ms(WIFI_LEARN_DELAY_MS)
+        best = None
+        for entry in wlan.scan():
+            if entry[0].decode('utf-8', 'ignore') == SSID and entry[2] == cache['channel']:
+                if best is None or entry[3] > best[3]:
+                    best = entry
+        bssid = best[1] if best else None
+    if bssid:
+        cache['bssid'] = binascii.hexlify(bssid).decode()
+        write_wifi_cache(cache)
+        if LOG_INFO:
+            log(INFO, f'Cached WiFi access point {cache["bssid"]}')
+
+async def wifi_attempt(wlan, cache):
+    """One association attempt, with the cached parameters if given; True once connected"""
+    if not wlan.active():
+        wlan.active(True)
+    if cache is None:
+        wlan.connect(SSID, PASSWORD)
+    else:
+        if WIFI_CACHE_IP and cache.get('ifconfig'):
+            wlan.ifconfig(tuple(cache['ifconfig']))
         try:
-            wlan.active(False)
-            time.sleep(2)
-            wlan.active(True)
-            time.sleep(3)
-            
-            print('Retrying WiFi connection...')
+            wlan.config(channel=cache['channel'])
+        except (OSError, ValueError, KeyError):
+            pass  # Not settable in station mode on every port
+        if cache.get('bssid'):
+            wlan.connect(SSID, PASSWORD, bssid=binascii.unhexlify(cache['bssid']))
+        else:
             wlan.connect(SSID, PASSWORD)
-            
-            # Wait for connection with timeout
-            timeout = 20
-            while timeout > 0 and not wlan.isconnected():
-                time.sleep(0.5)
-                timeout -= 1
-                
-            if wlan.isconnected():
-                print('Connected to WiFi on retry:', wlan.ifconfig())
-                return True
-            else:
-                print('Failed to connect after retry')
-                return False
-                
-        except Exception as e2:
-            print('Alternative approach also failed:', e2)
+    started = time.ticks_ms()
+    while not wlan.isconnected():
+        # A wrong password or a vanished access point fails early
+        if (wlan.status() in WIFI_FAILED
+                or time.ticks_diff(time.ticks_ms(), started) >= WIFI_ATTEMPT_MS):
+            wlan.disconnect()
             return False
-            
+        await async_sleep_ms(WIFI_POLL_MS)
+    return True
+
+async def connect_wifi():
+    """Connect to WiFi without blocking the server or motion; returns (WLAN, cache) once connected"""
+    wlan = network.WLAN(network.STA_IF)
+    cache = load_wifi_cache()
+    delay = WIFI_BACKOFF_MS
+    wifi_state["connected"] = False
+    wifi_state["attempts"] = 0
+    while True:
+        wifi_state["attempts"] += 1
+        wifi_state["cached"] = cache is not None
+        try:
+            if await wifi_attempt(wlan, cache):
+                break
+            log(WARN, f'WiFi attempt {wifi_state["attempts"]} failed')
+        except OSError as e:
+            # "Wifi Internal Error" is common on the ESP32-C3; restart the interface
+            log(WARN, f'WiFi error: {e}')
+            wlan.active(False)
+        if cache is not None:
+            log(WARN, 'Cached WiFi parameters failed, doing a full connect')
+            cache = None
+            if WIFI_CACHE_IP:
+                try:
+                    wlan.ifconfig('dhcp')
+                except (OSError, ValueError):
+                    pass
+            continue
+        await async_sleep_ms(delay)
+        delay = min(delay * 2, WIFI_BACKOFF_MAX_MS)
+    wifi_state["connected"] = True
+    wifi_state["ifconfig"] = wlan.ifconfig()
+    boot_phase('wifi')
+    if LOG_INFO:
+        log(INFO, f'Connected to WiFi: {wlan.ifconfig()}')
+    return wlan, save_wifi_cache(wlan, cache)
+
+async def wifi_task():
+    """Bring WiFi up in the background, then start WebREPL and complete the cache"""
+    wlan, cache = await connect_wifi()
+    try:
+        #webrepl.start()
+        if LOG_INFO:
+            log(INFO, 'WebREPL started')
     except Exception as e:
-        print('Unexpected WiFi error:', e)
-        return False
-        
+        log(WARN, f'WebREPL failed to start: {e}')
+    if cache is not None and not cache.get('bssid'):
+        await learn_bssid(wlan, cache)
+
 # Constants
 SERVO_FREQ = 50  # 50 Hz for standard servos
 SERVO_MIN_US = 500   # microseconds
 SERVO_MAX_US = 2400  # microseconds
 SERVO_DELAY_TIME_MS = 35  # Slightly faster for smoother movement
+PWM_FRAME_MS = 1000 // SERVO_FREQ  # 20 ms PWM frame; servos can't follow faster updates
+CONTROL_PERIOD_MS = PWM_FRAME_MS   # Motion engine tick, one per PWM frame
+TRAJECTORY_CACHE_ENTRIES = 16      # Compiled action trajectories kept in RAM
+TRAJECTORY_CACHE_BYTES = 8 * 1024  # Keyframe budget for the trajectory cache
+TRAJECTORY_HEAP_RESERVE = 32 * 1024  # Stop caching when free heap drops below this
+JOINT_MAX_VELOCITY = 180           # Default joint velocity limit, degrees/s
+JOINT_MAX_ACCEL = 600              # Default joint acceleration limit, degrees/s^2
+DEFAULT_PROFILE = 'trapezoid'      # Velocity profile for coordinated moves
+CHOREO_DIR = 'choreo'              # Choreography keyframe files on flash
+CHOREO_LOOKAHEAD = 2               # Keyframes queued ahead of playback
+
+# Joint pose persistence
+POSE_FILE = 'pose.json'
+POSE_SETTLE_MS = 5000              # Pose must be unchanged this long before saving
+POSE_SAVE_INTERVAL_MS = 60000      # At most one flash write per interval
+
+# Arm geometry for Cartesian moves (mm and servo degrees; measure on your robot)
+ARM_BASE_HEIGHT_MM = 60            # Shoulder axis above the table
+ARM_UPPER_MM = 80                  # Shoulder (arm_c) to elbow (arm_d)
+ARM_FORE_MM = 80                   # Elbow to gripper centre
+TURNTABLE_ZERO_DEG = 135           # Turntable angle facing +x
+SHOULDER_ZERO_DEG = 135            # arm_c angle with the upper arm horizontal
+ELBOW_ZERO_DEG = 135               # arm_d angle with the forearm in line with the upper arm
+IK_GRID_FILE = 'ik_grid.bin'       # Precomputed (r, z) -> (arm_c, arm_d) table
+IK_GRID_STEP_MM = 5
 
 # GPIO pin assignments
 ASERVO_PIN = 4  # Turntable - 270 Degrees movement (updated from 160)
@@ -87,19 +342,6 @@ CSERVO_PIN = 6  # 270 Degrees movement (corrected from 120)
 DSERVO_PIN = 7  # 270 Degrees Movement (corrected from 40)
 BEEP_PIN = 9    # Beeper GPIO control
 
-# Current positions of each servo (will be updated during operation)
-TURNTABLE_POSITION = 0    # Current turntable position (0-270° range)
-CLAW_POSITION = 0         # Current claw position (0-180° range)
-ARM_C_POSITION = 0        # Current arm C position (0-270° range)
-ARM_D_POSITION = 0        # Current arm D position (0-270° range)
-
-# Initialize servos
-servo_a = PWM(Pin(ASERVO_PIN), freq=SERVO_FREQ)
-servo_b = PWM(Pin(BSERVO_PIN), freq=SERVO_FREQ)
-servo_c = PWM(Pin(CSERVO_PIN), freq=SERVO_FREQ)
-servo_d = PWM(Pin(DSERVO_PIN), freq=SERVO_FREQ)
-
-
 # Servo angle to duty cycle converter for ESP32 PWM
 def angle_to_duty_ns(angle):
     """Convert angle (0-180) to duty cycle in nanoseconds (ns)"""
@@ -108,53 +350,672 @@ def angle_to_duty_ns(angle):
     pulse_width_us = SERVO_MIN_US + (angle / 180.0) * (SERVO_MAX_US - SERVO_MIN_US)
     return int(pulse_width_us * 1000)  # Convert us to ns for MicroPython's PWM.duty_ns()
 
+# Integer-only angle to duty path for the motion engine. The ESP32-C3 has no
+# FPU and every MicroPython float is a heap allocation, so joint angles are
+# carried as Q4 fixed point (1/16 degree) and converted with a per-joint Q8
+# scale. Intermediate products stay below 2**30 (MicroPython small ints) and
+# the result is within 10 ns of the float path, far below the ~1.2 us duty
+# resolution of the 14-bit LEDC timer at 50 Hz.
+FX_ANGLE_BITS = 4                                   # Q4: 1/16 degree per unit
+FX_ANGLE_ONE = 1 << FX_ANGLE_BITS
+DUTY_SHIFT = 8                                      # Duty scales are Q8
+DUTY_ROUND = 1 << (DUTY_SHIFT - 1)
+
+def duty_scale(span_ns, max_range):
+    """Q8 nanoseconds per Q4 degree for a joint's pulse span and range"""
+    units = max_range * FX_ANGLE_ONE
+    return ((span_ns << DUTY_SHIFT) + units // 2) // units
+
+
+# Servo board drivers
+#
+# A board hands out channel objects with the machine.PWM duty_ns() method, so
+# the scheduler writes every joint the same way whatever drives it.
+class GpioServoBoard:
+    """Servos wired straight to ESP32 GPIO pins, one LEDC PWM each"""
+
+    def channel(self, pin):
+        return PWM(Pin(pin), freq=SERVO_FREQ)
+
+
+class Pca9685Channel:
+    """One PCA9685 output with the PWM.duty_ns() interface"""
+
+    def __init__(self, board, channel):
+        self.board = board
+        self.register = 0x06 + 4 * channel   # LEDn_ON_L
+        self.buf = bytearray(4)              # ON=0, OFF=count, reused per write
+
+    def duty_ns(self, duty_ns):
+        # counts = duty_ns * 4096 / period_ns, kept within small ints
+        count = (duty_ns << 5) // self.board.period_div
+        self.buf[2] = count & 0xFF
+        self.buf[3] = count >> 8
+        self.board.i2c.writeto_mem(self.board.address, self.register, self.buf)
+
+
+class Pca9685ServoBoard:
+    """PCA9685 16-channel, 12-bit PWM expander on I2C"""
+
+    def __init__(self, sda=8, scl=10, address=0x40, i2c_id=0, osc_hz=25000000):
+        self.i2c = machine.I2C(i2c_id, sda=Pin(sda), scl=Pin(scl), freq=400000)
+        self.address = address
+        self.period_div = (1000000000 // SERVO_FREQ) >> 7
+        prescale = (osc_hz + 2048 * SERVO_FREQ) // (4096 * SERVO_FREQ) - 1
+        self.i2c.writeto_mem(address, 0x00, b'\x10')              # MODE1: sleep
+        self.i2c.writeto_mem(address, 0xFE, bytes([prescale]))    # PRE_SCALE
+        self.i2c.writeto_mem(address, 0x00, b'\x20')              # Wake, auto-increment
+        time.sleep_ms(1)                                          # Oscillator start-up
+
+    def channel(self, channel):
+        return Pca9685Channel(self, channel)
+
+
+class FakeServoChannel:
+    """Records duty writes instead of driving hardware"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.duty = None
+        self.writes = 0
+
+    def duty_ns(self, duty_ns=None):
+        if duty_ns is None:
+            return self.duty
+        self.duty = duty_ns
+        self.writes += 1
+
+
+class FakeServoBoard:
+    """Stand-in board for tests and dry runs without servos attached"""
+
+    def channel(self, channel):
+        return FakeServoChannel(channel)
+
+
+SERVO_DRIVERS = {
+    'gpio': GpioServoBoard,
+    'pca9685': Pca9685ServoBoard,
+    'fake': FakeServoBoard,
+}
+
+# Boards by name; "driver" selects a SERVO_DRIVERS entry and the remaining
+# keys are passed to it
+SERVO_BOARDS = {
+    'gpio': {'driver': 'gpio'},
+}
+
+# One row per joint. "board" names an entry in SERVO_BOARDS, "channel" is the
+# GPIO pin (gpio board) or output number (PCA9685), and min_us/max_us are the
+# pulse widths at 0° and at the end of the range. Two optional trailing
+# columns override the velocity (°/s) and acceleration (°/s²) limits used by
+# coordinated moves. A JOINTS_FILE on flash with
+# {"boards": {...}, "joints": [[...], ...]} replaces both tables, so joints
+# and boards can be added without editing code.
+JOINT_TABLE = [
+    # name,       board,  channel,    range, min_us,       max_us
+    ('turntable', 'gpio', ASERVO_PIN, 270,   SERVO_MIN_US, SERVO_MAX_US),
+    ('claw',      'gpio', BSERVO_PIN, 180,   SERVO_MIN_US, SERVO_MAX_US),
+    ('arm_c',     'gpio', CSERVO_PIN, 270,   SERVO_MIN_US, SERVO_MAX_US),
+    ('arm_d',     'gpio', DSERVO_PIN, 270,   SERVO_MIN_US, SERVO_MAX_US),
+]
+JOINTS_FILE = 'joints.json'
+
+
+class Joint:
+    """One servo joint: output channel, range, calibration and position"""
+
+    __slots__ = ('index', 'name', 'pwm', 'max_range', 'duty_min_ns', 'duty_span_ns',
+                 'duty_scale', 'max_velocity', 'max_accel', 'position')
+
+    def __init__(self, index, name, pwm, max_range, min_us, max_us,
+                 max_velocity=JOINT_MAX_VELOCITY, max_accel=JOINT_MAX_ACCEL):
+        self.index = index
+        self.name = name
+        self.pwm = pwm
+        self.max_range = max_range
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.duty_min_ns = min_us * 1000
+        self.duty_span_ns = (max_us - min_us) * 1000
+        self.duty_scale = duty_scale(self.duty_span_ns, max_range)
+        self.position = 0            # Tracked position in degrees
+
+    def angle_q_to_duty_ns(self, angle_q):
+        """Convert a Q4 joint angle to duty_ns using integer math only"""
+        return self.duty_min_ns + ((angle_q * self.duty_scale + DUTY_ROUND) >> DUTY_SHIFT)
+
+    def duty_ns_to_angle(self, duty_ns):
+        """Whole-degree joint angle for a duty value"""
+        return ((duty_ns - self.duty_min_ns) * self.max_range + self.duty_span_ns // 2) // self.duty_span_ns
+
+
+def make_joints(boards_config, rows):
+    """Create the boards and joints described by a boards dict and joint rows"""
+    boards = {}
+    for name in boards_config:
+        options = dict(boards_config[name])
+        boards[name] = SERVO_DRIVERS[options.pop('driver')](**options)
+    joints = []
+    for row in rows:
+        name, board, channel, max_range, min_us, max_us = row[:6]
+        joints.append(Joint(len(joints), name, boards[board].channel(channel), max_range,
+                            min_us, max_us, *row[6:]))
+    return joints
+
+def build_joints():
+    """
+    Create boards and joints from JOINTS_FILE, or the built-in tables
+
+    A missing file is normal; a malformed one is logged and ignored, so the
+    robot still comes up (and stays reachable) on the built-in wiring.
+    """
+    try:
+        with open(JOINTS_FILE) as f:
+            config = json.load(f)
+        joints = make_joints(config.get('boards', SERVO_BOARDS), config['joints'])
+        if LOG_INFO:
+            log(INFO, f'Loaded joint table from {JOINTS_FILE}')
+        return joints
+    except OSError:
+        pass
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        log(WARN, f'Ignoring bad {JOINTS_FILE}: {e}')
+    return make_joints(SERVO_BOARDS, JOINT_TABLE)
+
+
+# Initialize servos
+JOINTS = build_joints()
+JOINTS_BY_NAME = dict([(joint.name, joint) for joint in JOINTS])
+boot_phase('joints')
+
+# The preset actions address the four arm joints by their original names
+servo_a = JOINTS_BY_NAME['turntable']
+servo_b = JOINTS_BY_NAME['claw']
+servo_c = JOINTS_BY_NAME['arm_c']
+servo_d = JOINTS_BY_NAME['arm_d']
+
+def get_joint(ref):
+    """Look up a joint by Joint object, name or index; None if unknown"""
+    if isinstance(ref, Joint):
+        return ref
+    if isinstance(ref, str):
+        return JOINTS_BY_NAME.get(ref)
+    if isinstance(ref, int) and 0 <= ref < len(JOINTS):
+        return JOINTS[ref]
+    return None
+
+
+class PwmScheduler:
+    """Frame-aligned, deduplicating PWM writer.
+
+    Setpoints are collected with set() and written by flush() at most once
+    per PWM frame, and only for joints whose duty value actually changed.
+    State is kept in arrays indexed by joint index.
+    """
+
+    def __init__(self, joints):
+        self.joints = joints
+        self.pending = array('i', [-1] * len(joints))  # -1: nothing pending
+        self.written = array('i', [-1] * len(joints))  # Last duty_ns written
+        self.pending_count = 0
+        self.next_frame = None  # ticks_ms() of the next frame boundary
+        self.writes_issued = 0
+        self.writes_suppressed = 0
+
+    def set(self, joint, duty_ns):
+        """Record a setpoint; a newer one before the frame replaces it"""
+        index = joint.index
+        if self.pending[index] < 0:
+            self.pending_count += 1
+        else:
+            self.writes_suppressed += 1
+        self.pending[index] = duty_ns
+
+    def write(self, joint, duty_ns):
+        """Write a duty value now unless the PWM already has it"""
+        index = joint.index
+        if self.written[index] == duty_ns:
+            self.writes_suppressed += 1
+            return
+        joint.pwm.duty_ns(duty_ns)
+        self.written[index] = duty_ns
+        self.writes_issued += 1
+
+    def flush(self, now):
+        """Write pending setpoints if a PWM frame boundary has been reached"""
+        if not self.pending_count:
+            return
+        if self.next_frame is not None and time.ticks_diff(self.next_frame, now) > 0:
+            return
+        pending = self.pending
+        for index in range(len(pending)):
+            if pending[index] >= 0:
+                self.write(self.joints[index], pending[index])
+                pending[index] = -1
+        self.pending_count = 0
+        # Stay on the frame grid unless we fell a whole frame behind
+        if self.next_frame is None or time.ticks_diff(now, self.next_frame) >= PWM_FRAME_MS:
+            self.next_frame = now
+        self.next_frame = time.ticks_add(self.next_frame, PWM_FRAME_MS)
+
+    def stats(self):
+        """Write counters since boot"""
+        return {"writes_issued": self.writes_issued, "writes_suppressed": self.writes_suppressed}
+
+
+pwm_scheduler = PwmScheduler(JOINTS)
+joint_lock = _thread.allocate_lock()  # Guards joint positions and PWM writes from worker threads
+
+
 def set_servo_angle(servo, angle):
-    """Safely set servo angle with bounds checking"""
+    """Safely set servo angle (0-180 across the joint's range) right away"""
     try:
-        duty_ns = angle_to_duty_ns(angle)
-        servo.duty_ns(duty_ns)
+        angle = max(0, min(180, angle))
+        pwm_scheduler.write(servo, servo.angle_q_to_duty_ns(int(angle * servo.max_range * FX_ANGLE_ONE / 180)))
         return True
     except Exception as e:
-        print(f"Error setting servo angle: {e}")
+        log(ERROR, f"Error setting servo angle: {e}")
         return False
 
-def move(servo, degrees, direction="clockwise", speed=5):
+def speed_to_delay_ms(speed):
+    """Per-step delay for a speed setting (Speed 1=50ms, Speed 10=14ms)"""
+    base_delay = 50  # Base delay in ms
+    return max(10, int(base_delay - (speed - 1) * 4))  # Minimum 10ms delay
+
+def speed_to_velocity(speed):
+    """Joint velocity in degrees/s for a speed setting (one step per delay)"""
+    return speed * 1000 / speed_to_delay_ms(speed)
+
+
+# Velocity profiles
+#
+# A profile maps normalised time to normalised position. The shape is kept as
+# a Q14 lookup table so compiling a trajectory needs no float math, together
+# with the factors giving the shortest duration for a joint moving d degrees
+# under its limits: T = max(kv * d / v_max, sqrt(ka * d / a_max)).
+PROFILE_POINTS = 64
+PROFILE_BITS = 14
+TRAPEZOID_ACCEL_FRACTION = 0.25   # Share of the move spent accelerating, and decelerating
+
+def trapezoid_shape(t, f=TRAPEZOID_ACCEL_FRACTION):
+    """Constant acceleration, cruise, constant deceleration"""
+    if t < f:
+        return t * t / (2 * f * (1 - f))
+    if t > 1 - f:
+        return 1 - (1 - t) * (1 - t) / (2 * f * (1 - f))
+    return (t - f / 2) / (1 - f)
+
+def scurve_shape(t):
+    """Minimum-jerk quintic: zero velocity and acceleration at both ends"""
+    return t * t * t * (10 - 15 * t + 6 * t * t)
+
+def profile_table(shape):
+    """Sample a profile shape into a Q14 lookup table"""
+    one = 1 << PROFILE_BITS
+    return array('H', [int(shape(i / PROFILE_POINTS) * one + 0.5) for i in range(PROFILE_POINTS + 1)])
+
+PROFILES = {
+    # name: (table, kv, ka); linear has no table and ignores acceleration
+    'linear': (None, 1.0, 0.0),
+    'trapezoid': (profile_table(trapezoid_shape),
+                  1 / (1 - TRAPEZOID_ACCEL_FRACTION),
+                  1 / (TRAPEZOID_ACCEL_FRACTION * (1 - TRAPEZOID_ACCEL_FRACTION))),
+    'scurve': (profile_table(scurve_shape), 1.875, 5.7735),
+}
+
+
+class Trajectory:
+    """Compiled motion: per-joint duty_ns keyframes, one per PWM frame.
+
+    ``buffers`` holds one array('I') per joint in ``joints``; keyframe 0 is
+    the start and the last keyframe is the target. A trajectory without
+    joints is a pause of ``duration_ms``.
+    """
+
+    def __init__(self, joints, targets, buffers, duration_ms):
+        self.joints = joints
+        self.targets = targets
+        self.buffers = buffers
+        self.duration_ms = duration_ms
+        self.nbytes = sum([len(buf) * 4 for buf in buffers])
+
+
+def compile_trajectory(moves, profile=None):
+    """
+    Compile joint moves into a Trajectory
+
+    Args:
+        moves: List of tuples (joint, start, target, duration_ms); all
+            joints start together
+        profile: PROFILES name shaping each joint's motion; linear if None
+    """
+    table = PROFILES[profile][0] if profile else None
+    joints = []
+    targets = []
+    buffers = []
+    duration_ms = 0
+    for joint, start, target, move_ms in moves:
+        start_q = int(start * FX_ANGLE_ONE)
+        delta_q = int(target * FX_ANGLE_ONE) - start_q
+        frames = move_ms // PWM_FRAME_MS + (2 if move_ms % PWM_FRAME_MS else 1)
+        buf = array('I', range(frames))
+        for i in range(frames - 1):
+            t = i * PWM_FRAME_MS
+            if table is None:
+                buf[i] = joint.angle_q_to_duty_ns(start_q + delta_q * t // move_ms)
+                continue
+            # Interpolate the Q14 profile table at t / move_ms
+            x = t * PROFILE_POINTS
+            k = x // move_ms
+            progress = table[k] + (table[k + 1] - table[k]) * (x - k * move_ms) // move_ms
+            buf[i] = joint.angle_q_to_duty_ns(start_q + ((delta_q * progress) >> PROFILE_BITS))
+        buf[frames - 1] = joint.angle_q_to_duty_ns(start_q + delta_q)
+        joints.append(joint)
+        targets.append(target)
+        buffers.append(buf)
+        duration_ms = max(duration_ms, move_ms)
+    return Trajectory(joints, targets, buffers, duration_ms)
+
+
+class TrajectoryCache:
+    """Size-bounded LRU cache of compiled trajectories.
+
+    Entries are keyed by (action, starting positions). The cache holds at
+    most ``max_entries`` trajectories and ``max_bytes`` of keyframes, and
+    empties itself when the heap drops below TRAJECTORY_HEAP_RESERVE.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.order = []         # Keys, least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached trajectory for key, or None"""
+        trajectory = self.entries.get(key)
+        if trajectory is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.order[-1] != key:
+            self.order.remove(key)
+            self.order.append(key)
+        return trajectory
+
+    def put(self, key, trajectory):
+        """Insert a trajectory, evicting least recently used entries"""
+        if trajectory.nbytes > self.max_bytes // 2:
+            return  # Caching it would push out everything else
+        mem_free = getattr(gc, 'mem_free', None)  # MicroPython only
+        if mem_free and mem_free() < TRAJECTORY_HEAP_RESERVE:
+            self.clear()
+            return
+        while self.order and (len(self.order) >= self.max_entries or
+                              self.nbytes + trajectory.nbytes > self.max_bytes):
+            old = self.entries.pop(self.order.pop(0))
+            self.nbytes -= old.nbytes
+            self.evictions += 1
+        self.entries[key] = trajectory
+        self.order.append(key)
+        self.nbytes += trajectory.nbytes
+
+    def clear(self):
+        """Drop every cached trajectory"""
+        self.evictions += len(self.order)
+        self.entries = {}
+        self.order = []
+        self.nbytes = 0
+
+    def stats(self):
+        """Cache counters since boot"""
+        return {"entries": len(self.order), "bytes": self.nbytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+trajectory_cache = TrajectoryCache(TRAJECTORY_CACHE_ENTRIES, TRAJECTORY_CACHE_BYTES)
+
+
+class MotionEngine:
+    """Plays compiled trajectories from an async tick task at a fixed rate.
+
+    Callers enqueue trajectories and get control back immediately. Each tick
+    looks up the keyframe for the current PWM frame, derived from the time
+    elapsed since the trajectory started, so late ticks (prints, GC) never
+    stretch a motion and a tick does no math beyond an index.
+    """
+
+    def __init__(self):
+        self.segments = []      # Queued trajectories, oldest first
+        self.current = None     # Trajectory being played
+        self.started = 0        # ticks_ms() when the current one started
+        self.last_frame = -1    # Keyframe index at the previous tick
+        self.planned = {}       # joint -> position once the queue has drained
+        self.running = False    # True while run() is driving the engine
+        self.cancels = 0        # Times cancel() preempted motion
+        self.feeder = None      # ChoreographyPlayer topping up the queue
+        self.feed_error = None  # Why the last player was detached early, if it was
+        self.wake = asyncio.Event()
+        self.idle = asyncio.Event()  # Set by run() each time the queue drains
+
+    def planned_position(self, joint):
+        """Position a joint will be at after all queued segments"""
+        return self.planned.get(joint, joint.position)
+
+    def play(self, trajectory):
+        """Queue a compiled trajectory; returns its duration"""
+        for joint, target in zip(trajectory.joints, trajectory.targets):
+            self.planned[joint] = target
+        self.segments.append(trajectory)
+        self.wake.set()
+        return trajectory.duration_ms
+
+    def enqueue(self, moves):
+        """Compile and queue joint moves that start together"""
+        return self.play(compile_trajectory(moves))
+
+    def stream(self, player):
+        """Attach a choreography player that queues keyframes as playback needs them"""
+        if self.feeder is not None:
+            self.feeder.close()
+        self.feeder = player
+        self.feed_error = None
+        self.feed()
+        self.wake.set()
+
+    def feed(self):
+        """
+        Keep CHOREO_LOOKAHEAD segments queued while a player is attached
+
+        A bad line detaches the player and sets feed_error; motion already
+        queued still plays out, and the tick task keeps running.
+        """
+        while self.feeder is not None and len(self.segments) < CHOREO_LOOKAHEAD:
+            try:
+                more = self.feeder.feed()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.feed_error = f"Bad keyframe {self.feeder.keyframes + 1} in {self.feeder.name}: {e}"
+                log(ERROR, self.feed_error)
+                self.feeder.close()
+                more = False
+            if not more:
+                self.feeder = None
+
+    def dwell(self, duration_ms):
+        """Queue a pause between segments"""
+        self.segments.append(Trajectory((), (), (), duration_ms))
+        self.wake.set()
+
+    def remaining_ms(self):
+        """Time until every queued segment, and the rest of a streamed choreography, has finished"""
+        total = sum([trajectory.duration_ms for trajectory in self.segments])
+        if self.current is not None:
+            total += max(0, self.current.duration_ms - time.ticks_diff(time.ticks_ms(), self.started))
+        if self.feeder is not None:
+            total += self.feeder.unqueued_ms()
+        return total
+
+    def busy(self):
+        """True while a segment is executing or queued, teleop is streaming, or a write is pending"""
+        return (self.current is not None or bool(self.segments) or teleop.active
+                or self.feeder is not None or bool(pwm_scheduler.pending_count))
+
+    def cancel(self):
+        """Drop all queued motion and hold every joint where it is now"""
+        trajectory = self.current
+        if trajectory is not None and self.last_frame >= 0:
+            # Recover the angles of the last keyframe sent to each joint
+            for joint, buf in zip(trajectory.joints, trajectory.buffers):
+                joint.position = joint.duty_ns_to_angle(buf[min(self.last_frame, len(buf) - 1)])
+        if self.feeder is not None:
+            self.feeder.close()
+            self.feeder = None
+        self.segments = []
+        self.current = None
+        self.planned = {}
+        self.cancels += 1
+
+    def tick(self, now):
+        """Advance playback to time ``now`` (ticks_ms)"""
+        if teleop.active:
+            # Streamed setpoints own the joints until the dead-man timeout
+            teleop.step(now)
+            pwm_scheduler.flush(now)
+            teleop.send_ack(now)
+            return
+        trajectory = self.current
+        if trajectory is None:
+            if not self.segments:
+                pwm_scheduler.flush(now)
+                return
+            trajectory = self.current = self.segments.pop(0)
+            self.started = now
+            self.last_frame = -1
+
+        elapsed = time.ticks_diff(now, self.started)
+        frame = elapsed // PWM_FRAME_MS
+        last_frame = self.last_frame
+        if frame != last_frame:
+            joints = trajectory.joints
+            buffers = trajectory.buffers
+            for j in range(len(joints)):
+                buf = buffers[j]
+                last = len(buf) - 1
+                if last_frame >= last:
+                    continue  # Joint already reached its target on an earlier tick
+                pwm_scheduler.set(joints[j], buf[frame if frame < last else last])
+            self.last_frame = frame
+
+        if elapsed >= trajectory.duration_ms:
+            # A tick can land past the duration but before the final frame is
+            # due; the target still has to be written
+            joints = trajectory.joints
+            buffers = trajectory.buffers
+            for j in range(len(joints)):
+                buf = buffers[j]
+                if frame < len(buf) - 1:
+                    pwm_scheduler.set(joints[j], buf[-1])
+                joints[j].position = trajectory.targets[j]
+            self.current = None
+            if not self.segments:
+                self.planned = {}
+        pwm_scheduler.flush(now)
+
+    def run_until_idle(self):
+        """Drive the engine with blocking sleeps (REPL use, no event loop)"""
+        while self.busy():
+            self.tick(time.ticks_ms())
+            self.feed()
+            time.sleep_ms(CONTROL_PERIOD_MS)
+
+    async def wait_idle(self):
+        """Wait until every queued segment has finished"""
+        while self.busy():
+            if self.running:
+                # Woken on the tick that finishes the motion, not up to a period later
+                self.idle.clear()
+                await self.idle.wait()
+            else:
+                await async_sleep_ms(CONTROL_PERIOD_MS)
+
+    async def run(self):
+        """Tick task: advance playback every CONTROL_PERIOD_MS while busy"""
+        self.running = True
+        try:
+            while True:
+                if not self.busy():
+                    self.wake.clear()
+                    await self.wake.wait()
+                next_tick = time.ticks_ms()
+                metrics.last_tick_us = None  # Idle time is not a tick period
+                while self.busy():
+                    start_us = time.ticks_us()
+                    self.tick(time.ticks_ms())
+                    self.feed()  # Between ticks, so parsing never delays a PWM write
+                    metrics.tick(start_us, time.ticks_us())
+                    # Sleep until the next period boundary; if we fell behind,
+                    # resynchronise instead of bursting to catch up
+                    next_tick = time.ticks_add(next_tick, CONTROL_PERIOD_MS)
+                    delay = time.ticks_diff(next_tick, time.ticks_ms())
+                    if delay < 0:
+                        metrics.late(-delay)
+                        next_tick = time.ticks_ms()
+                        delay = 0
+                    await async_sleep_ms(delay)
+                self.idle.set()
+        finally:
+            self.running = False
+
+
+motion_engine = MotionEngine()
+
+
+def play_action(action, servos, plan, profile=None):
+    """
+    Queue the trajectory of a named action, compiling it only on a cache miss
+
+    The cache key is the action name plus the planned start positions of
+    ``servos``; ``plan`` returns the joint moves to compile on a miss, shaped
+    by ``profile``. Returns the trajectory duration in ms.
+    """
+    key = (action, tuple([motion_engine.planned_position(joint) for joint in servos]))
+    trajectory = trajectory_cache.get(key)
+    if trajectory is None:
+        trajectory = compile_trajectory(plan(), profile)
+        trajectory_cache.put(key, trajectory)
+    return motion_engine.play(trajectory)
+
+def move(servo, degrees, direction="clockwise", speed=5, action=None):
     """
     Move a servo by specified degrees in specified direction at specified speed
-    
+
+    The move is queued on the motion engine and this returns straight away
+    when the engine is running; from the REPL it blocks until done.
+
     Args:
-        servo: The servo object to move
-        degrees (int): Number of degrees to move (1-270)
+        servo: The joint to move (Joint, joint name or index)
+        degrees (int): Number of degrees to move (1 to the joint's range)
         direction (str): "clockwise" or "counterclockwise"
         speed (int): Speed from 1-10 (1=slowest, 10=fastest)
+        action (str): Optional action name; its compiled trajectory is cached
     """
-    # Declare global variables at the beginning
-    global TURNTABLE_POSITION, CLAW_POSITION, ARM_C_POSITION, ARM_D_POSITION
-    
-    # Validate inputs
-    degrees = max(1, min(270, degrees))  # Clamp to 1-270 degrees
-    speed = max(1, min(10, speed))       # Clamp to 1-10 speed
-    
-    # Determine which servo and get its current position
-    if servo == servo_a:
-        current_position = TURNTABLE_POSITION
-        max_range = 270
-        position_var = "TURNTABLE_POSITION"
-    elif servo == servo_b:
-        current_position = CLAW_POSITION
-        max_range = 180
-        position_var = "CLAW_POSITION"
-    elif servo == servo_c:
-        current_position = ARM_C_POSITION
-        max_range = 270
-        position_var = "ARM_C_POSITION"
-    elif servo == servo_d:
-        current_position = ARM_D_POSITION
-        max_range = 270
-        position_var = "ARM_D_POSITION"
-    else:
-        print("Invalid servo specified")
+    servo = get_joint(servo)
+    if servo is None:
+        log(WARN, "Invalid servo specified")
         return False
+
+    # Validate inputs
+    max_range = servo.max_range
+    degrees = max(1, min(max_range, degrees))  # Clamp to the joint's range
+    speed = max(1, min(10, speed))             # Clamp to 1-10 speed
+
+    # Moves are relative to where the previously queued motion ends
+    current_position = motion_engine.planned_position(servo)
     
     # Calculate target position
     if direction.lower() == "clockwise":
@@ -164,144 +1025,50 @@ def move(servo, degrees, direction="clockwise", speed=5):
         target_position = current_position - degrees
         direction_str = "counterclockwise"
     else:
-        print(f"Invalid direction: {direction}. Use 'clockwise' or 'counterclockwise'")
+        log(WARN, f"Invalid direction: {direction}. Use 'clockwise' or 'counterclockwise'")
         return False
     
     # Ensure target position is within valid range
     target_position = max(0, min(max_range, target_position))
+    if target_position == current_position:
+        coalesce_stats["noops"] += 1
+        if LOG_DEBUG:
+            log(DEBUG, f"Servo already at {target_position}°, nothing to do")
+        return True
     
-    # Calculate step size based on speed
-    # Speed 1 = 1 degree steps, Speed 10 = 10 degree steps
+    # Speed 1 = 1 degree steps, Speed 10 = 10 degree steps, one step per delay
     step_size = speed
-    total_steps = abs(target_position - current_position) / step_size
-    steps = max(1, int(total_steps))  # At least 1 step
-    
-    # Calculate delay based on speed (faster speed = shorter delay)
-    base_delay = 50  # Base delay in ms
-    speed_delay = base_delay - (speed - 1) * 4  # Speed 1=50ms, Speed 10=14ms
-    speed_delay = max(10, speed_delay)  # Minimum 10ms delay
-    
-    print(f"Moving servo {degrees}° {direction_str} at speed {speed}")
-    print(f"From {current_position}° to {target_position}° in {steps} steps")
-    
-    # Move servo in increments
-    for i in range(steps + 1):
-        # Calculate current angle based on step
-        if direction.lower() == "clockwise":
-            current_angle = current_position + (step_size * i)
-        else:
-            current_angle = current_position - (step_size * i)
-        
-        # Clamp to valid range
-        current_angle = max(0, min(max_range, current_angle))
-        
-        # Map the servo range to 0-180 for the duty cycle function
-        mapped_angle = (current_angle / max_range) * 180.0
-        
-        if set_servo_angle(servo, mapped_angle):
-            print(f"Step {i}/{steps}: {current_angle:.1f}°")
-        else:
-            print(f"Failed to set angle at step {i}")
-            return False
-        
-        # Delay based on speed
-        time.sleep_ms(speed_delay)
+    speed_delay = speed_to_delay_ms(speed)
+    duration_ms = int(abs(target_position - current_position) * speed_delay / step_size)
     
-    # Update the position variable
-    if servo == servo_a:
-        TURNTABLE_POSITION = target_position
-    elif servo == servo_b:
-        CLAW_POSITION = target_position
-    elif servo == servo_c:
-        ARM_C_POSITION = target_position
-    elif servo == servo_d:
-        ARM_D_POSITION = target_position
+    if LOG_DEBUG:
+        log(DEBUG, f"Moving servo {degrees}° {direction_str} at speed {speed}")
+        log(DEBUG, f"From {current_position}° to {target_position}° in {duration_ms}ms")
     
-    print(f"Servo movement completed! Final position: {target_position}°")
+    moves = [(servo, current_position, target_position, duration_ms)]
+    if action:
+        play_action(action, (servo,), lambda: moves)
+    else:
+        motion_engine.enqueue(moves)
+    if not motion_engine.running:
+        motion_engine.run_until_idle()
+        if LOG_DEBUG:
+            log(DEBUG, f"Servo movement completed! Final position: {target_position}°")
     return True
 
-def move_simultaneous(movements):
-    """
-    Move multiple servos simultaneously using threading
-    
-    Args:
-        movements: List of tuples (servo, degrees, direction, speed)
+def plan_movements(movements, delay_of=None):
     """
-    # Create threads for each movement
-    threads = []
-    
-    def move_thread(servo, degrees, direction, speed):
-        """Thread function for individual servo movement"""
-        move(servo, degrees, direction, speed)
-    
-    # Start all movements in separate threads
-    for servo, degrees, direction, speed in movements:
-        thread = _thread.start_new_thread(move_thread, (servo, degrees, direction, speed))
-        threads.append(thread)
-    
-    # Wait for all threads to complete
-    # Note: In MicroPython, we need to use a different approach for synchronization
-    # For now, we'll use a simple delay based on the longest movement
-    max_steps = 0
-    for servo, degrees, direction, speed in movements:
-        # Calculate steps for this movement
-        if servo == servo_a:
-            current_pos = TURNTABLE_POSITION
-            max_range = 270
-        elif servo == servo_b:
-            current_pos = CLAW_POSITION
-            max_range = 180
-        elif servo == servo_c:
-            current_pos = ARM_C_POSITION
-            max_range = 270
-        elif servo == servo_d:
-            current_pos = ARM_D_POSITION
-            max_range = 270
-        
-        if direction.lower() == "clockwise":
-            target_pos = current_pos + degrees
-        else:
-            target_pos = current_pos - degrees
-        
-        target_pos = max(0, min(max_range, target_pos))
-        steps = abs(target_pos - current_pos) / speed
-        max_steps = max(max_steps, steps)
-    
-    # Calculate total delay based on longest movement
-    base_delay = 50
-    speed_delay = base_delay - (speed - 1) * 4
-    speed_delay = max(10, speed_delay)
-    total_delay = int(max_steps * speed_delay)
-    
-    print(f"Waiting {total_delay}ms for all movements to complete...")
-    time.sleep_ms(total_delay)
-    
-    print("All simultaneous movements completed!")
+    Turn (servo, degrees, direction, speed) tuples into engine joint moves
 
-def move_simultaneous_simple(movements):
-    """
-    Alternative approach: Move servos in very small increments simultaneously
-    This provides smoother simultaneous movement without threading complexity
+    ``servo`` may be a Joint, joint name or index. Each joint moves ``speed``
+    degrees per step. ``delay_of`` gives the step delay for a movement; by
+    default every joint uses its own speed.
     """
-    # Declare global variables at the beginning
-    global TURNTABLE_POSITION, CLAW_POSITION, ARM_C_POSITION, ARM_D_POSITION
-    
-    # Validate and prepare movements
-    movement_data = []
+    moves = []
     for servo, degrees, direction, speed in movements:
-        # Get current position and calculate target
-        if servo == servo_a:
-            current_position = TURNTABLE_POSITION
-            max_range = 270
-        elif servo == servo_b:
-            current_position = CLAW_POSITION
-            max_range = 180
-        elif servo == servo_c:
-            current_position = ARM_C_POSITION
-            max_range = 270
-        elif servo == servo_d:
-            current_position = ARM_D_POSITION
-            max_range = 270
+        servo = get_joint(servo)
+        current_position = motion_engine.planned_position(servo)
+        max_range = servo.max_range
         
         if direction.lower() == "clockwise":
             target_position = current_position + degrees
@@ -310,86 +1077,450 @@ def move_simultaneous_simple(movements):
         
         target_position = max(0, min(max_range, target_position))
         
-        # Calculate step size and total steps
-        step_size = speed
-        total_steps = abs(target_position - current_position) / step_size
-        steps = max(1, int(total_steps))  # Ensure it's an integer
-        
-        movement_data.append({
-            'servo': servo,
-            'current': current_position,
-            'target': target_position,
-            'step_size': step_size,
-            'steps': steps,
-            'direction': direction,
-            'max_range': max_range
-        })
-    
-    # Find the maximum number of steps needed
-    max_steps = max([m['steps'] for m in movement_data])
-    max_steps = int(max_steps)  # Ensure it's an integer
-    
-    # Calculate delay based on speed (use average speed)
-    avg_speed = sum([m['step_size'] for m in movement_data]) / len(movement_data)
-    base_delay = 50
-    speed_delay = base_delay - (avg_speed - 1) * 4
-    speed_delay = max(10, int(speed_delay))  # Ensure it's an integer
-    
-    print(f"Moving {len(movements)} servos simultaneously for {max_steps} steps")
-    
-    # Move all servos in small increments simultaneously
-    for step in range(max_steps + 1):
-        for movement in movement_data:
-            if step <= movement['steps']:
-                # Calculate current angle for this step
-                if movement['direction'].lower() == "clockwise":
-                    current_angle = movement['current'] + (movement['step_size'] * step)
-                else:
-                    current_angle = movement['current'] - (movement['step_size'] * step)
-                
-                # Clamp to valid range
-                current_angle = max(0, min(movement['max_range'], current_angle))
-                
-                # Map to duty cycle
-                mapped_angle = (current_angle / movement['max_range']) * 180.0
-                
-                # Set servo position
-                set_servo_angle(movement['servo'], mapped_angle)
-        
-        # Small delay for smooth movement
-        time.sleep_ms(speed_delay)
-    
-    # Update position variables
-    for movement in movement_data:
-        if movement['servo'] == servo_a:
-            TURNTABLE_POSITION = movement['target']
-        elif movement['servo'] == servo_b:
-            CLAW_POSITION = movement['target']
-        elif movement['servo'] == servo_c:
-            ARM_C_POSITION = movement['target']
-        elif movement['servo'] == servo_d:
-            ARM_D_POSITION = movement['target']
-    
-    print("Simultaneous movement completed!")
+        step_delay = delay_of(speed) if delay_of else speed_to_delay_ms(speed)
+        duration_ms = int(abs(target_position - current_position) * step_delay / speed)
+        moves.append((servo, current_position, target_position, duration_ms))
+    return moves
 
-def turn_turntable_180_clockwise():
-    """Legacy function - moves turntable 180 degrees clockwise at speed 5"""
-    return move(servo_a, 180, "clockwise", 5)
+class CountdownLatch:
+    """Lets waiters block until count_down() has been called ``count`` times"""
 
-def get_current_positions():
-    """Get the current positions of all servos"""
-    print(f"Current positions:")
-    print(f"Turntable: {TURNTABLE_POSITION}°")
-    print(f"Claw: {CLAW_POSITION}°")
-    print(f"Arm C: {ARM_C_POSITION}°")
-    print(f"Arm D: {ARM_D_POSITION}°")
+    def __init__(self, count):
+        self.count = count
+        self.lock = _thread.allocate_lock()
+        self.done = _thread.allocate_lock()  # Held until the count reaches zero
+        if count > 0:
+            self.done.acquire()
 
-# Action Functions for Robot Commands
-# 
-# Flexible Message Format:
-# Send commands in any of these formats:
-# 1. JSON format: {"action": "command_name"}
-# 2. Simple format: action: command_name
+    def count_down(self):
+        with self.lock:
+            self.count -= 1
+            if self.count == 0:
+                self.done.release()
+
+    def wait(self):
+        """Block until the count reaches zero"""
+        with self.done:
+            pass
+
+
+class ThreadedMove:
+    """Plays a compiled trajectory with one worker thread per joint.
+
+    Workers share a start tick so they stay on the same PWM frame grid, hold
+    joint_lock around every PWM write and position update, and count down a
+    latch when they finish. wait() therefore returns as soon as the last
+    joint has written its final keyframe, or stopped after cancel().
+    """
+
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+        self.cancelled = False
+        self.started = 0
+        self.latch = CountdownLatch(len(trajectory.joints))
+
+    def start(self):
+        # Start one frame from now so every worker is up before frame 0
+        self.started = time.ticks_add(time.ticks_ms(), PWM_FRAME_MS)
+        for j in range(len(self.trajectory.joints)):
+            _thread.start_new_thread(self.worker, (j,))
+        return self
+
+    def worker(self, j):
+        joint = self.trajectory.joints[j]
+        buf = self.trajectory.buffers[j]
+        duty_ns = -1
+        try:
+            for frame in range(len(buf)):
+                delay = time.ticks_diff(time.ticks_add(self.started, frame * PWM_FRAME_MS), time.ticks_ms())
+                if delay > 0:
+                    time.sleep_ms(delay)
+                if self.cancelled:
+                    break
+                duty_ns = buf[frame]
+                with joint_lock:
+                    pwm_scheduler.write(joint, duty_ns)
+        finally:
+            with joint_lock:
+                if not self.cancelled:
+                    joint.position = self.trajectory.targets[j]
+                elif duty_ns >= 0:
+                    joint.position = joint.duty_ns_to_angle(duty_ns)
+            self.latch.count_down()
+
+    def wait(self):
+        """Block until every joint has finished or stopped"""
+        self.latch.wait()
+
+    def cancel(self):
+        """Stop every joint at its current keyframe and wait for the workers"""
+        self.cancelled = True
+        self.latch.wait()
+
+
+def move_simultaneous(movements, threaded=False, wait=True):
+    """
+    Move multiple servos simultaneously, each at its own speed
+    
+    All joints are queued as one motion engine segment, so they start on the
+    same tick and the engine tracks real completion.
+
+    With ``threaded`` set (REPL use, no event loop), each joint is driven by
+    its own worker thread instead and the ThreadedMove is returned; call its
+    wait() or cancel(), or pass ``wait=True`` to block until it completes.
+
+    Args:
+        movements: List of tuples (servo, degrees, direction, speed)
+    """
+    if threaded and not motion_engine.running:
+        motion_engine.run_until_idle()  # Threads start from a settled pose
+        threaded_move = ThreadedMove(compile_trajectory(plan_movements(movements))).start()
+        if LOG_DEBUG:
+            log(DEBUG, f"Moving {len(movements)} servos on threads for {threaded_move.trajectory.duration_ms}ms")
+        if wait:
+            threaded_move.wait()
+            if LOG_DEBUG:
+                log(DEBUG, "All simultaneous movements completed!")
+        return threaded_move
+
+    duration_ms = motion_engine.enqueue(plan_movements(movements))
+    if LOG_DEBUG:
+        log(DEBUG, f"Moving {len(movements)} servos simultaneously for {duration_ms}ms")
+    if not motion_engine.running:
+        motion_engine.run_until_idle()
+        if LOG_DEBUG:
+            log(DEBUG, "All simultaneous movements completed!")
+
+def move_duration_ms(joint, distance, profile=DEFAULT_PROFILE, speed=None):
+    """Shortest time for a joint to move ``distance`` degrees within its limits and ``speed``"""
+    table, kv, ka = PROFILES[profile]
+    velocity = joint.max_velocity
+    if speed:
+        velocity = min(velocity, speed_to_velocity(speed))
+    seconds = kv * distance / velocity
+    if ka:
+        seconds = max(seconds, math.sqrt(ka * distance / joint.max_accel))
+    return int(seconds * 1000 + 0.999)
+
+def plan_coordinated(targets, profile=DEFAULT_PROFILE, speed=None):
+    """
+    Plan a synchronised move of several joints to absolute targets
+
+    Every joint gets the same duration: the shortest one that keeps each
+    joint within its velocity and acceleration limits (and the velocity of
+    ``speed``, if given) under the chosen profile. So all joints start and
+    finish together.
+
+    Args:
+        targets: List of (joint, target_degrees) pairs
+        profile: 'trapezoid', 'scurve' or 'linear'
+        speed (int): Optional 1-10 speed setting capping joint velocity
+
+    Returns:
+        (moves, duration_ms) with moves ready for compile_trajectory()
+    """
+    duration_ms = 0
+    plan = []
+    for ref, target in targets:
+        joint = get_joint(ref)
+        start = motion_engine.planned_position(joint)
+        target = max(0, min(joint.max_range, target))
+        distance = abs(target - start)
+        if not distance:
+            continue  # Already there; nothing to compile
+        duration_ms = max(duration_ms, move_duration_ms(joint, distance, profile, speed))
+        plan.append((joint, start, target))
+    return [(joint, start, target, duration_ms) for joint, start, target in plan], duration_ms
+
+def move_coordinated(targets, profile=DEFAULT_PROFILE, speed=None, action=None):
+    """
+    Move several joints to absolute targets so they all finish together
+
+    Returns the planned duration in ms as soon as the move is queued (from
+    the REPL, after it has run). See plan_coordinated() for the arguments;
+    with ``action`` set, the compiled trajectory is cached per start pose.
+    """
+    moves, duration_ms = plan_coordinated(targets, profile, speed)
+    if not moves:
+        coalesce_stats["noops"] += 1
+        if LOG_DEBUG:
+            log(DEBUG, "All joints already at their targets")
+        return 0
+    plan = lambda: moves
+    if action:
+        duration_ms = play_action(action, [get_joint(target[0]) for target in targets], plan, profile)
+    else:
+        duration_ms = motion_engine.play(compile_trajectory(plan(), profile))
+    if LOG_DEBUG:
+        log(DEBUG, f"Moving {len(targets)} servos in sync ({profile}) for {duration_ms}ms")
+    if not motion_engine.running:
+        motion_engine.run_until_idle()
+        if LOG_DEBUG:
+            log(DEBUG, "Coordinated movement completed!")
+    return duration_ms
+
+def move_simultaneous_simple(movements, action=None):
+    """
+    Move servos simultaneously with a synchronised, smooth velocity profile
+
+    Relative movements are turned into absolute targets and run through
+    move_coordinated(), capped at the velocity of the average speed, so all
+    joints ramp up and down together instead of stopping abruptly one by one.
+    With ``action`` set, the compiled trajectory is cached per start pose.
+    Returns the planned duration in ms.
+    """
+    avg_speed = sum([speed for servo, degrees, direction, speed in movements]) / len(movements)
+    targets = []
+    for servo, degrees, direction, speed in movements:
+        joint = get_joint(servo)
+        if direction.lower() == "clockwise":
+            targets.append((joint, motion_engine.planned_position(joint) + degrees))
+        else:
+            targets.append((joint, motion_engine.planned_position(joint) - degrees))
+    return move_coordinated(targets, DEFAULT_PROFILE, avg_speed, action)
+
+def benchmark_duty_paths(steps=1000, joint='turntable'):
+    """
+    Compare the float and fixed-point angle to duty paths per motion step
+
+    Sweeps one joint across its full range in ``steps`` steps with each path
+    and reports microseconds and heap bytes per step, plus the largest
+    difference between the two results. Run it from the REPL on the device.
+    """
+    mem_alloc = getattr(gc, 'mem_alloc', None)  # MicroPython only
+    joint = get_joint(joint)
+    max_range = joint.max_range
+    duty_min_ns = joint.duty_min_ns
+    full_q = max_range * FX_ANGLE_ONE
+
+    # Float path: the original per-step mapping through angle_to_duty_ns()
+    gc.collect()
+    alloc_start = mem_alloc() if mem_alloc else 0
+    start = time.ticks_us()
+    for i in range(steps + 1):
+        current_angle = max_range * i // steps
+        angle_to_duty_ns((current_angle / max_range) * 180.0)
+    float_us = time.ticks_diff(time.ticks_us(), start)
+    float_bytes = mem_alloc() - alloc_start if mem_alloc else 0
+
+    # Fixed-point path: the same mapping through a call, so both paths pay
+    # the same call overhead and only the arithmetic differs
+    angle_q_to_duty_ns = joint.angle_q_to_duty_ns
+    gc.collect()
+    alloc_start = mem_alloc() if mem_alloc else 0
+    start = time.ticks_us()
+    for i in range(steps + 1):
+        angle_q_to_duty_ns(full_q * i // steps)
+    fixed_us = time.ticks_diff(time.ticks_us(), start)
+    fixed_bytes = mem_alloc() - alloc_start if mem_alloc else 0
+
+    max_error_ns = 0
+    for angle_q in range(full_q + 1):
+        reference = int(duty_min_ns + angle_q * joint.duty_span_ns / full_q)
+        max_error_ns = max(max_error_ns, abs(joint.angle_q_to_duty_ns(angle_q) - reference))
+
+    result = {
+        "steps": steps + 1,
+        "float_us_per_step": float_us / (steps + 1),
+        "fixed_us_per_step": fixed_us / (steps + 1),
+        "float_bytes_per_step": float_bytes / (steps + 1),
+        "fixed_bytes_per_step": fixed_bytes / (steps + 1),
+        "max_error_ns": max_error_ns,
+    }
+    print("Duty path benchmark:", result)
+    return result
+
+# Cartesian moves. The arm is a turntable plus a planar two-link arm: arm_c
+# raises the upper arm and arm_d bends the forearm, both upward as their
+# angle decreases (as in move_arms_up). Solving that live means several
+# trig calls in soft floating point on the C3, so solve_arm() is tabulated
+# once over the (reach, height) plane into IK_GRID_FILE, and a move only
+# interpolates the four surrounding cells.
+IK_HEADER = '<4sHHhH'  # magic, reach cells, height cells, lowest height, step
+IK_MAGIC = b'IKG1'
+IK_MAX_CELL_SPREAD = 30 * FX_ANGLE_ONE  # Larger jumps between neighbouring cells mean a branch switch
+
+def solve_arm(r, z):
+    """Exact IK for the planar arm: (arm_c, arm_d) angles in degrees, or None if out of reach"""
+    dz = z - ARM_BASE_HEIGHT_MM
+    cos_elbow = (r * r + dz * dz - ARM_UPPER_MM * ARM_UPPER_MM - ARM_FORE_MM * ARM_FORE_MM) / (2 * ARM_UPPER_MM * ARM_FORE_MM)
+    if not -1 <= cos_elbow <= 1:
+        return None
+    arm_c_range = JOINTS_BY_NAME['arm_c'].max_range
+    arm_d_range = JOINTS_BY_NAME['arm_d'].max_range
+    for sign in (1, -1):  # Prefer one elbow branch so neighbouring cells agree
+        elbow = sign * math.acos(cos_elbow)
+        shoulder = math.atan2(dz, r) - math.atan2(ARM_FORE_MM * math.sin(elbow), ARM_UPPER_MM + ARM_FORE_MM * math.cos(elbow))
+        arm_c = SHOULDER_ZERO_DEG - math.degrees(shoulder)
+        arm_d = ELBOW_ZERO_DEG - math.degrees(elbow)
+        if 0 <= arm_c <= arm_c_range and 0 <= arm_d <= arm_d_range:
+            return arm_c, arm_d
+    return None
+
+def forward_kinematics(turntable, arm_c, arm_d):
+    """Gripper (x, y, z) in mm for joint angles in degrees"""
+    yaw = math.radians(turntable - TURNTABLE_ZERO_DEG)
+    shoulder = math.radians(SHOULDER_ZERO_DEG - arm_c)
+    elbow = shoulder + math.radians(ELBOW_ZERO_DEG - arm_d)
+    r = ARM_UPPER_MM * math.cos(shoulder) + ARM_FORE_MM * math.cos(elbow)
+    z = ARM_BASE_HEIGHT_MM + ARM_UPPER_MM * math.sin(shoulder) + ARM_FORE_MM * math.sin(elbow)
+    return r * math.cos(yaw), r * math.sin(yaw), z
+
+def build_ik_grid(path=IK_GRID_FILE, step=IK_GRID_STEP_MM):
+    """
+    Tabulate solve_arm() and write it to flash
+
+    Each cell holds (arm_c, arm_d) as int16 Q4 angles, -1 where the point is
+    out of reach. Thousands of soft-float trig solves take seconds on the
+    C3, so this runs on a host (python -m sim ikgrid) and the file is copied
+    to the robot; the robot never builds it.
+    """
+    reach = ARM_UPPER_MM + ARM_FORE_MM
+    nr = reach // step + 1
+    nz = 2 * reach // step + 1
+    z0 = ARM_BASE_HEIGHT_MM - reach
+    cells = array('h', [-1]) * (nr * nz * 2)
+    for i in range(nr):
+        for k in range(nz):
+            solution = solve_arm(i * step, z0 + k * step)
+            if solution is not None:
+                cell = (i * nz + k) * 2
+                cells[cell] = int(solution[0] * FX_ANGLE_ONE + 0.5)
+                cells[cell + 1] = int(solution[1] * FX_ANGLE_ONE + 0.5)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(struct.pack(IK_HEADER, IK_MAGIC, nr, nz, z0, step))
+        f.write(cells)
+    os.rename(tmp_file, path)
+    print(f"IK grid written: {nr}x{nz} cells, {len(cells) * 2} bytes")
+
+
+class IkGrid:
+    """The (reach, height) -> (arm_c, arm_d) table, bilinearly interpolated"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(struct.calcsize(IK_HEADER))
+            magic, self.nr, self.nz, self.z0, self.step = struct.unpack(IK_HEADER, header)
+            if magic != IK_MAGIC:
+                raise ValueError('Not an IK grid: ' + path)
+            self.cells = array('h', [0]) * (self.nr * self.nz * 2)
+            f.readinto(self.cells)
+
+    def solve(self, r, z):
+        """(arm_c, arm_d) in degrees for a reach and height in mm, or None if out of reach"""
+        fr = r / self.step
+        fz = (z - self.z0) / self.step
+        i = math.floor(fr)  # Not int(): below the grid that would round up into it
+        k = math.floor(fz)
+        if not (0 <= i < self.nr - 1 and 0 <= k < self.nz - 1):
+            return None
+        fr -= i
+        fz -= k
+        cells = self.cells
+        angles = []
+        for j in (0, 1):
+            c00 = cells[(i * self.nz + k) * 2 + j]
+            c01 = cells[(i * self.nz + k + 1) * 2 + j]
+            c10 = cells[((i + 1) * self.nz + k) * 2 + j]
+            c11 = cells[((i + 1) * self.nz + k + 1) * 2 + j]
+            if c00 < 0 or c01 < 0 or c10 < 0 or c11 < 0:
+                return None  # Too close to the edge of the workspace to interpolate
+            if max(c00, c01, c10, c11) - min(c00, c01, c10, c11) > IK_MAX_CELL_SPREAD:
+                # The cells straddle a switch of elbow branch, where blending
+                # the two would be meaningless: use the nearest cell instead
+                c = cells[((i + (fr >= 0.5)) * self.nz + k + (fz >= 0.5)) * 2 + j]
+                angles.append(c / FX_ANGLE_ONE)
+                continue
+            near = c00 + (c01 - c00) * fz
+            far = c10 + (c11 - c10) * fz
+            angles.append((near + (far - near) * fr) / FX_ANGLE_ONE)
+        return angles[0], angles[1]
+
+
+ik_grid = None  # Loaded on the first Cartesian move
+
+def get_ik_grid():
+    """The IK grid from flash, or None if IK_GRID_FILE is missing or not a grid"""
+    global ik_grid
+    if ik_grid is None:
+        try:
+            ik_grid = IkGrid(IK_GRID_FILE)
+        except (OSError, ValueError) as e:
+            log(WARN, f'No usable IK grid: {e}')
+    return ik_grid
+
+def xyz_to_joints(x, y, z):
+    """Joint angles that put the gripper at (x, y, z) mm, or None if unreachable (or no grid)"""
+    turntable = TURNTABLE_ZERO_DEG + math.degrees(math.atan2(y, x))
+    if not 0 <= turntable <= JOINTS_BY_NAME['turntable'].max_range:
+        return None
+    grid = get_ik_grid()
+    if grid is None:
+        return None
+    arm = grid.solve(math.sqrt(x * x + y * y), z)
+    if arm is None:
+        return None
+    return {"turntable": turntable, "arm_c": arm[0], "arm_d": arm[1]}
+
+def move_to(joints=None, xyz=None, speed=None, profile=DEFAULT_PROFILE):
+    """
+    Move to an absolute pose in one synchronised move
+
+    Args:
+        joints: Dict of joint name -> absolute angle in degrees; joints left
+            out stay where they are
+        xyz: (x, y, z) gripper position in mm, solved through the IK grid
+        speed (int): Optional 1-10 speed cap
+        profile: Velocity profile, as for move_coordinated()
+
+    Returns a result dict with the joint targets and planned duration.
+    """
+    targets = {}
+    if xyz is not None:
+        if get_ik_grid() is None:
+            return {"status": "error",
+                    "message": f"No IK grid on the robot; build {IK_GRID_FILE} with 'python -m sim ikgrid' and upload it"}
+        solution = xyz_to_joints(*xyz)
+        if solution is None:
+            return {"status": "error", "message": f"Position {list(xyz)} is out of reach"}
+        targets.update(solution)
+    if joints:
+        targets.update(joints)
+    if not targets:
+        return {"status": "error", "message": "move_to needs joints or xyz"}
+    moves = []
+    for name, angle in targets.items():
+        joint = get_joint(name)
+        if joint is None:
+            return {"status": "error", "message": f"Unknown joint: {name}"}
+        targets[name] = int(angle + 0.5)
+        moves.append((joint, targets[name]))
+    duration_ms = move_coordinated(moves, profile, speed)
+    return {"status": "success", "action": "move_to", "message": "Moving to pose",
+            "targets": targets, "duration_ms": duration_ms}
+
+def move_to_command(options):
+    """move_to from a JSON message, e.g. {"action": "move_to", "xyz": [120, 0, 80]}"""
+    return move_to(options.get("joints"), options.get("xyz"), options.get("speed"),
+                   options.get("profile", DEFAULT_PROFILE))
+
+def turn_turntable_180_clockwise():
+    """Legacy function - moves turntable 180 degrees clockwise at speed 5"""
+    return move(servo_a, 180, "clockwise", 5)
+
+def get_current_positions():
+    """Get the current positions of all servos"""
+    print(f"Current positions:")
+    for joint in JOINTS:
+        print(f"{joint.name}: {joint.position}°")
+
+# Action Functions for Robot Commands
+# 
+# Flexible Message Format:
+# Send commands in any of these formats:
+# 1. JSON format: {"action": "command_name"}
+# 2. Simple format: action: command_name
 # 3. Assignment format: action=command_name  
 # 4. Direct command: command_name
 #
@@ -402,6 +1533,8 @@ def get_current_positions():
 # - turn_table_right: Turns turntable right (clockwise)
 # - move_arms_up: Moves both arms up
 # - move_arms_down: Moves both arms down
+# - home: Moves every joint back to 0°
+# - calibrate: Takes the current pose as 0° for every joint
 # - dance: Executes the full dance sequence
 #
 # Examples:
@@ -410,76 +1543,93 @@ def get_current_positions():
 # action=open_claw
 # open_claw
 #
+# Joint moves of the preset actions as (joint, degrees), clockwise positive.
+# The motion task folds runs of these on the same joints into one net move
+# (see coalesce()).
+PRESET_MOVES = {
+    'extend_gripper': (('arm_c', 45), ('arm_d', 45)),        # Arms C and D extend outward
+    'retract_gripper': (('arm_c', -45), ('arm_d', -45)),     # Arms C and D retract inward
+    'open_claw': (('claw', 90),),                            # Open claw 90 degrees
+    'close_claw': (('claw', -90),),                          # Close claw 90 degrees
+    'turn_table_left': (('turntable', -45),),                # Turn left 45 degrees
+    'turn_table_right': (('turntable', 45),),                # Turn right 45 degrees
+    'move_arms_up': (('arm_c', -30), ('arm_d', -30)),        # Arms C and D move up
+    'move_arms_down': (('arm_c', 30), ('arm_d', 30)),        # Arms C and D move down
+}
+PRESET_JOINTS = {action: tuple(name for name, _ in moves) for action, moves in PRESET_MOVES.items()}
+PRESET_SPEED = 3
+
+def preset_movements(action):
+    """(servo, degrees, direction, speed) movements of a preset action"""
+    return [(JOINTS_BY_NAME[name], abs(degrees), "clockwise" if degrees > 0 else "counterclockwise", PRESET_SPEED)
+            for name, degrees in PRESET_MOVES[action]]
+
 def extend_gripper():
     """Extend the gripper by moving arm C and D outward"""
-    print("Extending gripper...")
-    movements = [
-        (servo_c, 45, "clockwise", 3),      # Arm C extends outward
-        (servo_d, 45, "clockwise", 3)       # Arm D extends outward
-    ]
-    move_simultaneous_simple(movements)
+    if LOG_DEBUG:
+        log(DEBUG, "Extending gripper...")
+    move_simultaneous_simple(preset_movements("extend_gripper"), action="extend_gripper")
     return {"status": "success", "action": "extend_gripper", "message": "Gripper extended"}
 
 def retract_gripper():
     """Retract the gripper by moving arm C and D inward"""
-    print("Retracting gripper...")
-    movements = [
-        (servo_c, 45, "counterclockwise", 3),  # Arm C retracts inward
-        (servo_d, 45, "counterclockwise", 3)   # Arm D retracts inward
-    ]
-    move_simultaneous_simple(movements)
+    if LOG_DEBUG:
+        log(DEBUG, "Retracting gripper...")
+    move_simultaneous_simple(preset_movements("retract_gripper"), action="retract_gripper")
     return {"status": "success", "action": "retract_gripper", "message": "Gripper retracted"}
 
 def open_claw():
     """Open the claw by moving servo B to open position"""
-    print("Opening claw...")
-    move(servo_b, 90, "clockwise", 3)  # Open claw 90 degrees
+    if LOG_DEBUG:
+        log(DEBUG, "Opening claw...")
+    move(*preset_movements("open_claw")[0], action="open_claw")
     return {"status": "success", "action": "open_claw", "message": "Claw opened"}
 
 def close_claw():
     """Close the claw by moving servo B to closed position"""
-    print("Closing claw...")
-    move(servo_b, 90, "counterclockwise", 3)  # Close claw 90 degrees
+    if LOG_DEBUG:
+        log(DEBUG, "Closing claw...")
+    move(*preset_movements("close_claw")[0], action="close_claw")
     return {"status": "success", "action": "close_claw", "message": "Claw closed"}
 
 def turn_table_left():
     """Turn the turntable left (counterclockwise)"""
-    print("Turning table left...")
-    move(servo_a, 45, "counterclockwise", 3)  # Turn left 45 degrees
+    if LOG_DEBUG:
+        log(DEBUG, "Turning table left...")
+    move(*preset_movements("turn_table_left")[0], action="turn_table_left")
     return {"status": "success", "action": "turn_table_left", "message": "Table turned left"}
 
 def turn_table_right():
     """Turn the turntable right (clockwise)"""
-    print("Turning table right...")
-    move(servo_a, 45, "clockwise", 3)  # Turn right 45 degrees
+    if LOG_DEBUG:
+        log(DEBUG, "Turning table right...")
+    move(*preset_movements("turn_table_right")[0], action="turn_table_right")
     return {"status": "success", "action": "turn_table_right", "message": "Table turned right"}
 
 def move_arms_up():
     """Move both arms up simultaneously"""
-    print("Moving arms up...")
-    movements = [
-        (servo_c, 30, "counterclockwise", 3),  # Arm C moves up
-        (servo_d, 30, "counterclockwise", 3)   # Arm D moves up
-    ]
-    move_simultaneous_simple(movements)
+    if LOG_DEBUG:
+        log(DEBUG, "Moving arms up...")
+    move_simultaneous_simple(preset_movements("move_arms_up"), action="move_arms_up")
     return {"status": "success", "action": "move_arms_up", "message": "Arms moved up"}
 
 def move_arms_down():
     """Move both arms down simultaneously"""
-    print("Moving arms down...")
-    movements = [
-        (servo_c, 30, "clockwise", 3),      # Arm C moves down
-        (servo_d, 30, "clockwise", 3)       # Arm D moves down
-    ]
-    move_simultaneous_simple(movements)
+    if LOG_DEBUG:
+        log(DEBUG, "Moving arms down...")
+    move_simultaneous_simple(preset_movements("move_arms_down"), action="move_arms_down")
     return {"status": "success", "action": "move_arms_down", "message": "Arms moved down"}
 
 def extract_action_from_message(message):
     """Extract action from message using regex patterns"""
+    # Bare command names skip the regexes (and their allocations) entirely
+    if message in ACTIONS:
+        return message
     try:
         # Clean the message
         message_clean = message.lower().strip()
-        print(f"Extracting action from: {repr(message_clean)}")
+        if LOG_DEBUG:
+            log(DEBUG, f"Extracting action from: {repr(message_clean)}")
         
         # Define regex patterns for different message formats
         patterns = [
@@ -495,341 +1645,1684 @@ def extract_action_from_message(message):
             match = re.search(pattern, message_clean)
             if match:
                 action = match.group(1).strip()
-                print(f"Found action: '{action}' using pattern: {pattern}")
+                if LOG_DEBUG:
+                    log(DEBUG, f"Found action: '{action}' using pattern: {pattern}")
                 return action
         
         # If no pattern matches, return None
-        print("No action found in message")
+        if LOG_DEBUG:
+            log(DEBUG, "No action found in message")
         return None
         
     except Exception as e:
-        print(f"Error extracting action: {e}")
+        log(WARN, f"Error extracting action: {e}")
         return None
 
 def process_command(message):
     """Process message and execute corresponding action"""
     try:
+        if message.startswith('play '):
+            return play(message[5:].strip())
+
         # Extract action from message
         action = extract_action_from_message(message)
         
         if not action:
             return {"status": "error", "message": "No valid action found in message"}
         
-        print(f"Processing action: {action}")
-        
-        # Map actions to functions
-        action_map = {
-            'extend_gripper': extend_gripper,
-            'retract_gripper': retract_gripper,
-            'open_claw': open_claw,
-            'close_claw': close_claw,
-            'turn_table_left': turn_table_left,
-            'turn_table_right': turn_table_right,
-            'move_arms_up': move_arms_up,
-            'move_arms_down': move_arms_down,
-            'dance': lambda: {"status": "success", "action": "dance", "message": "Dance completed"}
-        }
+        if LOG_INFO:
+            log(INFO, f"Processing action: {action}")
         
         # Execute the action if it exists
-        if action in action_map:
-            if action == 'dance':
-                print("Executing dance movement...")
-                dance_movement()
-                result = {"status": "success", "action": "dance", "message": "Dance completed"}
-            else:
-                result = action_map[action]()
-            print(f"Action '{action}' completed successfully")
+        if action in ACTIONS:
+            result = ACTIONS[action]()
+            if LOG_DEBUG:
+                log(DEBUG, f"Action '{action}' completed successfully")
             return result
+        elif action in PARAM_ACTIONS:
+            # Actions with arguments take them from the JSON message
+            return PARAM_ACTIONS[action](json.loads(message))
         else:
-            available_actions = ", ".join(action_map.keys())
+            available_actions = ", ".join(ACTION_NAMES + tuple(PARAM_ACTIONS))
             error_msg = f"Unknown action: {action}. Available actions: {available_actions}"
-            print(error_msg)
+            log(WARN, error_msg)
             return {"status": "error", "message": error_msg}
             
     except Exception as e:
         error_msg = f"Error processing command: {str(e)}"
-        print(error_msg)
+        log(ERROR, error_msg)
         return {"status": "error", "message": error_msg}
 
 def dance_movement():
-    """Create a dance pattern using all four servos with TRUE simultaneous movements"""
-    print("Starting full robot dance with simultaneous movements! 🤖💃")
-    
-    # Dance sequence 1: Multi-directional wave (TRULY simultaneous)
-    print("Dance 1: Multi-directional wave (simultaneous)")
-    # Move servos in different directions simultaneously
-    movements = [
-        (servo_a, 40, "clockwise", 2),      # Turntable clockwise
-        (servo_b, 45, "counterclockwise", 2),  # Claw counterclockwise
-        (servo_c, 90, "clockwise", 2),      # Arm C clockwise
-        (servo_d, 90, "counterclockwise", 2)   # Arm D counterclockwise
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Reverse all directions simultaneously
-    movements = [
-        (servo_a, 40, "counterclockwise", 2),  # Turntable counterclockwise
-        (servo_b, 45, "clockwise", 2),      # Claw clockwise
-        (servo_c, 90, "counterclockwise", 2),  # Arm C counterclockwise
-        (servo_d, 90, "clockwise", 2)       # Arm D clockwise
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Dance sequence 2: Cross-pattern movements (simultaneous)
-    print("Dance 2: Cross-pattern movements (simultaneous)")
-    # Create crossing pattern with arms
-    movements = [
-        (servo_a, 60, "clockwise", 2),      # Turntable clockwise
-        (servo_b, 60, "clockwise", 2),      # Claw clockwise
-        (servo_c, 120, "counterclockwise", 2),  # Arm C counterclockwise
-        (servo_d, 120, "clockwise", 2)       # Arm D clockwise
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Reverse the cross pattern
-    movements = [
-        (servo_a, 60, "counterclockwise", 2),  # Turntable counterclockwise
-        (servo_b, 60, "counterclockwise", 2),  # Claw counterclockwise
-        (servo_c, 120, "clockwise", 2),      # Arm C clockwise
-        (servo_d, 120, "counterclockwise", 2)   # Arm D counterclockwise
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Dance sequence 3: Dynamic claw and arm coordination (simultaneous)
-    print("Dance 3: Dynamic claw and arm coordination (simultaneous)")
-    for i in range(3):
-        # All servos move in different directions simultaneously
-        movements = [
-            (servo_b, 90, "clockwise", 2),      # Claw open
-            (servo_c, 60, "clockwise", 2),      # Arm C up
-            (servo_d, 60, "counterclockwise", 2)   # Arm D down
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(300)
-        
-        # Reverse all directions simultaneously
-        movements = [
-            (servo_b, 90, "counterclockwise", 2),  # Claw close
-            (servo_c, 60, "counterclockwise", 2),  # Arm C down
-            (servo_d, 60, "clockwise", 2)       # Arm D up
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(300)
-    
-    # Dance sequence 4: Spiral pattern demonstration (simultaneous)
-    print("Dance 4: Spiral pattern demonstration (simultaneous)")
-    # Create spiral-like movement with all servos
-    movements = [
-        (servo_a, 80, "clockwise", 2),      # Turntable (80° from start)
-        (servo_b, 180, "clockwise", 2),     # Claw full range
-        (servo_c, 270, "clockwise", 2),     # Arm C full range
-        (servo_d, 270, "counterclockwise", 2)   # Arm D full range (opposite direction)
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Reverse spiral pattern
-    movements = [
-        (servo_a, 80, "counterclockwise", 2),   # Turntable back
-        (servo_b, 180, "counterclockwise", 2),  # Claw back
-        (servo_c, 270, "counterclockwise", 2),  # Arm C back
-        (servo_d, 270, "clockwise", 2)       # Arm D back
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    # Dance sequence 5: Synchronized multi-directional movements (simultaneous)
-    print("Dance 5: Synchronized multi-directional movements (simultaneous)")
-    for i in range(3):
-        # All servos move in different directions with small movements
-        movements = [
-            (servo_a, 15, "clockwise", 2),      # Small turntable movement
-            (servo_b, 20, "counterclockwise", 2),  # Claw opposite direction
-            (servo_c, 30, "clockwise", 2),      # Arm C clockwise
-            (servo_d, 30, "counterclockwise", 2)   # Arm D counterclockwise
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(300)
-        
-        # Reverse all directions
-        movements = [
-            (servo_a, 15, "counterclockwise", 2),  # Turntable back
-            (servo_b, 20, "clockwise", 2),      # Claw back
-            (servo_c, 30, "counterclockwise", 2),  # Arm C back
-            (servo_d, 30, "clockwise", 2)       # Arm D back
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(300)
-    
-    # Dance sequence 6: Wave pattern with alternating directions (simultaneous)
-    print("Dance 6: Wave pattern with alternating directions (simultaneous)")
-    # Create wave-like pattern with alternating directions
-    for i in range(2):
-        # First wave
-        movements = [
-            (servo_a, 30, "clockwise", 2),      # Turntable
-            (servo_b, 30, "counterclockwise", 2),  # Claw opposite
-            (servo_c, 45, "clockwise", 2),      # Arm C
-            (servo_d, 45, "counterclockwise", 2)   # Arm D opposite
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(400)
-        
-        # Second wave (different pattern)
-        movements = [
-            (servo_a, 30, "counterclockwise", 2),  # Turntable opposite
-            (servo_b, 30, "clockwise", 2),      # Claw
-            (servo_c, 45, "counterclockwise", 2),  # Arm C opposite
-            (servo_d, 45, "clockwise", 2)       # Arm D
-        ]
-        move_simultaneous_simple(movements)
-        time.sleep_ms(400)
-    
-    # Return all to starting positions smoothly (simultaneous)
-    print("Returning all servos to starting positions (simultaneous)")
-    movements = [
-        (servo_a, 0, "counterclockwise", 2),    # Turntable to starting position
-        (servo_b, 0, "counterclockwise", 2),    # Claw to starting position
-        (servo_c, 0, "counterclockwise", 2),    # Arm C to starting position
-        (servo_d, 0, "counterclockwise", 2)     # Arm D to starting position
-    ]
-    move_simultaneous_simple(movements)
-    time.sleep_ms(500)
-    
-    print("Full robot dance with TRUE simultaneous movements completed! 🎉🤖")
+    """Play the dance choreography (choreo/dance.jsonl)"""
+    if LOG_INFO:
+        log(INFO, "Starting full robot dance with simultaneous movements! 🤖💃")
+    result = play("dance")
+    if result["status"] != "success":
+        raise OSError(result["message"])
+
+
+# Choreographies: JSON-lines keyframe files in CHOREO_DIR, one keyframe per
+# line ({"move": ...}, {"to": ...}, {"wait": ms} or {"say": text}; see
+# choreo_tool.py). The player reads one line at a time as the motion engine
+# runs low, so memory use does not grow with the routine's length.
+CHOREO_NAME = re.compile('^[a-z0-9_]+$')
+
+def keyframe_targets(keyframe, position_of):
+    """
+    The (joint, target) pairs of a "move" or "to" keyframe, with relative
+    moves added to ``position_of(joint)``; ValueError for an unknown joint
+    """
+    relative = "move" in keyframe
+    targets = []
+    for name, degrees in (keyframe["move"] if relative else keyframe["to"]).items():
+        joint = JOINTS_BY_NAME.get(name)
+        if joint is None:
+            raise ValueError(f"Unknown joint {name}")
+        targets.append((joint, position_of(joint) + degrees if relative else degrees))
+    return targets
+
+def play_keyframe(keyframe):
+    """Queue one choreography keyframe on the motion engine; returns its duration"""
+    if "wait" in keyframe:
+        duration_ms = int(keyframe["wait"])
+        motion_engine.dwell(duration_ms)
+        return duration_ms
+    if "say" in keyframe:
+        if LOG_INFO:
+            log(INFO, keyframe["say"])
+        return 0
+    targets = keyframe_targets(keyframe, motion_engine.planned_position)
+    profile = keyframe.get("profile", DEFAULT_PROFILE)
+    moves, duration_ms = plan_coordinated(targets, profile, keyframe.get("speed"))
+    if moves:
+        motion_engine.play(compile_trajectory(moves, profile))
+    return duration_ms
+
+
+class ChoreographyPlayer:
+    """Streams a keyframe file into the motion engine, one line at a time"""
+
+    def __init__(self, name):
+        self.name = name
+        self.file = open(f"{CHOREO_DIR}/{name}.jsonl")
+        self.keyframes = 0          # Keyframes queued so far
+        self.total_keyframes = 0    # Set by scan()
+        self.total_ms = 0           # Whole routine, set by scan()
+        self.queued_ms = 0          # Time of the keyframes queued so far
+
+    def next_keyframe(self):
+        """Parse the next keyframe line; None at the end of the file"""
+        while True:
+            line = self.file.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if line and line[0] != '#':
+                return json.loads(line)
+
+    def scan(self):
+        """
+        Check every keyframe and total the routine's duration before any of it plays
+
+        Raises ValueError, KeyError or TypeError at the first bad line. Joint
+        positions are followed through the file as playback will move them,
+        so relative moves add up as they will on the robot.
+        """
+        positions = {}
+        position_of = lambda joint: positions.get(joint, motion_engine.planned_position(joint))
+        count = total_ms = 0
+        while True:
+            keyframe = self.next_keyframe()
+            if keyframe is None:
+                break
+            count += 1
+            if "wait" in keyframe:
+                total_ms += int(keyframe["wait"])
+                continue
+            if "say" in keyframe:
+                continue
+            profile = keyframe.get("profile", DEFAULT_PROFILE)
+            duration_ms = 0
+            for joint, target in keyframe_targets(keyframe, position_of):
+                target = max(0, min(joint.max_range, target))
+                distance = abs(target - position_of(joint))
+                if distance:
+                    duration_ms = max(duration_ms, move_duration_ms(joint, distance, profile, keyframe.get("speed")))
+                positions[joint] = target
+            total_ms += duration_ms
+        self.file.seek(0)
+        self.total_keyframes = count
+        self.total_ms = total_ms
+
+    def feed(self):
+        """Queue the next keyframe; False (and the file closed) at the end"""
+        keyframe = self.next_keyframe()
+        if keyframe is None:
+            self.close()
+            return False
+        self.queued_ms += play_keyframe(keyframe)
+        self.keyframes += 1
+        return True
+
+    def unqueued_ms(self):
+        """Time of the keyframes not queued yet"""
+        return max(0, self.total_ms - self.queued_ms)
+
+    def close(self):
+        self.file.close()
+
+
+def play(name):
+    """
+    Start playing a choreography by name; returns once it is streaming
+
+    The whole file is checked first, so a bad line fails the command before
+    anything moves. From the REPL this blocks until the routine has finished.
+    """
+    if not name or not CHOREO_NAME.match(name):
+        return {"status": "error", "message": f"Invalid choreography name: {name}"}
+    try:
+        player = ChoreographyPlayer(name)
+    except OSError:
+        return {"status": "error", "message": f"No choreography named {name}"}
+    try:
+        player.scan()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        player.close()
+        log(ERROR, f"Bad choreography {name}: {e}")
+        return {"status": "error", "message": f"Bad choreography {name}: {e}"}
+    motion_engine.stream(player)
+    if not motion_engine.running:
+        motion_engine.run_until_idle()
+    error = motion_engine.feed_error
+    if error is not None:
+        motion_engine.feed_error = None
+        return {"status": "error", "message": error}
+    return {"status": "success", "action": "play", "message": f"Playing {name}"}
+
+def play_command(options):
+    """play from a JSON message, e.g. {"action": "play", "name": "dance"}"""
+    return play(options.get("name"))
 
 # Initialize servos without forcing movement
 def initialize_servos():
     """Initialize servos without forcing movement - use current positions as 0"""
-    print("Initializing servos - using current positions as starting points...")
+    if LOG_INFO:
+        log(INFO, "Initializing servos - using current positions as starting points...")
     
-    # Set all position variables to 0 (current servo positions become 0)
-    global TURNTABLE_POSITION, CLAW_POSITION, ARM_C_POSITION, ARM_D_POSITION
-    TURNTABLE_POSITION = 0
-    CLAW_POSITION = 0
-    ARM_C_POSITION = 0
-    ARM_D_POSITION = 0
+    # Set all positions to 0 (current servo positions become 0)
+    for joint in JOINTS:
+        joint.position = 0
     
     # Don't move servos - just set their current positions as 0
-    print("Servos initialized! Current positions set as 0° for all servos")
-    print("Turntable: 0°, Claw: 0°, Arm C: 0°, Arm D: 0°")
+    if LOG_INFO:
+        log(INFO, "Servos initialized! Current positions set as 0° for all servos")
 
 
-def start_command_server():
-    """Start a socket server to listen for robot commands in multiple formats"""
+# Joint pose persistence
+#
+# The tracked pose lives in the joint table between commands and is
+# mirrored to POSE_FILE, keyed by joint name, so it survives a reboot. Flash
+# writes are batched: the pose must have settled for POSE_SETTLE_MS, must
+# differ from what is on flash, and writes are at least POSE_SAVE_INTERVAL_MS
+# apart.
+
+saved_pose = None          # Pose tuple last written to flash
+pose_changed_at = None     # ticks_ms() when the pose last changed
+pose_saved_at = None       # ticks_ms() of the last flash write
+pose_writes = 0
+
+def current_pose():
+    """Tracked positions as a tuple in joint order"""
+    return tuple([joint.position for joint in JOINTS])
+
+def load_pose():
+    """Restore the tracked pose saved by a previous boot, if any"""
+    global saved_pose
     try:
-        addr = socket.getaddrinfo('0.0.0.0', PORT)[0][-1]
-        server_socket = socket.socket()
-        server_socket.bind(addr)
-        server_socket.listen(1)
-        
-        print('Robot command server listening on port', PORT)
-        print('Send robot commands to this device on port', PORT)
-        
+        with open(POSE_FILE) as f:
+            pose = json.load(f)
+        for joint in JOINTS:
+            # Joints added since the pose was saved start at 0°
+            joint.position = max(0, min(joint.max_range, pose.get(joint.name, 0)))
+        saved_pose = current_pose()
+        if LOG_INFO:
+            log(INFO, f'Restored pose: {pose}')
+        return True
+    except OSError:
+        if LOG_INFO:
+            log(INFO, 'No saved pose, using 0° for all servos')
+    except (ValueError, TypeError, AttributeError) as e:
+        log(WARN, f'Ignoring corrupt pose file: {e}')
+    return False
+
+def save_pose():
+    """Write the tracked pose to flash (write-then-rename, so never torn)"""
+    global saved_pose, pose_saved_at, pose_writes
+    pose = current_pose()
+    tmp_file = POSE_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(dict([(joint.name, joint.position) for joint in JOINTS]), f)
+    os.rename(tmp_file, POSE_FILE)
+    saved_pose = pose
+    pose_saved_at = time.ticks_ms()
+    pose_writes += 1
+
+def maybe_save_pose():
+    """Save the pose if it settled, changed, and the write budget allows"""
+    global pose_changed_at
+    if motion_engine.busy():
+        pose_changed_at = None
+        return False
+    pose = current_pose()
+    if pose == saved_pose:
+        pose_changed_at = None
+        return False
+    now = time.ticks_ms()
+    if pose_changed_at is None:
+        pose_changed_at = now
+    if time.ticks_diff(now, pose_changed_at) < POSE_SETTLE_MS:
+        return False
+    if pose_saved_at is not None and time.ticks_diff(now, pose_saved_at) < POSE_SAVE_INTERVAL_MS:
+        return False
+    try:
+        save_pose()
+        pose_changed_at = None
+        return True
+    except OSError as e:
+        log(WARN, f'Failed to save pose: {e}')
+        return False
+
+async def pose_saver():
+    """Background task that batches pose writes to flash"""
+    while True:
+        maybe_save_pose()
+        await async_sleep_ms(1000)
+
+def home():
+    """Move every joint back to its 0° position"""
+    if LOG_INFO:
+        log(INFO, "Homing all servos...")
+    movements = [(servo, motion_engine.planned_position(servo), "counterclockwise", 3)
+                 for servo in JOINTS]
+    move_simultaneous(movements)
+    return {"status": "success", "action": "home", "message": "All servos homed"}
+
+def calibrate():
+    """Take the current physical pose as 0° for every joint and persist it"""
+    motion_engine.cancel()
+    initialize_servos()
+    try:
+        save_pose()
+    except OSError as e:
+        log(WARN, f'Failed to save pose: {e}')
+    return {"status": "success", "action": "calibrate", "message": "Current pose set as 0° for all servos"}
+
+
+def halt():
+    """Preempt the current motion; joints hold where the last keyframe left them"""
+    teleop.stop()
+    motion_engine.cancel()
+
+def stop():
+    """Stop at once: halt the current motion and drop every queued command"""
+    dropped = command_queue.clear("Stopped")
+    halt()
+    return {"status": "success", "action": "stop", "message": f"Stopped, {dropped} queued commands dropped"}
+
+def hold():
+    """Halt the current motion where it is; queued commands still run"""
+    halt()
+    return {"status": "success", "action": "hold", "message": "Holding position"}
+
+
+def dance():
+    """Dance command: run the full dance routine"""
+    if LOG_DEBUG:
+        log(DEBUG, "Executing dance movement...")
+    dance_movement()
+    return {"status": "success", "action": "dance", "message": "Dance completed"}
+
+
+# Command name -> action function, built once at import. The tuple fixes the
+# order, which is also the action id used by binary ACTION frames.
+ACTION_NAMES = (
+    'extend_gripper', 'retract_gripper', 'open_claw', 'close_claw',
+    'turn_table_left', 'turn_table_right', 'move_arms_up', 'move_arms_down',
+    'dance', 'home', 'calibrate', 'stop', 'hold',
+)
+ACTIONS = {
+    'extend_gripper': extend_gripper,
+    'retract_gripper': retract_gripper,
+    'open_claw': open_claw,
+    'close_claw': close_claw,
+    'turn_table_left': turn_table_left,
+    'turn_table_right': turn_table_right,
+    'move_arms_up': move_arms_up,
+    'move_arms_down': move_arms_down,
+    'dance': dance,
+    'home': home,
+    'calibrate': calibrate,
+    'stop': stop,
+    'hold': hold,
+}
+PARAM_ACTIONS = {'move_to': move_to_command, 'play': play_command}
+PREEMPT_ACTIONS = ('stop', 'hold')  # Run straight from the connection handler, never queued
+
+
+# Binary command frames, for high-rate teleoperation. Little endian:
+#   magic (u8), opcode (u8), duration_ms (u16), one int16 per joint in JOINTS order
+# MOVE takes absolute target angles (negative leaves a joint where it is) and
+# never runs faster than the joint limits allow; ACTION runs ACTION_NAMES[first
+# target]; STOP drops all queued motion. The magic byte can never start UTF-8
+# text, so both protocols share the port.
+BINARY_MAGIC = 0xA5
+OP_MOVE = 1
+OP_ACTION = 2
+OP_STOP = 3
+BINARY_FORMAT = '<BBH' + 'h' * len(JOINTS)
+BINARY_FRAME_SIZE = struct.calcsize(BINARY_FORMAT)
+BINARY_REPLY_FORMAT = '<BBH'  # magic, status (0 ok, 1 error), duration_ms
+binary_reply = bytearray(struct.calcsize(BINARY_REPLY_FORMAT))
+
+def pack_binary_command(opcode, targets=(), duration_ms=0, buf=None):
+    """Build a binary frame; unset joints get -1 (hold)"""
+    values = list(targets) + [-1] * (len(JOINTS) - len(targets))
+    if buf is None:
+        buf = bytearray(BINARY_FRAME_SIZE)
+    struct.pack_into(BINARY_FORMAT, buf, 0, BINARY_MAGIC, opcode, duration_ms, *values)
+    return buf
+
+def binary_move(duration_ms, targets):
+    """MOVE frame: synchronised move to absolute angles"""
+    moves, min_ms = plan_coordinated([(JOINTS[i], targets[i]) for i in range(len(JOINTS)) if targets[i] >= 0])
+    if moves:
+        duration_ms = max(duration_ms, min_ms)
+        moves = [(joint, start, target, duration_ms) for joint, start, target, _ in moves]
+        motion_engine.play(compile_trajectory(moves, DEFAULT_PROFILE))
+    return {"status": "success", "action": "move", "message": "Moving"}
+
+def binary_action(duration_ms, targets):
+    """ACTION frame: run a named action by its id"""
+    if not 0 <= targets[0] < len(ACTION_NAMES):
+        return {"status": "error", "message": f"Unknown action id: {targets[0]}"}
+    return ACTIONS[ACTION_NAMES[targets[0]]]()
+
+def binary_stop(duration_ms, targets):
+    """STOP frame: same as the stop command"""
+    return stop()
+
+BINARY_OPCODES = {OP_MOVE: binary_move, OP_ACTION: binary_action, OP_STOP: binary_stop}
+
+def binary_preempts(frame):
+    """True for a STOP frame, or an ACTION frame naming one of PREEMPT_ACTIONS"""
+    handler, duration_ms, targets = frame
+    if handler is binary_stop:
+        return True
+    return (handler is binary_action and 0 <= targets[0] < len(ACTION_NAMES)
+            and ACTION_NAMES[targets[0]] in PREEMPT_ACTIONS)
+
+def parse_binary_command(buf, nbytes=None):
+    """
+    Decode a binary frame in place with struct.unpack_from
+
+    ``nbytes`` is how much of ``buf`` holds received data (default: all).
+    Returns (handler, duration_ms, targets), or None if it is not a complete
+    frame with a known opcode.
+    """
+    if nbytes is None:
+        nbytes = len(buf)
+    if nbytes < BINARY_FRAME_SIZE or buf[0] != BINARY_MAGIC:
+        return None
+    fields = struct.unpack_from(BINARY_FORMAT, buf)
+    handler = BINARY_OPCODES.get(fields[1])
+    if handler is None:
+        return None
+    return handler, fields[2], fields[3:]
+
+def benchmark_command_parsing(iterations=1000):
+    """
+    Compare the cost of turning a message into an action for both protocols
+
+    The text path is extract_action_from_message() (its regex matching) plus
+    the ACTIONS lookup, as a JSON request is handled today. Its debug records
+    cost nothing unless LOG_DEBUG is compiled in, so the result covers parsing
+    only. The binary path is parse_binary_command() on a preallocated frame.
+    Reports microseconds and heap bytes per message. Run it from the REPL on
+    the device.
+    """
+    mem_alloc = getattr(gc, 'mem_alloc', None)  # MicroPython only
+    text = '{"action": "move_arms_up"}'
+    frame = pack_binary_command(OP_MOVE, [90, 45, 120, 30], 200)
+
+    gc.collect()
+    alloc_start = mem_alloc() if mem_alloc else 0
+    start = time.ticks_us()
+    for _ in range(iterations):
+        ACTIONS.get(extract_action_from_message(text))
+    text_us = time.ticks_diff(time.ticks_us(), start)
+    text_bytes = mem_alloc() - alloc_start if mem_alloc else 0
+
+    gc.collect()
+    alloc_start = mem_alloc() if mem_alloc else 0
+    start = time.ticks_us()
+    for _ in range(iterations):
+        parse_binary_command(frame)
+    binary_us = time.ticks_diff(time.ticks_us(), start)
+    binary_bytes = mem_alloc() - alloc_start if mem_alloc else 0
+
+    result = {
+        "iterations": iterations,
+        "text_us_per_message": text_us / iterations,
+        "binary_us_per_message": binary_us / iterations,
+        "text_bytes_per_message": text_bytes / iterations,
+        "binary_bytes_per_message": binary_bytes / iterations,
+    }
+    print("Command parsing benchmark:", result)
+    return result
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL, 'low': PRIORITY_LOW}
+
+
+class CommandQueue:
+    """Bounded priority queue between connection handlers and the motion task.
+
+    uasyncio has no Queue, so this is one FIFO list per priority plus an
+    Event that the motion task waits on while they are all empty. Higher
+    priorities are served first; within a priority, in arrival order.
+    """
+
+    def __init__(self, maxsize):
+        self.levels = ([], [], [])  # Indexed by priority
+        self.count = 0
+        self.maxsize = maxsize
+        self.ready = asyncio.Event()
+        self.depth_max = 0
+        self.served = 0
+        self.dropped = 0
+        self.wait_total_ms = 0
+        self.wait_max_ms = 0
+
+    def put_nowait(self, item, priority=PRIORITY_NORMAL):
+        """Add an item, returning False if the queue is full"""
+        if self.count >= self.maxsize:
+            return False
+        item.queued_at = time.ticks_ms()
+        item.queued_us = time.ticks_us()
+        self.levels[priority].append(item)
+        self.count += 1
+        self.depth_max = max(self.depth_max, self.count)
+        self.ready.set()
+        return True
+
+    async def get(self):
+        """Wait for and remove the oldest item of the highest priority"""
+        while not self.count:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.get_nowait()
+
+    def peek(self):
+        """The item get() would return next, or None if the queue is empty"""
+        for level in self.levels:
+            if level:
+                return level[0]
+        return None
+
+    def get_nowait(self):
+        """Remove and return the next item; the queue must not be empty"""
+        for level in self.levels:
+            if level:
+                item = level.pop(0)
+                break
+        self.count -= 1
+        wait_ms = time.ticks_diff(time.ticks_ms(), item.queued_at)
+        self.served += 1
+        self.wait_total_ms += wait_ms
+        self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+        return item
+
+    def clear(self, reason):
+        """Drop every queued item, finishing each with an error; returns how many"""
+        dropped = 0
+        for level in self.levels:
+            for item in level:
+                item.state = 'cancelled'
+                item.result = {"status": "error", "message": reason}
+                if item.id:
+                    item.result["job_id"] = item.id
+                dropped += 1
+            del level[:]
+        self.count = 0
+        self.dropped += dropped
+        return dropped
+
+    def stats(self):
+        """Depth and wait-time counters since boot"""
+        return {
+            "depth": self.count,
+            "depth_max": self.depth_max,
+            "served": self.served,
+            "dropped": self.dropped,
+            "wait_ms_mean": self.wait_total_ms // self.served if self.served else 0,
+            "wait_ms_max": self.wait_max_ms,
+        }
+
+
+coalesce_stats = {"coalesced": 0, "noops": 0, "moves_saved": 0}
+
+def preset_action(command):
+    """The PRESET_MOVES action a queued text command asks for, else None"""
+    if command.frame is not None:
+        return None
+    action = extract_action_from_message(command.message)
+    return action if action in PRESET_MOVES else None
+
+def coalesce(command, queue):
+    """
+    Take queued preset commands that directly follow ``command``
+
+    Returns [(command, action), ...] starting with ``command``. A run of
+    preset actions on the same joints is folded into one move to the net
+    target, so repeated or cancelling commands (left then right, open then
+    close) cost one motion, or none. The run ends at the first command on
+    other joints: folding open_claw, extend_gripper, close_claw would skip the
+    grasp. A single command comes back alone and runs unchanged.
+    """
+    action = preset_action(command)
+    group = [(command, action)]
+    if action is None or command.timed:
+        return group  # Timed commands report their own start and finish
+    joints = PRESET_JOINTS[action]
+    while True:
+        following = queue.peek()
+        if following is None:
+            return group
+        action = preset_action(following)
+        if action is None or following.timed or PRESET_JOINTS[action] != joints:
+            return group
+        queue.get_nowait()
+        following.state = 'running'
+        group.append((following, action))
+
+def run_coalesced(group):
+    """Run a group from coalesce() as one synchronised move to the net target"""
+    positions = {}
+    for command, action in group:
+        # Clamp after every step, as running the commands one by one would
+        for name, degrees in PRESET_MOVES[action]:
+            joint = JOINTS_BY_NAME[name]
+            position = positions.get(joint, motion_engine.planned_position(joint))
+            positions[joint] = max(0, min(joint.max_range, position + degrees))
+    duration_ms = move_coordinated(list(positions.items()), DEFAULT_PROFILE, PRESET_SPEED)
+    coalesce_stats["coalesced"] += len(group) - 1
+    coalesce_stats["moves_saved"] += len(group) - (1 if duration_ms else 0)
+    return {"status": "success", "action": group[0][1],
+            "message": f"Coalesced {len(group)} commands into {'one move' if duration_ms else 'no motion'}",
+            "coalesced": len(group)}
+
+
+class PendingCommand:
+    """A parsed message waiting for the motion task to execute it.
+
+    Text commands double as jobs: they get an id and a state that clients can
+    poll or watch while the motion task works through them.
+    """
+
+    def __init__(self, message, frame=None, job_id=0):
+        self.message = message
+        self.frame = frame  # (handler, duration_ms, targets) for binary commands
+        self.id = job_id
+        self.state = 'queued'   # queued, running, done, error or cancelled
+        self.queued_at = 0      # ticks_ms() when it entered the queue
+        self.queued_us = 0      # Same in ticks_us(), for the latency metrics
+        self.action = None      # Action name once executed, for the latency metrics
+        self.start_at = None    # ticks_ms() to start at, for synchronised fleet starts
+        self.timed = False      # Report started_at/finished_at (ticks_ms) in the result
+        self.segments = 0       # Motion segments the command planned
+        self.duration_ms = 0    # Planned motion time
+        self.result = None
+
+    def snapshot(self):
+        """Job status: state, progress through its segments, ETA and joint positions"""
+        status = {"status": "success", "job_id": self.id, "command": self.message, "state": self.state}
+        if self.state == 'running':
+            left = len(motion_engine.segments) + (motion_engine.current is not None)
+            eta_ms = motion_engine.remaining_ms()
+            status["segment"] = max(1, min(self.segments, self.segments - left + 1))
+            status["segments"] = self.segments
+            if motion_engine.feeder is not None:
+                # Streaming a choreography: segments only cover what is queued so far
+                status["keyframe"] = motion_engine.feeder.keyframes
+                status["keyframes"] = motion_engine.feeder.total_keyframes
+            status["eta_ms"] = eta_ms
+            progress = 1 - eta_ms / self.duration_ms if self.duration_ms else 0
+            status["progress"] = max(0, min(1, progress))
+            positions = {}
+            for joint in JOINTS:
+                duty_ns = pwm_scheduler.written[joint.index]
+                positions[joint.name] = joint.duty_ns_to_angle(duty_ns) if duty_ns >= 0 else joint.position
+            status["positions"] = positions
+        elif self.result is not None:
+            status["result"] = self.result
+        return status
+
+
+class JobTable:
+    """Recent text commands by job id, for status polling and progress streams"""
+
+    def __init__(self, queue, history):
+        self.queue = queue
+        self.history = history
+        self.jobs = {}
+        self.order = []     # Job ids, oldest first
+        self.next_id = 1
+
+    def submit(self, message, priority=PRIORITY_NORMAL, replace=False, start_at=None, timed=False):
+        """
+        Queue a text command as a new job; None if the queue is full
+
+        With ``replace`` set, commands still waiting in the queue are dropped
+        first, so the new one runs as soon as the current motion ends. With
+        ``start_at`` (a ticks_ms() value) it does not start before then.
+        """
+        if replace:
+            self.queue.clear("Replaced by a newer command")
+        job = PendingCommand(message, None, self.next_id)
+        job.start_at = start_at
+        job.timed = timed or start_at is not None
+        if not self.queue.put_nowait(job, priority):
+            return None
+        self.next_id += 1
+        self.jobs[job.id] = job
+        self.order.append(job.id)
+        # Forget the oldest jobs, but never one still waiting or running
+        while len(self.order) > self.history and self.jobs[self.order[0]].result is not None:
+            del self.jobs[self.order.pop(0)]
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+
+async def motion_task(queue):
+    """Execute queued commands one at a time, in arrival order.
+
+    Actions only queue segments on the motion engine, so each command is
+    planned instantly and this task then waits for the engine to finish it
+    before publishing the result.
+    """
+    while True:
+        command = await queue.get()
+        if command.start_at is not None:
+            # Synchronised start: hold the motion task until the agreed tick
+            cancels = motion_engine.cancels
+            while motion_engine.cancels == cancels:
+                delay = time.ticks_diff(command.start_at, time.ticks_ms())
+                if delay <= 0:
+                    break
+                await async_sleep_ms(min(delay, MOTION_POLL_MS))  # Short naps, so stop is noticed
+            if motion_engine.cancels != cancels:
+                command.state = 'cancelled'
+                command.result = {"status": "error", "message": "Preempted by stop/hold", "job_id": command.id}
+                continue
+        command.state = 'running'
+        started_ms = time.ticks_ms()
+        started_us = time.ticks_us()
+        planned_us = idle_us = None
+        group = coalesce(command, queue)
+        try:
+            # Process the command using regex pattern matching; moves are
+            # relative to the pose left by the previous command
+            if len(group) > 1:
+                result = run_coalesced(group)
+            elif command.frame is not None:
+                handler, duration_ms, targets = command.frame
+                result = handler(duration_ms, targets)
+            else:
+                result = process_command(command.message)
+            planned_us = time.ticks_us()
+            command.segments = len(motion_engine.segments) + (motion_engine.current is not None)
+            command.duration_ms = motion_engine.remaining_ms()
+            if result.get("status") == "success":
+                result["duration_ms"] = command.duration_ms
+            cancels = motion_engine.cancels
+            await motion_engine.wait_idle()
+            idle_us = time.ticks_us()
+            if motion_engine.cancels != cancels:
+                result = {"status": "error", "message": "Preempted by stop/hold"}
+                command.state = 'cancelled'
+            elif motion_engine.feed_error is not None:
+                result = {"status": "error", "message": motion_engine.feed_error}
+                motion_engine.feed_error = None
+        except Exception as e:
+            motion_engine.cancel()
+            result = {"status": "error", "message": f"Error processing command: {str(e)}"}
+        for other, action in group[1:]:
+            # Commands folded into this one finish with it
+            other.duration_ms = command.duration_ms
+            other.state = command.state
+            other.result = dict(result)
+            other.result["action"] = action
+            other.action = action
+            if other.id:
+                other.result["job_id"] = other.id
+            if other.state != 'cancelled':
+                other.state = 'done' if result.get("status") == "success" else 'error'
+        if command.id:
+            result["job_id"] = command.id
+        if command.state != 'cancelled':
+            command.state = 'done' if result.get("status") == "success" else 'error'
+        if command.timed:
+            result["started_at"] = started_ms
+            result["finished_at"] = time.ticks_ms()
+        command.action = action = result.get("action") or 'other'
+        metrics.stage(action, 'queue', time.ticks_diff(started_us, command.queued_us))
+        if planned_us is not None:
+            metrics.stage(action, 'plan', time.ticks_diff(planned_us, started_us))
+        if idle_us is not None:
+            metrics.stage(action, 'motion', time.ticks_diff(idle_us, planned_us))
+        metrics.sample_heap()
+        command.result = result
+
+
+async def send_json(writer, result):
+    """Serialize a result and write it to the client"""
+    response = json.dumps(result)
+    try:
+        writer.write(response.encode('utf-8'))
+        await writer.drain()
+    except Exception as send_error:
+        log(WARN, f'Error sending response: {send_error}')
+
+
+async def send_binary(writer, result):
+    """Write the compact reply to a binary command"""
+    status = 0 if result.get("status") == "success" else 1
+    duration_ms = min(0xFFFF, result.get("duration_ms", 0))
+    struct.pack_into(BINARY_REPLY_FORMAT, binary_reply, 0, BINARY_MAGIC, status, duration_ms)
+    try:
+        writer.write(binary_reply)
+        await writer.drain()
+    except Exception as send_error:
+        log(WARN, f'Error sending response: {send_error}')
+
+
+async def read_into(reader, buf):
+    """Read one chunk into ``buf``; returns the byte count (0 at EOF)"""
+    readinto = getattr(reader, 'readinto', None)
+    if readinto is not None:
+        return (await readinto(buf)) or 0
+    data = await reader.read(len(buf))  # CPython streams have no readinto
+    buf[:len(data)] = data
+    return len(data)
+
+def decode_message(buf, start, end):
+    """
+    Decode the text command in ``buf[start:end]`` with surrounding whitespace
+    and line endings trimmed; the only allocation is the returned str
+    """
+    while start < end and (buf[start] == 32 or 9 <= buf[start] <= 13):
+        start += 1
+    while end > start and (buf[end - 1] == 32 or 9 <= buf[end - 1] <= 13):
+        end -= 1
+    return str(memoryview(buf)[start:end], 'utf-8')
+
+
+class RequestReader:
+    """Incremental reader over one connection's receive buffer.
+
+    Unread bytes stay in buf[start:end] between calls, so requests split
+    across TCP segments or pipelined back to back are both handled, and the
+    socket is only read when a line or body is still incomplete.
+    """
+
+    def __init__(self, reader, buf):
+        self.reader = reader
+        self.buf = buf
+        self.mv = memoryview(buf)
+        self.start = 0
+        self.end = 0
+
+    async def fill(self, timeout_ms):
+        """Read more data; False at EOF, on timeout or if the buffer is full"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start:
+            # Move a partial request to the front (rare: it was split across reads)
+            n = self.end - self.start
+            self.buf[:n] = bytes(self.mv[self.start:self.end])
+            self.start, self.end = 0, n
+        if self.end == len(self.buf):
+            return False
+        try:
+            n = await asyncio.wait_for(read_into(self.reader, self.mv[self.end:]), timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            return False
+        self.end += n
+        return n > 0
+
+    async def readline(self, timeout_ms):
+        """
+        Return (start, end) of the next line without its line ending, -1 for
+        a line too long for the buffer (its bytes are discarded), or None at
+        EOF or timeout
+        """
+        scanned = 0
+        overlong = False
+        while True:
+            buf = self.buf
+            for i in range(self.start + scanned, self.end):
+                if buf[i] == 10:
+                    start = self.start
+                    self.start = i + 1
+                    if overlong:
+                        return -1
+                    if i > start and buf[i - 1] == 13:
+                        i -= 1
+                    return start, i
+            scanned = self.end - self.start
+            if scanned == len(buf):
+                overlong = True
+                self.start = self.end = scanned = 0
+            if not await self.fill(timeout_ms):
+                return None
+
+    async def read_exact(self, nbytes, timeout_ms):
+        """Return the start of the next ``nbytes`` bytes, or None if they never arrive"""
+        while self.end - self.start < nbytes:
+            if not await self.fill(timeout_ms):
+                return None
+        start = self.start
+        self.start += nbytes
+        return start
+
+
+class RequestStats:
+    """Heap bytes allocated by the connection handler per request.
+
+    Only the handler's own synchronous sections (parse and enqueue, reply)
+    are counted, so other tasks running meanwhile do not inflate the numbers.
+    Counts are 0 where gc.mem_alloc() is not available.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.last_bytes = 0
+        self.max_bytes = 0
+        self.total_bytes = 0
+
+    def record(self, nbytes):
+        self.requests += 1
+        self.last_bytes = nbytes
+        self.max_bytes = max(self.max_bytes, nbytes)
+        self.total_bytes += nbytes
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "last_bytes": self.last_bytes,
+            "max_bytes": self.max_bytes,
+            "mean_bytes": self.total_bytes // self.requests if self.requests else 0,
+        }
+
+
+mem_alloc = getattr(gc, 'mem_alloc', None) or (lambda: 0)  # MicroPython only
+request_stats = RequestStats()
+
+
+# Latency metrics
+#
+# Each command's time is split into stages, measured with ticks_us():
+#   parse   request bytes in hand -> job queued (HTTP: from the request line)
+#   queue   waiting for the motion task
+#   plan    executing the action (planning and queueing motion segments)
+#   motion  waiting for the motion engine to finish
+#   send    writing the reply
+#   total   parse start -> reply sent
+# plus "accept" per connection: connection handed over -> first bytes read.
+METRIC_STAGES = ('parse', 'queue', 'plan', 'motion', 'send', 'total')
+METRICS_ACTIONS = 8            # Actions with their own histograms; the rest share "other"
+HISTOGRAM_BUCKETS = 108        # Covers up to 2**27 us (134 s); longer counts as the last bucket
+
+
+class LatencyHistogram:
+    """Microsecond latencies in fixed memory.
+
+    Four buckets per power of two (exact below 8 us), so percentiles are
+    within 25%. Bucket i >= 8 holds [t << s, (t + 1) << s) where s = i // 4 - 1
+    and t = i - 4 * s. Counts saturate by halving every bucket.
+    """
+
+    def __init__(self):
+        self.counts = array('H', [0] * HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.max = 0
+
+    def record(self, us):
+        if us < 0:
+            us = 0
+        shift = 0
+        while us >> (shift + 3):
+            shift += 1
+        index = min(HISTOGRAM_BUCKETS - 1, 4 * shift + (us >> shift))
+        counts = self.counts
+        if counts[index] == 0xFFFF:
+            for i in range(HISTOGRAM_BUCKETS):
+                counts[i] >>= 1
+        counts[index] += 1
+        self.count += 1
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        total = sum(self.counts)
+        rank = max(1, int(total * fraction + 0.999))
+        seen = 0
+        for index in range(HISTOGRAM_BUCKETS):
+            seen += self.counts[index]
+            if seen >= rank:
+                if index < 8:
+                    return index
+                shift = index // 4 - 1
+                return min(self.max, ((index - 4 * shift + 1) << shift) - 1)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "p50_us": self.percentile(0.5),
+                "p95_us": self.percentile(0.95), "max_us": self.max}
+
+
+mem_free = getattr(gc, 'mem_free', None)  # MicroPython only
+
+
+class Metrics:
+    """Per-action stage latencies, control tick timing and heap watermarks"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.actions = {}                     # action -> {stage: LatencyHistogram}
+        self.accept = LatencyHistogram()
+        self.tick_period = LatencyHistogram()  # Start-to-start time of consecutive ticks
+        self.tick_work = LatencyHistogram()    # Time spent inside each tick
+        self.ticks = 0
+        self.late_ticks = 0                   # Ticks that started after their period had ended
+        self.dropped_ticks = 0                # Whole periods skipped when resynchronising
+        self.period_total_us = 0
+        self.periods = 0
+        self.last_tick_us = None
+        self.heap_min = None
+        self.heap_max = None
+        self.started = time.ticks_ms()
+
+    def stage(self, action, name, us):
+        """Record one stage of a command"""
+        stages = self.actions.get(action)
+        if stages is None:
+            if len(self.actions) >= METRICS_ACTIONS:
+                action = 'other'
+            stages = self.actions.get(action)
+            if stages is None:
+                stages = self.actions[action] = {}
+        histogram = stages.get(name)
+        if histogram is None:
+            histogram = stages[name] = LatencyHistogram()
+        histogram.record(us)
+
+    def tick(self, start_us, end_us):
+        """Record a motion engine tick that ran from start_us to end_us"""
+        if self.last_tick_us is not None:
+            period = time.ticks_diff(start_us, self.last_tick_us)
+            self.tick_period.record(period)
+            self.period_total_us += period
+            self.periods += 1
+        self.last_tick_us = start_us
+        self.tick_work.record(time.ticks_diff(end_us, start_us))
+        self.ticks += 1
+
+    def late(self, behind_ms):
+        """The tick loop fell behind by behind_ms and resynchronised"""
+        self.late_ticks += 1
+        self.dropped_ticks += behind_ms // CONTROL_PERIOD_MS
+
+    def sample_heap(self):
+        """Update the free-heap watermarks; returns the free bytes (None off MicroPython)"""
+        if mem_free is None:
+            return None
+        free = mem_free()
+        if self.heap_min is None or free < self.heap_min:
+            self.heap_min = free
+        if self.heap_max is None or free > self.heap_max:
+            self.heap_max = free
+        return free
+
+    def report(self):
+        """Everything as JSON-ready dicts; never touches the motion queue"""
+        commands = {}
+        for action, stages in self.actions.items():
+            commands[action] = {}
+            for name in METRIC_STAGES:
+                if name in stages:
+                    commands[action][name] = stages[name].summary()
+        return {
+            "status": "success",
+            "uptime_ms": time.ticks_diff(time.ticks_ms(), self.started),
+            "commands": commands,
+            "accept": self.accept.summary(),
+            "ticks": {
+                "target_hz": 1000 // CONTROL_PERIOD_MS,
+                "rate_hz": self.periods * 1000000 // self.period_total_us if self.period_total_us else 0,
+                "count": self.ticks,
+                "late": self.late_ticks,
+                "dropped": self.dropped_ticks,
+                "period": self.tick_period.summary(),
+                "work": self.tick_work.summary(),
+            },
+            "heap": {"free": self.sample_heap(), "min_free": self.heap_min, "max_free": self.heap_max},
+            "boot": boot_report(),
+            "queue": command_queue.stats(),
+            "requests": request_stats.stats(),
+        }
+
+
+metrics = Metrics()
+
+def metrics_command(options):
+    """{"action": "metrics"} returns latency and tick metrics; "reset": true starts them over"""
+    result = metrics.report()
+    if options and options.get("reset"):
+        metrics.reset()
+    return result
+
+def record_reply(job, started_us, send_us):
+    """
+    Record the parse, send and total stages of a job whose request arrived at
+    started_us and whose reply was written from send_us until now
+    """
+    now = time.ticks_us()
+    action = job.action or 'other'
+    metrics.stage(action, 'parse', time.ticks_diff(job.queued_us, started_us))
+    metrics.stage(action, 'send', time.ticks_diff(now, send_us))
+    metrics.stage(action, 'total', time.ticks_diff(now, started_us))
+
+
+HTTP_REASONS = {
+    200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    408: 'Request Timeout', 411: 'Length Required', 413: 'Payload Too Large', 414: 'URI Too Long',
+    503: 'Service Unavailable',
+}
+
+def is_http_request(buf, nbytes):
+    """True if the buffer starts with an HTTP request method"""
+    for method in (b'POST ', b'GET ', b'PUT ', b'HEAD ', b'OPTIONS '):
+        n = len(method)
+        if nbytes >= n and buf[:n] == method:
+            return True
+    return False
+
+async def send_http(writer, status, result, keep_alive):
+    """Write an HTTP/1.1 response with a JSON body"""
+    body = json.dumps(result).encode('utf-8')
+    connection = 'keep-alive' if keep_alive else 'close'
+    header = (f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+              f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+              f'Connection: {connection}\r\n\r\n')
+    try:
+        writer.write(header.encode('utf-8'))
+        writer.write(body)
+        await writer.drain()
+    except Exception as send_error:
+        log(WARN, f'Error sending response: {send_error}')
+
+async def wait_result(command):
+    """Wait for the motion task without holding up any other connection"""
+    while command.result is None:
+        await async_sleep_ms(MOTION_POLL_MS)
+    return command.result
+
+async def serve_binary(conn, writer):
+    """Binary frames, one reply each, until the client closes or goes idle"""
+    while True:
+        while conn.end - conn.start < BINARY_FRAME_SIZE:
+            partial = conn.end > conn.start
+            if not await conn.fill(CLIENT_READ_TIMEOUT_MS if partial else KEEPALIVE_IDLE_MS):
+                if partial:
+                    await send_binary(writer, {"status": "error"})
+                return
+        started_us = time.ticks_us()
+        alloc_start = mem_alloc()
+        frame = parse_binary_command(conn.mv[conn.start:conn.end])
+        conn.start += BINARY_FRAME_SIZE
+        if frame is None:
+            await send_binary(writer, {"status": "error"})
+            return
+        if binary_preempts(frame):
+            await send_binary(writer, frame[0](frame[1], frame[2]))  # Preempts; never waits in the queue
+            continue
+        command = PendingCommand(None, frame)
+        if not command_queue.put_nowait(command):
+            await send_binary(writer, {"status": "error"})
+            continue
+        alloc_bytes = mem_alloc() - alloc_start
+        result = await wait_result(command)
+        alloc_start = mem_alloc()
+        send_us = time.ticks_us()
+        await send_binary(writer, result)
+        record_reply(command, started_us, send_us)
+        request_stats.record(alloc_bytes + mem_alloc() - alloc_start)
+
+def parse_job_options(message):
+    """The JSON object of a message that uses job, queue, log, metrics or timing fields, else None"""
+    if ('"job_id"' not in message and '"async"' not in message
+            and '"priority"' not in message and '"replace"' not in message
+            and '"clear"' not in message and '"reset"' not in message
+            and '"start_at"' not in message and '"timing"' not in message):
+        return None
+    try:
+        options = json.loads(message)
+    except ValueError:
+        return None
+    return options if isinstance(options, dict) else None
+
+def route_message(message):
+    """
+    Submit a text command or look up a job
+
+    Returns (http_status, reply, job, watch): send ``reply`` straight away if
+    it is set; otherwise wait for ``job`` to finish, or stream its progress
+    when ``watch`` is True.
+
+    {"action": "dance", "async": true} replies at once with the job id;
+    {"action": "status", "job_id": 7} returns the job's progress and
+    {"action": "watch", "job_id": 7} streams it until the job finishes.
+    {"action": "logs"} returns the recent log records (see logs_command()) and
+    {"action": "metrics"} the latency metrics; neither ever queues motion.
+    {"action": "clock"} returns ticks_ms() for clock offset estimation.
+
+    stop and hold preempt motion right here rather than queueing behind it;
+    "priority" ("high", "normal", "low") and "replace" control queueing.
+    "start_at" (robot ticks_ms) holds a command until then, for synchronised
+    starts across robots; it and "timing": true add the robot's started_at
+    and finished_at ticks to the result.
+    """
+    options = parse_job_options(message)
+    action = options.get("action") if options is not None else None
+    if isinstance(action, str):
+        action = action.lower().strip()  # As process_command() would read it
+    elif action is None:
+        lowered = message.lower()
+        if ('stop' in lowered or 'hold' in lowered or 'queue' in lowered
+                or 'logs' in lowered or 'metrics' in lowered or 'clock' in lowered):
+            action = extract_action_from_message(message)
+    if action in PREEMPT_ACTIONS:
+        return 200, ACTIONS[action](), None, False
+    if action == "queue":
+        result = command_queue.stats()
+        result.update(coalesce_stats)
+        result["status"] = "success"
+        return 200, result, None, False
+    if action == "logs":
+        return 200, logs_command(options), None, False
+    if action == "metrics":
+        return 200, metrics_command(options), None, False
+    if action == "clock":
+        return 200, {"status": "success", "ticks_ms": time.ticks_ms()}, None, False
+    if options is not None and action in ("status", "watch"):
+        job = jobs.get(options.get("job_id"))
+        if job is None:
+            return 404, {"status": "error", "message": "Unknown job"}, None, False
+        if action == "status":
+            return 200, job.snapshot(), None, False
+        return 200, None, job, True
+    priority = PRIORITY_NORMAL
+    replace = False
+    start_at = None
+    timed = False
+    if options is not None:
+        priority = PRIORITIES.get(options.get("priority"), PRIORITY_NORMAL)
+        replace = bool(options.get("replace"))
+        start_at = options.get("start_at")
+        timed = bool(options.get("timing"))
+        if start_at is not None and not isinstance(start_at, int):
+            return 400, {"status": "error", "message": "start_at must be a ticks_ms value"}, None, False
+    job = jobs.submit(message, priority, replace, start_at, timed)
+    if job is None:
+        return 503, {"status": "error", "message": "Command queue full, try again later"}, None, False
+    if options is not None and options.get("async"):
+        return 202, {"status": "accepted", "job_id": job.id, "state": job.state}, None, False
+    return 200, None, job, False
+
+async def stream_job(writer, job):
+    """Write a JSON line with the job's progress every JOB_EVENT_MS until it finishes"""
+    while True:
+        snapshot = job.snapshot()
+        writer.write(json.dumps(snapshot).encode('utf-8'))
+        writer.write(b'\n')
+        await writer.drain()
+        if job.result is not None:
+            return
+        await async_sleep_ms(JOB_EVENT_MS)
+
+async def serve_text(conn, writer):
+    """Legacy raw message: one command, one JSON reply, then close"""
+    started_us = time.ticks_us()
+    alloc_start = mem_alloc()
+    try:
+        message = decode_message(conn.buf, conn.start, conn.end)
+    except UnicodeError:
+        await send_json(writer, {"status": "error", "message": 'Error: Invalid UTF-8 data received'})
+        return
+    code, reply, job, watch = route_message(message)
+    if reply is not None:
+        await send_json(writer, reply)
+        return
+    if watch:
+        await stream_job(writer, job)
+        return
+    alloc_bytes = mem_alloc() - alloc_start
+    result = await wait_result(job)
+    alloc_start = mem_alloc()
+    send_us = time.ticks_us()
+    await send_json(writer, result)
+    record_reply(job, started_us, send_us)
+    request_stats.record(alloc_bytes + mem_alloc() - alloc_start)
+
+async def serve_http(conn, writer):
+    """HTTP/1.1 requests on one persistent connection until it is closed"""
+    while True:
+        # Request line; between requests the connection may sit idle
+        line = await conn.readline(KEEPALIVE_IDLE_MS)
+        while line is not None and line != -1 and line[0] == line[1]:
+            line = await conn.readline(KEEPALIVE_IDLE_MS)  # Stray CRLF between requests
+        if line is None:
+            return
+        if line == -1:
+            await send_http(writer, 414, {"status": "error", "message": "Request line too long"}, False)
+            return
+        started_us = time.ticks_us()
+        alloc_start = mem_alloc()
+        try:
+            request_line = str(conn.mv[line[0]:line[1]], 'utf-8').split()
+        except UnicodeError:
+            request_line = ()
+        if len(request_line) != 3:
+            await send_http(writer, 400, {"status": "error", "message": "Malformed request line"}, False)
+            return
+        method, target, version = request_line
+        keep_alive = version == 'HTTP/1.1'
+
+        # Headers: only Content-Length, Connection and Transfer-Encoding matter
+        content_length = 0
+        chunked = False
         while True:
+            line = await conn.readline(CLIENT_READ_TIMEOUT_MS)
+            if line is None:
+                await send_http(writer, 408, {"status": "error", "message": "Incomplete request"}, False)
+                return
+            if line == -1:
+                continue  # Header longer than the buffer; none we need are
+            start, end = line
+            if start == end:
+                break
+            if conn.buf[start] not in (67, 99, 84, 116):  # C, c, T, t
+                continue
+            name, _, value = str(conn.mv[start:end], 'utf-8').partition(':')
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == 'content-length':
+                content_length = int(value) if value.isdigit() else -1
+            elif name == 'connection':
+                keep_alive = value == 'keep-alive' or (keep_alive and value != 'close')
+            elif name == 'transfer-encoding':
+                chunked = value != 'identity'
+
+        if chunked or content_length < 0:
+            await send_http(writer, 411, {"status": "error", "message": "Content-Length required"}, False)
+            return
+        if content_length > len(conn.buf):
+            await send_http(writer, 413, {"status": "error", "message": "Body too large"}, False)
+            return
+        body = await conn.read_exact(content_length, CLIENT_READ_TIMEOUT_MS)
+        if body is None:
+            await send_http(writer, 408, {"status": "error", "message": "Incomplete body"}, False)
+            return
+
+        if method == 'GET' and target.startswith('/jobs/'):
+            # /jobs/<id> polls a job, /jobs/<id>/events streams its progress
+            parts = target.split('/')
+            job = jobs.get(int(parts[2])) if parts[2].isdigit() else None
+            if job is None:
+                await send_http(writer, 404, {"status": "error", "message": "Unknown job"}, keep_alive)
+            elif len(parts) > 3 and parts[3] == 'events':
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+                await stream_job(writer, job)
+                return
+            else:
+                await send_http(writer, 200, job.snapshot(), keep_alive)
+        elif method == 'GET' and target == '/logs':
+            await send_http(writer, 200, logs_command(None), keep_alive)
+        elif method == 'GET' and target == '/metrics':
+            await send_http(writer, 200, metrics_command(None), keep_alive)
+        elif method == 'GET':
+            positions = {}
+            for joint in JOINTS:
+                positions[joint.name] = joint.position
+            await send_http(writer, 200, {"status": "success", "positions": positions}, keep_alive)
+        elif method != 'POST':
+            await send_http(writer, 405, {"status": "error", "message": "Use POST"}, keep_alive)
+        else:
             try:
-                # Accept connection
-                client_socket, client_addr = server_socket.accept()
-                print('Connection from', client_addr)
-                
-                # Set timeout for receiving data
-                #client_socket.settimeout(10.0)
-                
-                # Receive data
-                data = client_socket.recv(1024)
-                if data:
-                    try:
-                        # Decode data and clean it
-                        message = data.decode('utf-8').strip()
-                        print('Received raw:', repr(message))
-                        print('Received length:', len(message))
-                        
-                        # Additional cleaning for common issues
-                        message_clean = message.replace('\r', '').replace('\n', '').strip()
-                        print('Cleaned message:', repr(message_clean))
-                        
-                        # Initialize servos before processing command
-                        initialize_servos()
-                        time.sleep_ms(1000)  # Wait 1 second after initialization
-                        
-                        # Process the command using regex pattern matching
-                        result = process_command(message_clean)
-                        
-                        # Send response back to client
-                        response = json.dumps(result)
-                        try:
-                            client_socket.send(response.encode('utf-8'))
-                            print('Response sent:', response)
-                        except Exception as send_error:
-                            print('Error sending response:', send_error)
-                            
-                    except UnicodeError:
-                        error_msg = 'Error: Invalid UTF-8 data received'
-                        print(error_msg)
-                        error_response = json.dumps({"status": "error", "message": error_msg})
-                        try:
-                            client_socket.send(error_response.encode('utf-8'))
-                        except:
-                            pass
-                    except Exception as e:
-                        error_msg = f'Error processing message: {str(e)}'
-                        print(error_msg)
-                        if 'message' in locals():
-                            print('Failed message:', repr(message))
-                        if 'message_clean' in locals():
-                            print('Failed cleaned message:', repr(message_clean))
-                        error_response = json.dumps({"status": "error", "message": error_msg})
-                        try:
-                            client_socket.send(error_response.encode('utf-8'))
-                        except:
-                            pass
-                
-                # Close client connection
-                client_socket.close()
-                
-                # Garbage collection to free memory
-                gc.collect()
-                
-            except Exception as e:
-                print('Server error:', e)
-                try:
-                    client_socket.close()
-                except:
-                    pass
-                gc.collect()
-    except Exception as e:
-        print('Failed to start server:', e)
+                message = decode_message(conn.buf, body, body + content_length)
+            except UnicodeError:
+                message = None
+                await send_http(writer, 400, {"status": "error", "message": "Invalid UTF-8 body"}, keep_alive)
+            if message is not None:
+                code, reply, job, watch = route_message(message)
+                if reply is not None:
+                    await send_http(writer, code, reply, keep_alive)
+                elif watch:
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+                    await stream_job(writer, job)
+                    return
+                else:
+                    alloc_bytes = mem_alloc() - alloc_start
+                    result = await wait_result(job)
+                    alloc_start = mem_alloc()
+                    status = 200 if result.get("status") == "success" else 400
+                    send_us = time.ticks_us()
+                    await send_http(writer, status, result, keep_alive)
+                    record_reply(job, started_us, send_us)
+                    request_stats.record(alloc_bytes + mem_alloc() - alloc_start)
+        if not keep_alive:
+            return
 
-def main():
-    """Main function"""
-    print('ESP32-C3 Mini Robot Command Server Starting...')
-    
-    # Connect to WiFi with error handling
-    if connect_wifi():
-        # Start WebREPL
+
+async def handle_client(reader, writer):
+    """
+    Serve one connection until it closes
+
+    The first bytes pick the protocol: binary frames, HTTP/1.1 (keep-alive,
+    as sent by the Android app) or a legacy raw text message.
+    """
+    global active_clients
+    active_clients += 1
+    buf = None
+    accepted_us = time.ticks_us()
+    try:
+        if active_clients > MAX_CLIENTS:
+            await send_json(writer, {"status": "error", "message": "Server busy, too many connections"})
+            return
+        buf = recv_buffers.pop()
+        conn = RequestReader(reader, buf)
+
+        # Apply a read deadline so a slow or half-open client only stalls itself
+        if not await conn.fill(CLIENT_READ_TIMEOUT_MS):
+            return
+        metrics.accept.record(time.ticks_diff(time.ticks_us(), accepted_us))
+        if 'first_command' not in boot_phases:
+            boot_phase('first_command')
+        if buf[0] == BINARY_MAGIC:
+            await serve_binary(conn, writer)
+        elif is_http_request(buf, conn.end):
+            await serve_http(conn, writer)
+        else:
+            await serve_text(conn, writer)
+
+    except Exception as e:
+        log(WARN, f'Client error: {e}')
+    finally:
+        active_clients -= 1
+        if buf is not None:
+            recv_buffers.append(buf)
         try:
-            #webrepl.start()
-            print('WebREPL started')
-        except Exception as e:
-            print('WebREPL failed to start:', e)
-        
-        # Start command server
-        print('Starting robot command server...')
-        start_command_server()
-    else:
-        print('WiFi connection failed. Starting WebREPL for debugging...')
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+# Teleop datagrams, little endian:
+#   magic (u8), flags (u8), seq (u16), stamp (u32), one int16 per joint in JOINTS order
+# Targets are absolute Q4 angles (1/16 degree); negative holds a joint. Each
+# applied setpoint is acknowledged with magic, status (0 applied, 1 stale,
+# 2 malformed, 3 stopped), seq and the sender's stamp echoed back, so the
+# sender can time the round trip to the PWM write. After stop or hold every
+# datagram is refused (status 3) until one carries TELEOP_FLAG_START, which
+# starts a new session with any sequence number.
+TELEOP_MAGIC = 0xA6
+TELEOP_FORMAT = '<BBHI' + 'h' * len(JOINTS)
+TELEOP_PACKET_SIZE = struct.calcsize(TELEOP_FORMAT)
+TELEOP_ACK_FORMAT = '<BBHI'
+TELEOP_APPLIED = 0
+TELEOP_STALE = 1
+TELEOP_MALFORMED = 2
+TELEOP_STOPPED = 3
+TELEOP_FLAG_START = 0x01       # Flags bit: start a new session
+
+
+class Teleop:
+    """Follows streamed joint setpoints from a UDP socket.
+
+    Only the newest sequence number is kept; older or duplicate datagrams are
+    dropped, after the dead-man timeout too. While active, the motion engine tick moves every joint toward
+    its latest target, rate-limited to the joint's max velocity, instead of
+    playing trajectories. If no setpoint arrives for TELEOP_DEADMAN_MS the
+    joints hold where they are and queued commands run again. stop and hold
+    end the session: a stream still sending afterwards cannot take control
+    back until it sends TELEOP_FLAG_START.
+    """
+
+    def __init__(self, joints):
+        self.joints = joints
+        self.sock = None
+        self.active = False
+        self.targets = array('i', [-1] * len(joints))  # Q4 targets, -1: hold
+        self.current = array('i', [0] * len(joints))   # Q4 setpoints sent to the PWM
+        self.max_step = array('i', [joint.max_velocity * FX_ANGLE_ONE * CONTROL_PERIOD_MS // 1000
+                                    for joint in joints])
+        self.last_seq = None   # Newest accepted sequence number; None until the first
+        self.last_rx = 0       # ticks_ms() of the newest accepted setpoint
+        self.stopped = False   # Set by stop/hold; only a TELEOP_FLAG_START datagram resumes
+        self.ack = bytearray(struct.calcsize(TELEOP_ACK_FORMAT))
+        self.ack_addr = None   # Where to acknowledge the pending setpoint
+        self.ack_seq = 0
+        self.ack_stamp = 0
+        self.received = 0
+        self.applied = 0
+        self.stale = 0
+        self.malformed = 0
+        self.refused = 0       # Datagrams refused after stop/hold
+        self.deadman_trips = 0
+        self.latency_max_ms = 0
+
+    def open(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('0.0.0.0', port))
+        sock.setblocking(False)
+        self.sock = sock
+
+    def reply(self, status, seq, stamp, addr):
+        struct.pack_into(TELEOP_ACK_FORMAT, self.ack, 0, TELEOP_MAGIC, status, seq, stamp)
         try:
-            webrepl.start()
-            print('WebREPL started - you can connect to debug WiFi issues')
-        except Exception as e:
-            print('WebREPL also failed:', e)
-            print('Try power cycling the ESP32-C3 Mini')
+            self.sock.sendto(self.ack, addr)
+        except OSError:
+            pass
+
+    def poll(self, now):
+        """Drain the socket, keeping the newest in-order setpoint"""
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(TELEOP_PACKET_SIZE + 1)
+            except OSError:
+                return  # Nothing more to read
+            self.received += 1
+            if len(data) != TELEOP_PACKET_SIZE or data[0] != TELEOP_MAGIC:
+                self.malformed += 1
+                self.reply(TELEOP_MALFORMED, 0, 0, addr)
+                continue
+            fields = struct.unpack_from(TELEOP_FORMAT, data)
+            seq = fields[2]
+            if fields[1] & TELEOP_FLAG_START:
+                self.stopped = False  # New session: its numbering starts afresh
+            elif self.stopped:
+                self.refused += 1
+                self.reply(TELEOP_STOPPED, seq, fields[3], addr)
+                continue
+            elif self.last_seq is not None and not 0 < (seq - self.last_seq) & 0xFFFF < 0x8000:
+                # Checked after the dead-man timeout too: a late datagram must not take over
+                self.stale += 1
+                self.reply(TELEOP_STALE, seq, fields[3], addr)
+                continue
+            self.accept(fields, addr, now)
+
+    def accept(self, fields, addr, now):
+        if not self.active:
+            # Take over from any queued motion, starting from where it stopped
+            motion_engine.cancel()
+            for joint in self.joints:
+                self.current[joint.index] = joint.position * FX_ANGLE_ONE
+            self.active = True
+            motion_engine.wake.set()
+        for joint in self.joints:
+            target = fields[4 + joint.index]
+            self.targets[joint.index] = min(target, joint.max_range * FX_ANGLE_ONE) if target >= 0 else -1
+        self.last_seq = fields[2]
+        self.last_rx = now
+        self.ack_addr = addr
+        self.ack_seq = fields[2]
+        self.ack_stamp = fields[3]
+
+    def step(self, now):
+        """Move every joint one rate-limited step toward its target"""
+        if time.ticks_diff(now, self.last_rx) > TELEOP_DEADMAN_MS:
+            self.hold()
+            return
+        targets = self.targets
+        current = self.current
+        for joint in self.joints:
+            i = joint.index
+            target = targets[i]
+            position = current[i]
+            if target < 0 or target == position:
+                continue
+            if target > position:
+                position = min(position + self.max_step[i], target)
+            else:
+                position = max(position - self.max_step[i], target)
+            current[i] = position
+            pwm_scheduler.set(joint, joint.angle_q_to_duty_ns(position))
 
-# Run the main function
-main()
+    def send_ack(self, now):
+        """Acknowledge the newest setpoint once it has reached the PWM"""
+        if self.ack_addr is None or pwm_scheduler.pending_count:
+            return
+        self.latency_max_ms = max(self.latency_max_ms, time.ticks_diff(now, self.last_rx))
+        self.applied += 1
+        self.reply(TELEOP_APPLIED, self.ack_seq, self.ack_stamp, self.ack_addr)
+        self.ack_addr = None
+
+    def stop(self):
+        """End the session (stop or hold): hold where the joints are and refuse the stream"""
+        if self.active:
+            self.hold()
+        self.stopped = True
+
+    def hold(self):
+        """Dead-man timeout: stop where the joints are and hand back control"""
+        for joint in self.joints:
+            joint.position = (self.current[joint.index] + FX_ANGLE_ONE // 2) >> FX_ANGLE_BITS
+            self.targets[joint.index] = -1
+        self.active = False
+        self.ack_addr = None
+        self.deadman_trips += 1
+        log(WARN, 'Teleop stream stopped, holding position')
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "received": self.received,
+            "applied": self.applied,
+            "stale": self.stale,
+            "malformed": self.malformed,
+            "refused": self.refused,
+            "stopped": self.stopped,
+            "deadman_trips": self.deadman_trips,
+            "latency_max_ms": self.latency_max_ms,
+        }
+
+
+async def teleop_task(channel):
+    """Receive teleop setpoints next to the TCP command server"""
+    channel.open(TELEOP_PORT)
+    if LOG_INFO:
+        log(INFO, f'Teleop listening on UDP port {TELEOP_PORT}')
+    while True:
+        channel.poll(time.ticks_ms())
+        await async_sleep_ms(TELEOP_POLL_MS)
+
+
+teleop = Teleop(JOINTS)
+
+# Server state shared by all connection handlers
+command_queue = CommandQueue(COMMAND_QUEUE_SIZE)
+active_clients = 0
+jobs = JobTable(command_queue, JOB_HISTORY)
+recv_buffers = [bytearray(RECV_BUFFER_SIZE) for _ in range(MAX_CLIENTS)]  # One per connection, reused
+
+
+async def serve():
+    """
+    Run the command server and the motion task until the loop is stopped
+
+    The server listens before WiFi is up, so local motion and clients on an
+    already-known address are served while WiFi associates.
+    """
+    load_pose()
+    boot_phase('pose')
+    # Collect in small steps as the heap fills instead of after every request
+    if hasattr(gc, 'threshold'):
+        gc.collect()
+        gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+    asyncio.create_task(motion_engine.run())
+    asyncio.create_task(motion_task(command_queue))
+    asyncio.create_task(pose_saver())
+    asyncio.create_task(teleop_task(teleop))
+    server = await asyncio.start_server(handle_client, '0.0.0.0', PORT, backlog=MAX_CLIENTS)
+    boot_phase('server')
+    if LOG_INFO:
+        log(INFO, f'Robot command server listening on port {PORT}')
+    asyncio.create_task(wifi_task())
+    try:
+        while True:
+            await async_sleep_ms(1000)
+    finally:
+        server.close()
+
+
+def start_command_server():
+    """Start the asyncio command server; handles many clients concurrently"""
+    try:
+        asyncio.run(serve())
+    except Exception as e:
+        log(ERROR, f'Failed to start server: {e}')
+
+def main():
+    """Main function"""
+    if LOG_INFO:
+        log(INFO, 'ESP32-C3 Mini Robot Command Server Starting...')
+    # WiFi connects in the background once the server is up (see serve())
+    start_command_server()
 
- 
+# Run the main function (on the device boot.py runs as __main__; importing it,
+# e.g. from the sim package, leaves the server stopped)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Host-side tool for robot choreography files
+Usage:
+    python choreo_tool.py convert <source.py> <function> <out.jsonl>
+    python choreo_tool.py show <file.jsonl>
+
+A choreography is a JSON-lines file with one keyframe per line:
+    {"say": "Dance 1"}                                  print a message
+    {"move": {"turntable": 40, "claw": -45}, "speed": 2} relative move, clockwise positive
+    {"to": {"turntable": 0, "arm_c": 90}, "speed": 2}    absolute move
+    {"wait": 500}                                       pause in ms
+Moves may also set "profile" ("trapezoid", "scurve" or "linear").
+Copy the files to the robot's choreo/ folder and run them with "play <name>".
+"""
+
+import ast
+import json
+import sys
+
+# boot.py aliases for the joints
+SERVO_NAMES = {
+    "servo_a": "turntable",
+    "servo_b": "claw",
+    "servo_c": "arm_c",
+    "servo_d": "arm_d",
+}
+
+MOVE_CALLS = ("move_simultaneous_simple", "move_simultaneous")
+DWELL_CALLS = ("dwell", "sleep_ms")
+
+def call_name(node):
+    """Name of the function a Call node calls (last attribute for methods)"""
+    func = node.func
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    if isinstance(func, ast.Name):
+        return func.id
+    return None
+
+def movement_list(node):
+    """Turn a literal list of (servo, degrees, direction, speed) tuples into keyframe fields"""
+    joints = {}
+    speeds = []
+    for item in node.elts:
+        servo, degrees, direction, speed = item.elts
+        name = SERVO_NAMES[servo.id]
+        degrees = ast.literal_eval(degrees)
+        if ast.literal_eval(direction).lower() != "clockwise":
+            degrees = -degrees
+        joints[name] = degrees
+        speeds.append(ast.literal_eval(speed))
+    speed = sum(speeds) / len(speeds)
+    return {"move": joints, "speed": int(speed) if speed == int(speed) else speed}
+
+def convert_body(statements, variables, keyframes):
+    """Append the keyframes of a list of statements, unrolling for-range loops"""
+    for statement in statements:
+        if isinstance(statement, ast.Assign) and isinstance(statement.value, ast.List):
+            variables[statement.targets[0].id] = movement_list(statement.value)
+        elif isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call):
+            call = statement.value
+            name = call_name(call)
+            if name == "print" and call.args and isinstance(call.args[0], ast.Constant):
+                keyframes.append({"say": call.args[0].value})
+            elif name in MOVE_CALLS:
+                argument = call.args[0]
+                if isinstance(argument, ast.Name):
+                    keyframes.append(dict(variables[argument.id]))
+                else:
+                    keyframes.append(movement_list(argument))
+            elif name in DWELL_CALLS:
+                keyframes.append({"wait": ast.literal_eval(call.args[0])})
+            else:
+                print(f"Skipping line {statement.lineno}: unsupported call {name}()")
+        elif isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+            continue  # Docstring
+        elif isinstance(statement, ast.For) and call_name(statement.iter) == "range":
+            for _ in range(ast.literal_eval(statement.iter.args[0])):
+                convert_body(statement.body, variables, keyframes)
+        else:
+            print(f"Skipping line {statement.lineno}: unsupported statement")
+
+def convert(source_path, function_name):
+    """Keyframes of a Python dance routine written with move_simultaneous_simple() and dwell()"""
+    with open(source_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), source_path)
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == function_name:
+            keyframes = []
+            convert_body(node.body, {}, keyframes)
+            return keyframes
+    raise SystemExit(f"No function {function_name}() in {source_path}")
+
+def write_keyframes(keyframes, path):
+    """Write one compact JSON object per line"""
+    with open(path, "w", encoding="utf-8") as f:
+        for keyframe in keyframes:
+            f.write(json.dumps(keyframe, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+def show(path):
+    """Check a choreography file and summarise it"""
+    counts = {"say": 0, "move": 0, "to": 0, "wait": 0}
+    wait_ms = 0
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keyframe = json.loads(line)
+            kinds = [kind for kind in counts if kind in keyframe]
+            if len(kinds) != 1:
+                raise SystemExit(f"{path}:{number}: expected one of {', '.join(counts)}")
+            counts[kinds[0]] += 1
+            wait_ms += keyframe.get("wait", 0)
+    print(f"{path}: {counts['move']} relative moves, {counts['to']} absolute moves, "
+          f"{counts['wait']} pauses ({wait_ms} ms), {counts['say']} messages")
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "convert":
+        keyframes = convert(sys.argv[2], sys.argv[3])
+        write_keyframes(keyframes, sys.argv[4])
+        print(f"Wrote {len(keyframes)} keyframes to {sys.argv[4]}")
+        show(sys.argv[4])
+    elif len(sys.argv) == 3 and sys.argv[1] == "show":
+        show(sys.argv[2])
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main()
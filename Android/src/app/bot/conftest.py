@@ -0,0 +1,2 @@
+# test_commands.py drives a real robot over the network; only test_sim.py runs under pytest
+collect_ignore = ['test_commands.py']
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Fleet controller: drive several robots at once
+
+Keeps a robot_client connection pool per robot, broadcasts commands to all
+of them in parallel, and starts per-robot sequences together. For a
+synchronised start, each robot's clock offset is estimated from a few
+{"action": "clock"} round trips (the sample with the shortest round trip
+wins), and the first command carries "start_at" in that robot's own
+ticks_ms(). Replies carry the robots' started_at/finished_at ticks, which
+are mapped back to host time for the skew report.
+
+Usage:
+    python fleet.py 192.168.1.100,192.168.1.101:8080 dance
+    python fleet.py --sim 3 open_claw close_claw     In-process simulated robots
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from robot_client import DEFAULT_PORT, RobotClient, RobotError, as_message
+
+TICKS_PERIOD = 1 << 30      # Robot ticks_ms() wrap
+
+def host_ms():
+    return time.monotonic() * 1000
+
+def ticks_diff(end, start):
+    """Signed difference of two robot ticks values, correct across a wrap"""
+    half = TICKS_PERIOD // 2
+    return (end - start + half) % TICKS_PERIOD - half
+
+class FleetRobot:
+    """One robot: its client and the estimated offset of its clock from the host's"""
+
+    def __init__(self, name, host, port, **client_options):
+        self.name = name
+        self.client = RobotClient(host, port, **client_options)
+        self.offset_ms = None   # Robot ticks_ms() minus host_ms() at the sync point
+        self.rtt_ms = None      # Round trip of the sample the offset came from
+        self.sync_host_ms = None
+
+    async def sync_clock(self, samples=8):
+        """Estimate the clock offset from the round trip with the least delay"""
+        best = None
+        for _ in range(samples):
+            sent = host_ms()
+            reply = await self.client.request("clock")
+            received = host_ms()
+            rtt = received - sent
+            if best is None or rtt < best[0]:
+                best = (rtt, (sent + received) / 2, reply["ticks_ms"])
+        self.rtt_ms, self.sync_host_ms, ticks = best
+        self.offset_ms = ticks - self.sync_host_ms
+
+    def to_ticks(self, at_host_ms):
+        """Robot ticks_ms() value at a host time"""
+        return int(round(at_host_ms + self.offset_ms)) % TICKS_PERIOD
+
+    def to_host(self, ticks):
+        """Host time of a robot ticks_ms() value near the sync point"""
+        return self.sync_host_ms + ticks_diff(ticks, self.to_ticks(self.sync_host_ms))
+
+class Fleet:
+    """
+    Parallel connections to several robots
+
+    ``robots`` are "host" or "host:port" strings or (host, port) pairs.
+    Options such as ``timeout`` and ``retries`` go to each RobotClient.
+    """
+
+    def __init__(self, robots, **client_options):
+        client_options.setdefault("timeout", 120.0)  # Long enough for a whole dance
+        self.robots = []
+        for robot in robots:
+            if isinstance(robot, str):
+                host, _, port = robot.partition(":")
+                robot = (host, int(port) if port else DEFAULT_PORT)
+            self.robots.append(FleetRobot(f"{robot[0]}:{robot[1]}", robot[0], robot[1], **client_options))
+
+    async def sync_clocks(self, samples=8):
+        """Estimate every robot's clock offset; returns {name: (offset_ms, rtt_ms)}"""
+        await asyncio.gather(*[robot.sync_clock(samples) for robot in self.robots])
+        return {robot.name: (round(robot.offset_ms, 3), round(robot.rtt_ms, 3)) for robot in self.robots}
+
+    async def broadcast(self, command):
+        """Send one command to every robot at once; returns {name: reply}"""
+        async def send(robot):
+            try:
+                return await robot.client.request(command)
+            except RobotError as e:
+                return {"status": "error", "message": str(e)}
+        replies = await asyncio.gather(*[send(robot) for robot in self.robots])
+        return {robot.name: reply for robot, reply in zip(self.robots, replies)}
+
+    async def run_synchronized(self, sequences, lead_ms=300, resync=True):
+        """
+        Start a command sequence on every robot at the same moment
+
+        ``sequences`` is one list of commands for all robots or a dict of
+        lists by robot name. The first command of each starts ``lead_ms``
+        from now on every robot's clock; the rest follow back to back.
+        Returns the skew report (see skew_report()).
+        """
+        if resync or any(robot.offset_ms is None for robot in self.robots):
+            await self.sync_clocks()
+        start = host_ms() + lead_ms
+
+        async def run(robot):
+            commands = sequences[robot.name] if isinstance(sequences, dict) else sequences
+            messages = [dict(as_message(command), timing=True) for command in commands]
+            messages[0]["start_at"] = robot.to_ticks(start)
+            try:
+                return await robot.client.pipeline(messages)
+            except RobotError as e:
+                return [{"status": "error", "message": str(e)}]
+
+        replies = await asyncio.gather(*[run(robot) for robot in self.robots])
+        return self.skew_report(start, dict(zip([robot.name for robot in self.robots], replies)))
+
+    def skew_report(self, start, replies):
+        """Per-robot start and finish times relative to the agreed start, and their spread"""
+        robots = {}
+        started = []
+        finished = []
+        for robot in self.robots:
+            results = replies[robot.name]
+            entry = {"ok": all(result.get("status") == "success" for result in results),
+                     "offset_ms": round(robot.offset_ms, 3), "rtt_ms": round(robot.rtt_ms, 3)}
+            if "started_at" in results[0] and "finished_at" in results[-1]:
+                entry["start_ms"] = round(robot.to_host(results[0]["started_at"]) - start, 3)
+                entry["finish_ms"] = round(robot.to_host(results[-1]["finished_at"]) - start, 3)
+                started.append(entry["start_ms"])
+                finished.append(entry["finish_ms"])
+            else:
+                entry["error"] = results[-1].get("message")
+            robots[robot.name] = entry
+        return {
+            "robots": robots,
+            "start_skew_ms": round(max(started) - min(started), 3) if started else None,
+            "finish_skew_ms": round(max(finished) - min(finished), 3) if finished else None,
+        }
+
+    async def close(self):
+        await asyncio.gather(*[robot.client.close() for robot in self.robots])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+def start_simulated_fleet(count, max_offset_ms=100000):
+    """Start ``count`` simulated robots in this process, with skewed clocks; returns their addresses"""
+    import sim  # Only needed here; run from the bot folder
+    addresses = []
+    for index in range(count):
+        boot, port = sim.start_server(f"robot{index}", clock_offset_ms=random.randint(0, max_offset_ms))
+        addresses.append(("127.0.0.1", port))
+    return addresses
+
+async def run_fleet(robots, commands, lead_ms):
+    async with Fleet(robots) as fleet:
+        return await fleet.run_synchronized(commands, lead_ms)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a command sequence on several robots in sync")
+    parser.add_argument("robots", nargs="?", default="", help="comma-separated host[:port] list")
+    parser.add_argument("commands", nargs="+")
+    parser.add_argument("--sim", type=int, metavar="N", help="use N in-process simulated robots")
+    parser.add_argument("--lead", type=float, default=300, help="ms between scheduling and the start")
+    args = parser.parse_args()
+    if args.sim:
+        robots = start_simulated_fleet(args.sim)
+        commands = ([args.robots] if args.robots else []) + args.commands
+    else:
+        robots = args.robots.split(",")
+        commands = args.commands
+    print(json.dumps(asyncio.run(run_fleet(robots, commands, args.lead)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Host-side client for the robot command server
+
+Commands go over HTTP/1.1 keep-alive connections, so a sequence pays for one
+TCP handshake instead of one per command. Replies are read by their
+Content-Length, never truncated. Several commands can be pipelined on one
+connection: they are all written at once and the robot runs them in order.
+
+    async with RobotClient("192.168.1.100") as robot:
+        print(await robot.request("open_claw"))
+        print(await robot.pipeline(["extend_gripper", "close_claw", "retract_gripper"]))
+
+    robot = SyncRobotClient("192.168.1.100")   # Same API without asyncio
+    robot.request({"action": "move_to", "xyz": [120, 0, 80]})
+    robot.close()
+
+Usage: python robot_client.py <robot_ip> <command> [command ...]
+"""
+
+import asyncio
+import json
+import sys
+
+DEFAULT_PORT = 8080
+READ_ONLY_ACTIONS = ("status", "queue", "metrics", "logs")  # Safe to re-send after a timeout
+
+class RobotError(Exception):
+    """A request failed after all its retries"""
+
+def as_message(command):
+    """A command name or message dict as the JSON object the robot expects"""
+    return {"action": command} if isinstance(command, str) else command
+
+def discard(futures):
+    """Drop replies nobody will wait for, so asyncio does not warn about their errors"""
+    for future in futures:
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled():
+            future.exception()
+
+class Connection:
+    """One keep-alive HTTP connection; replies are matched to requests in order"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.waiting = []       # Futures of sent requests, oldest first
+        self.closed = False
+        self.read_task = None
+
+    async def open(self, timeout):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout)
+        self.read_task = asyncio.ensure_future(self.read_replies())
+
+    @property
+    def pending(self):
+        return len(self.waiting)
+
+    def send(self, message):
+        """Write one request; returns a future for its decoded JSON reply"""
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(f"POST / HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode("utf-8") + body)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        return future
+
+    async def read_reply(self):
+        """One response: (status code, JSON body, keep-alive)"""
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the robot")
+        code = int(status_line.split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = (await self.reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection":
+                keep_alive = value.strip().lower() != "close"
+        body = await self.reader.readexactly(length)
+        return code, json.loads(body.decode("utf-8")), keep_alive
+
+    async def read_replies(self):
+        try:
+            while not self.closed:
+                code, reply, keep_alive = await self.read_reply()
+                if not self.waiting:
+                    raise ConnectionError("Reply without a request")
+                future = self.waiting.pop(0)
+                if not future.done():
+                    future.set_result((code, reply))
+                if not keep_alive:
+                    self.close(ConnectionError("Connection closed by the robot"))
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            self.close(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+
+    def close(self, error=None):
+        """Close the socket and fail every request still waiting for a reply"""
+        if self.closed:
+            return
+        self.closed = True
+        for future in self.waiting:
+            if not future.done():
+                future.set_exception(error or ConnectionError("Connection closed"))
+        self.waiting = []
+        if self.read_task is not None and self.read_task is not asyncio.current_task():
+            self.read_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+class RobotClient:
+    """
+    Pool of up to ``pool_size`` connections to one robot
+
+    Each request waits at most ``timeout`` seconds for its reply. Requests
+    that were refused with a full command queue (503), or that hit a
+    connection error before they were written, are retried up to ``retries``
+    times with exponential backoff. Once a motion command has been written it
+    is never re-sent, since the robot may already have it: a timeout or a
+    lost connection raises RobotError instead. Read-only ones (status, queue,
+    metrics, logs) are re-sent.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, pool_size=2, timeout=30.0, retries=2, backoff=0.2):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = []
+        self.lock = asyncio.Lock()
+
+    async def connection(self):
+        """An idle pooled connection, a new one while the pool has room, else the least busy"""
+        async with self.lock:  # One caller at a time, so the pool never grows past pool_size
+            self.connections = [connection for connection in self.connections if not connection.closed]
+            idle = [connection for connection in self.connections if not connection.pending]
+            if idle:
+                return idle[0]
+            if len(self.connections) < self.pool_size:
+                connection = Connection(self.host, self.port)
+                await connection.open(self.timeout)
+                self.connections.append(connection)
+                return connection
+            return min(self.connections, key=lambda connection: connection.pending)
+
+    async def request(self, command, timeout=None, retries=None):
+        """Send one command; returns the robot's JSON reply"""
+        message = as_message(command)
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            future = None
+            try:
+                connection = await self.connection()
+                future = connection.send(message)
+                code, reply = await asyncio.wait_for(future, timeout)
+                if code != 503 or attempt == retries:
+                    return reply
+            except asyncio.TimeoutError:
+                if future is not None:
+                    connection.close()  # A late reply would be matched to the next request
+                    if message.get("action") not in READ_ONLY_ACTIONS:
+                        raise RobotError(f"No reply to {message} within {timeout}s")
+                if attempt == retries:
+                    raise RobotError(f"No reply to {message} within {timeout}s")
+            except OSError as e:
+                if future is not None and message.get("action") not in READ_ONLY_ACTIONS:
+                    raise RobotError(f"{message}: {e}")  # Written: the robot may run it anyway
+                if attempt == retries:
+                    raise RobotError(f"{message}: {e}")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def pipeline(self, commands, timeout=None):
+        """
+        Send several commands back to back on one connection; returns their
+        replies in order. The robot runs them in that order. If the
+        connection is lost, read-only commands are re-sent on their own and
+        anything else raises RobotError (see the class docstring).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        messages = [as_message(command) for command in commands]
+        connection = await self.connection()
+        futures = [connection.send(message) for message in messages]
+        replies = []
+        for message, future in zip(messages, futures):
+            try:
+                code, reply = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                connection.close()
+                discard(futures)
+                raise RobotError(f"No reply to {message} within {timeout}s")
+            except OSError as e:
+                if message.get("action") not in READ_ONLY_ACTIONS:
+                    discard(futures)
+                    raise RobotError(f"{message}: {e}")
+                reply = await self.request(message, timeout)  # Connection lost: safe to re-send
+            replies.append(reply)
+        return replies
+
+    async def watch(self, job_id):
+        """Yield the progress events of a job (newline-delimited JSON) until it finishes"""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            writer.write(f"GET /jobs/{job_id}/events HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode("utf-8"))
+            status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not status_line or int(status_line.split()[1]) != 200:
+                raise RobotError(f"Unknown job {job_id}")
+            while (await reader.readline()).strip():
+                pass  # Headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not line:
+                    return
+                yield json.loads(line.decode("utf-8"))
+        finally:
+            writer.close()
+
+    async def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class SyncRobotClient:
+    """RobotClient for scripts without asyncio; the connections live in a private event loop"""
+
+    def __init__(self, host, port=DEFAULT_PORT, **options):
+        self.loop = asyncio.new_event_loop()
+        self.client = RobotClient(host, port, **options)
+
+    def request(self, command, timeout=None, retries=None):
+        return self.loop.run_until_complete(self.client.request(command, timeout, retries))
+
+    def pipeline(self, commands, timeout=None):
+        return self.loop.run_until_complete(self.client.pipeline(commands, timeout))
+
+    def close(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    with SyncRobotClient(sys.argv[1]) as robot:
+        for reply in robot.pipeline(sys.argv[2:]):
+            print(json.dumps(reply))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Host-side simulator for running boot.py on CPython
+
+Stands in for the MicroPython modules boot.py needs (machine, network,
+webrepl, micropython, and time on a virtual clock), so the motion and server
+code runs off-device:
+
+    import sim
+    boot = sim.load_boot()              # Instant virtual time
+    boot.dance_movement()               # Whole dance in milliseconds
+    print(sim.clock.now_us(), sim.machine.pwm_outputs[4].log[:3])
+
+Choreographies and the IK grid are read from the bot folder; the files the
+robot writes (pose.json, wifi.json) go to the temp folder, so the source
+tree stays clean whatever the working directory. load_boot(speed=1) keeps real time for clients talking to
+boot.start_command_server() over sockets; start_server() does that on a
+free port, once per simulated robot. ``python -m sim`` plays the dance and
+reports its timing.
+"""
+
+import asyncio
+import importlib.util
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from . import machine, micropython, network, vtime, webrepl
+from .clock import VirtualLoopPolicy
+
+clock = vtime.clock
+BOOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOT_PATH = os.path.join(BOOT_DIR, 'boot.py')
+
+def install(speed=None):
+    """Register the stand-in modules and make asyncio loops use the virtual clock"""
+    clock.set_speed(speed)
+    for module in (machine, network, webrepl, micropython):
+        sys.modules[module.__name__.rpartition('.')[2]] = module
+    asyncio.set_event_loop_policy(VirtualLoopPolicy(clock))
+
+def time_module(offset_ms):
+    """A copy of the virtual time module whose ticks run ``offset_ms`` ahead"""
+    spec = importlib.util.spec_from_file_location(f'{__name__}.vtime_{offset_ms}', vtime.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.offset_us = offset_ms * 1000
+    return module
+
+def load_boot(path=BOOT_PATH, speed=None, name='boot', clock_offset_ms=0):
+    """
+    Import boot.py (without running main()) against the simulator; returns
+    the module. Each ``name`` is a separate robot with its own joints and
+    queues; ``clock_offset_ms`` skews its ticks_ms() from the others'. Its
+    pose and WiFi cache files go to the temp folder, so several robots in
+    one process do not share them.
+    """
+    install(speed)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    real_time = sys.modules['time']
+    # boot.py's "import time" gets the virtual clock
+    sys.modules['time'] = time_module(clock_offset_ms) if clock_offset_ms else vtime
+    try:
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.modules['time'] = real_time
+    folder = os.path.dirname(path)
+    module.CHOREO_DIR = os.path.join(folder, module.CHOREO_DIR)
+    module.IK_GRID_FILE = os.path.join(folder, module.IK_GRID_FILE)
+    module.POSE_FILE = os.path.join(tempfile.gettempdir(), f'sim_{name}_pose.json')
+    module.WIFI_FILE = os.path.join(tempfile.gettempdir(), f'sim_{name}_wifi.json')
+    return module
+
+def start_server(name='boot', speed=1, clock_offset_ms=0):
+    """Load a robot and run its command server on a thread; returns (module, port)"""
+    boot = load_boot(speed=speed, name=name, clock_offset_ms=clock_offset_ms)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        boot.PORT = probe.getsockname()[1]
+    threading.Thread(target=boot.start_command_server, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', boot.PORT), timeout=1).close()
+            return boot, boot.PORT
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Simulated robot {name} did not start')
@@ -0,0 +1,49 @@
+"""
+Usage (from the bot folder):
+    python -m sim dance [choreography]     Play a choreography on virtual time and report its timing
+    python -m sim serve [port] [speed]     Run main() with the simulated WiFi, in real time by default
+    python -m sim ikgrid [path]            Build the IK grid for the robot (ik_grid.bin next to boot.py)
+"""
+
+import os
+import sys
+import time
+
+import sim
+
+def dance(name='dance'):
+    boot = sim.load_boot()
+    start_us = sim.clock.now_us()
+    wall = time.perf_counter()
+    result = boot.play(name)
+    if result["status"] != "success":
+        raise SystemExit(result["message"])
+    boot.motion_engine.run_until_idle()
+    wall_ms = (time.perf_counter() - wall) * 1000
+    print(f"{name}: {(sim.clock.now_us() - start_us) // 1000} ms of motion in {wall_ms:.1f} ms")
+    for joint in boot.JOINTS:
+        print(f"  {joint.name}: {len(joint.pwm.log)} duty writes, ends at {joint.position}°")
+
+def serve(port=8080, speed=1):
+    boot = sim.load_boot(speed=speed)
+    boot.PORT = port
+    boot.main()
+
+def ikgrid(path=None):
+    boot = sim.load_boot()
+    boot.build_ik_grid(path or boot.IK_GRID_FILE)
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == 'dance':
+        dance(*sys.argv[2:3])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'serve':
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1
+        serve(port, speed)
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'ikgrid':
+        ikgrid(*sys.argv[2:3])
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Virtual clock for the simulator
+
+Time is kept in integer microseconds. With ``speed=None`` the clock only
+moves when something sleeps, so sleeps return at once and a dance runs in
+milliseconds; give a ``speed`` (1 for real time, 10 for ten times faster)
+when real clients talk to the simulated robot over sockets, since their
+timeouts run on wall-clock time. Instant mode is for single-threaded runs:
+worker threads that sleep at the same time each push the clock forward.
+"""
+
+import asyncio
+import math
+import selectors
+import threading
+import time
+
+TICKS_PERIOD = 1 << 30  # MicroPython's ticks wrap at 2**30 on the ESP32
+
+
+class VirtualClock:
+    """Microsecond clock that runs instantly or at a multiple of real time"""
+
+    def __init__(self, speed=None):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.base_us = 0
+        self.real_start = time.perf_counter()
+
+    def now_us(self):
+        if self.speed is None:
+            return self.base_us
+        return self.base_us + int((time.perf_counter() - self.real_start) * self.speed * 1000000)
+
+    def advance_us(self, us):
+        """Move the clock forward; in scaled mode this waits the matching real time"""
+        if us <= 0:
+            return
+        if self.speed is None:
+            with self.lock:
+                self.base_us += int(us)
+        else:
+            time.sleep(us / 1000000 / self.speed)
+
+    def set_speed(self, speed):
+        """Switch between instant (None) and scaled mode without a jump in time"""
+        with self.lock:
+            self.base_us = self.now_us()
+            self.real_start = time.perf_counter()
+            self.speed = speed
+
+
+class VirtualSelector:
+    """Selector for the event loop that skips idle waits on the virtual clock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if timeout is None:
+            return self.selector.select(None)  # Nothing scheduled: wait for I/O
+        if self.clock.speed is not None:
+            return self.selector.select(timeout / self.clock.speed)
+        events = self.selector.select(0)
+        if not events:
+            # Round up, or a timer due in under 1 us would never become ready
+            self.clock.advance_us(math.ceil(timeout * 1000000))
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """asyncio loop whose timers (sleep, wait_for) run on the virtual clock"""
+
+    def __init__(self, clock):
+        super().__init__(VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now_us() / 1000000
+
+
+class VirtualLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    """Makes asyncio.run() and new_event_loop() create virtual-time loops"""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def new_event_loop(self):
+        return VirtualEventLoop(self.clock)
+
+
+clock = VirtualClock()  # Shared by every simulated module and robot
@@ -0,0 +1,104 @@
+"""
+Stand-in for MicroPython's ``machine`` module
+
+PWM outputs record every duty_ns() write with its virtual time, so tests can
+check what the servos were told and when. ``pwm_outputs`` maps pin numbers
+to the PWM objects created on them.
+"""
+
+from .vtime import clock
+
+pwm_outputs = {}   # Pin id -> the latest PWM created on it
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.level = value or 0
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        self.level = 1 if level else 0
+
+    def on(self):
+        self.level = 1
+
+    def off(self):
+        self.level = 0
+
+    def __call__(self, level=None):
+        return self.value(level)
+
+
+class PWM:
+    """Records duty writes as (virtual_us, duty_ns) in ``log``"""
+
+    def __init__(self, pin, freq=0, duty_ns=None, duty_u16=None):
+        self.pin = pin
+        self.frequency = freq
+        self.duty = 0
+        self.log = []
+        pwm_outputs[getattr(pin, 'id', pin)] = self
+        if duty_ns is not None:
+            self.duty_ns(duty_ns)
+        elif duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, hz=None):
+        if hz is None:
+            return self.frequency
+        self.frequency = hz
+
+    def duty_ns(self, ns=None):
+        if ns is None:
+            return self.duty
+        self.duty = ns
+        self.log.append((clock.now_us(), ns))
+
+    def duty_u16(self, value=None):
+        period_ns = 1000000000 // self.frequency if self.frequency else 0
+        if value is None:
+            return self.duty * 65535 // period_ns if period_ns else 0
+        self.duty_ns(value * period_ns // 65535)
+
+    def deinit(self):
+        pwm_outputs.pop(getattr(self.pin, 'id', self.pin), None)
+
+
+class I2C:
+    """Keeps the last bytes written to each (address, register)"""
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.memory = {}
+        self.log = []
+
+    def writeto_mem(self, address, register, buf):
+        self.memory[(address, register)] = bytes(buf)
+        self.log.append((clock.now_us(), address, register, bytes(buf)))
+
+    def readfrom_mem(self, address, register, nbytes):
+        return self.memory.get((address, register), bytes(nbytes))
+
+    def scan(self):
+        return sorted(set(address for address, register in self.memory))
+
+
+def freq(hz=None):
+    return 160000000
+
+def unique_id():
+    return b'\x00\x00\x00\x00\x00\x00'
+
+def idle():
+    pass
+
+def reset():
+    raise SystemExit('machine.reset()')
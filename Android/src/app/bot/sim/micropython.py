@@ -0,0 +1,16 @@
+"""Stand-in for MicroPython's ``micropython`` module"""
+
+def const(value):
+    return value
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def opt_level(level=None):
+    return 0
+
+def schedule(function, argument):
+    function(argument)
+
+def mem_info(verbose=False):
+    pass
@@ -0,0 +1,103 @@
+"""
+Stand-in for MicroPython's ``network`` module
+
+The simulated access point is set up with module attributes before
+connecting. Times are on the virtual clock:
+- ``connect_ms`` is the association itself.
+- ``scan_ms`` is added when connect() is not given the BSSID, and is the cost of scan().
+- ``dhcp_ms`` is added unless a static address was set with ifconfig().
+
+With ``reachable`` False, or a BSSID other than ``bssid``, connect() never
+succeeds. Like the ESP32 port, config() has no 'bssid' parameter, so
+boot.py has to learn it from a scan.
+"""
+
+from .vtime import clock
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+STAT_CONNECT_FAIL = 203
+
+ssid = ''
+bssid = b'\x02\x00\x00\x00\x00\x01'
+channel = 6
+connect_ms = 300
+scan_ms = 1200
+dhcp_ms = 500
+reachable = True
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self.enabled = False
+        self.connected_at = None  # Virtual us when association completes
+        self.failed = False       # The last connect() found no matching access point
+        self.static = False       # Address set with ifconfig() rather than DHCP
+        self.settings = {'ssid': ssid, 'channel': channel, 'mac': b'\x02\x00\x00\x00\x00\x02'}
+        self.addresses = ('192.168.4.2', '255.255.255.0', '192.168.4.1', '192.168.4.1')
+
+    def active(self, enabled=None):
+        if enabled is None:
+            return self.enabled
+        self.enabled = bool(enabled)
+        if not self.enabled:
+            self.connected_at = None
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        if not self.enabled:
+            raise OSError('Wifi Not Started')
+        if ssid is not None:
+            self.settings['ssid'] = ssid
+        self.failed = not reachable or (bssid is not None and bytes(bssid) != globals()['bssid'])
+        if self.failed:
+            self.connected_at = None
+            return
+        delay_ms = connect_ms + (scan_ms if bssid is None else 0) + (0 if self.static else dhcp_ms)
+        self.connected_at = clock.now_us() + delay_ms * 1000
+        self.settings['channel'] = channel
+
+    def disconnect(self):
+        self.connected_at = None
+        self.failed = False
+
+    def isconnected(self):
+        return self.connected_at is not None and clock.now_us() >= self.connected_at
+
+    def status(self, param=None):
+        if param == 'rssi':
+            return -50
+        if self.isconnected():
+            return STAT_GOT_IP
+        if self.connected_at is not None:
+            return STAT_CONNECTING
+        return STAT_NO_AP_FOUND if self.failed else STAT_IDLE
+
+    def ifconfig(self, addresses=None):
+        if addresses is None:
+            return self.addresses
+        if addresses == 'dhcp':
+            self.static = False
+        else:
+            self.addresses = tuple(addresses)
+            self.static = True
+
+    def config(self, *names, **settings):
+        if settings:
+            self.settings.update(settings)
+            return None
+        if names[0] not in self.settings:
+            raise ValueError('unknown config param')
+        return self.settings[names[0]]
+
+    def scan(self):
+        clock.advance_us(scan_ms * 1000)
+        if not reachable:
+            return []
+        return [(ssid.encode(), bssid, channel, -50, 3, False)]
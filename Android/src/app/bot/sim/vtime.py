@@ -0,0 +1,42 @@
+"""
+MicroPython ``time`` on the virtual clock
+
+boot.py is imported with this module standing in for ``time``. Anything it
+does not define (time.time(), localtime() and so on) comes from CPython's.
+Copies with a nonzero ``offset_us`` (see sim.time_module()) give simulated
+robots ticks that disagree, as robots booted at different times do.
+"""
+
+import time as _time
+
+from .clock import TICKS_PERIOD, clock
+
+offset_us = 0
+
+
+def ticks_us():
+    return (clock.now_us() + offset_us) % TICKS_PERIOD
+
+def ticks_ms():
+    return (clock.now_us() + offset_us) // 1000 % TICKS_PERIOD
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+def ticks_diff(end, start):
+    """Signed difference of two ticks values, correct across a wrap"""
+    half = TICKS_PERIOD // 2
+    return (end - start + half) % TICKS_PERIOD - half
+
+def sleep_us(us):
+    clock.advance_us(us)
+
+def sleep_ms(ms):
+    clock.advance_us(ms * 1000)
+
+def sleep(seconds):
+    clock.advance_us(seconds * 1000000)
+
+
+def __getattr__(name):
+    return getattr(_time, name)
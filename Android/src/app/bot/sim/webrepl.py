@@ -0,0 +1,11 @@
+"""Stand-in for MicroPython's ``webrepl`` module"""
+
+running = False
+
+def start(port=8266, password=None):
+    global running
+    running = True
+
+def stop():
+    global running
+    running = False
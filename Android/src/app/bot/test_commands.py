@@ -2,17 +2,40 @@
 """
 Test script for sending JSON commands to the ESP32-C3 robot
 Usage: python test_commands.py <robot_ip> [command]
+       python test_commands.py bench [robot_ip] [--clients N] [--rate HZ] [--http] [--sim] ...
 """
 
+import argparse
+import http.client
+import math
+import random
 import socket
 import json
+import struct
 import sys
+import threading
 import time
 
+from robot_client import SyncRobotClient
+
 # Default robot IP and port
 ROBOT_IP = "192.168.1.100"  # Replace with your ESP32-C3 IP address
 ROBOT_PORT = 8080
 
+# Binary protocol (see README_commands.md); one int16 target per joint
+BINARY_MAGIC = 0xA5
+OP_MOVE = 1
+OP_ACTION = 2
+OP_STOP = 3
+NUM_JOINTS = 4
+
+# UDP teleop channel; targets are Q4 angles (1/16 degree)
+TELEOP_PORT = 8081
+TELEOP_MAGIC = 0xA6
+TELEOP_FORMAT = '<BBHI' + 'h' * NUM_JOINTS
+TELEOP_ACK_FORMAT = '<BBHI'
+TELEOP_FLAG_START = 0x01  # Starts a session; needed again after a stop or hold
+
 def send_json_command(ip, port, command):
     """Send a JSON command to the robot and return the response"""
     try:
@@ -31,9 +54,11 @@ def send_json_command(ip, port, command):
         # Send message
         sock.send(json_message.encode('utf-8'))
         
-        # Receive response
-        response = sock.recv(1024)
-        response_str = response.decode('utf-8')
+        # Receive response; the robot closes the connection after it
+        chunks = [sock.recv(4096)]
+        while chunks[-1]:
+            chunks.append(sock.recv(4096))
+        response_str = b"".join(chunks).decode('utf-8')
         print(f"Response: {response_str}")
         
         # Parse response
@@ -52,6 +77,59 @@ def send_json_command(ip, port, command):
         except:
             pass
 
+def run_job(ip, port, command, poll_interval=0.5, timeout=120):
+    """
+    Submit a command as an async job and poll it until it finishes
+
+    The submission returns at once with a job id, so long actions such as
+    dance never hit the socket timeout and never get re-sent by a retry.
+    Returns the job's final result.
+    """
+    submitted = send_message(ip, port, {"action": command, "async": True})
+    job_id = submitted.get("job_id")
+    if job_id is None:
+        return submitted
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = send_message(ip, port, {"action": "status", "job_id": job_id})
+        if status.get("state") in ("done", "error", "cancelled"):
+            return status.get("result", status)
+        if status.get("state") == "running":
+            print(f"Job {job_id}: segment {status.get('segment')}/{status.get('segments')}, "
+                  f"ETA {status.get('eta_ms')}ms")
+        elif status.get("status") == "error":
+            return status
+        time.sleep(poll_interval)
+    return {"status": "error", "message": f"Job {job_id} did not finish within {timeout}s"}
+
+def send_message(ip, port, message):
+    """Send one JSON message and return the decoded JSON reply"""
+    try:
+        with socket.create_connection((ip, port), timeout=10) as sock:
+            sock.sendall(json.dumps(message).encode('utf-8'))
+            # Read until the robot closes: replies such as metrics exceed one recv()
+            chunks = [sock.recv(4096)]
+            while chunks[-1]:
+                chunks.append(sock.recv(4096))
+            return json.loads(b"".join(chunks).decode('utf-8'))
+    except Exception as e:
+        print(f"Error: {e}")
+        return {"status": "error", "message": str(e)}
+
+def send_binary_command(ip, port, opcode, targets=(), duration_ms=0):
+    """Send a binary command frame; returns (status, duration_ms) or None"""
+    values = list(targets) + [-1] * (NUM_JOINTS - len(targets))
+    frame = struct.pack('<BBH' + 'h' * NUM_JOINTS, BINARY_MAGIC, opcode, duration_ms, *values)
+    try:
+        with socket.create_connection((ip, port), timeout=10) as sock:
+            sock.sendall(frame)
+            reply = sock.recv(4)
+        magic, status, planned_ms = struct.unpack('<BBH', reply)
+        return status, planned_ms
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
 def main():
     """Main function to test robot commands"""
     
@@ -66,7 +144,7 @@ def main():
     if len(sys.argv) >= 3:
         command = sys.argv[2]
         # Send single command
-        result = send_json_command(robot_ip, ROBOT_PORT, command)
+        result = run_job(robot_ip, ROBOT_PORT, command)
         print(f"Result: {result}")
         return
     
@@ -92,7 +170,7 @@ def main():
     # Test each command with delay
     for cmd in commands:
         print(f"\n--- Testing: {cmd} ---")
-        result = send_json_command(robot_ip, ROBOT_PORT, cmd)
+        result = run_job(robot_ip, ROBOT_PORT, cmd)
         print(f"Status: {result.get('status', 'unknown')}")
         print(f"Message: {result.get('message', 'no message')}")
         
@@ -118,17 +196,299 @@ def test_sequence():
         "retract_gripper"
     ]
     
-    for cmd in sequence:
+    # Pipelined on one keep-alive connection: the robot runs the commands
+    # back to back in order, with no handshake or fixed pause between them
+    with SyncRobotClient(ROBOT_IP, ROBOT_PORT, timeout=60) as robot:
+        results = robot.pipeline(sequence)
+    for cmd, result in zip(sequence, results):
         print(f"\nExecuting: {cmd}")
-        result = send_json_command(ROBOT_IP, ROBOT_PORT, cmd)
         if result.get('status') == 'success':
             print(f"✓ {result.get('message')}")
         else:
             print(f"✗ {result.get('message')}")
-        time.sleep(2)  # Wait 2 seconds between movements
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def teleop_load_test(ip, port=TELEOP_PORT, rate_hz=50, seconds=5.0, drop=0.05, reorder=0.05):
+    """
+    Stream teleop setpoints and measure setpoint latency and loss handling
+
+    Sweeps the turntable back and forth at ``rate_hz``. A fraction of the
+    datagrams is deliberately not sent (``drop``) or sent after its successor
+    (``reorder``), which the robot must reject as stale. Latency is the round
+    trip from sending a setpoint to its acknowledgement, which the robot sends
+    once the setpoint has been written to the PWM. Setpoints replaced by a
+    newer one before the next control tick are never acknowledged, so they
+    count as unacknowledged along with datagrams lost on the way.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    start = time.monotonic()
+    latencies = []
+    counts = {"applied": 0, "stale": 0, "malformed": 0, "stopped": 0}
+    stop = threading.Event()
+    restart = threading.Event()  # The robot was stopped: start a new session
+    restart.set()
+
+    def receive():
+        while not stop.is_set():
+            try:
+                data = sock.recv(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            magic, status, seq, stamp = struct.unpack_from(TELEOP_ACK_FORMAT, data)
+            if status == 0:
+                counts["applied"] += 1
+                latencies.append((time.monotonic() - start) * 1000 - stamp)
+            elif status == 1:
+                counts["stale"] += 1
+            elif status == 3:
+                counts["stopped"] += 1
+                restart.set()
+            else:
+                counts["malformed"] += 1
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    sent = dropped = reordered = 0
+    held = None
+    total = int(seconds * rate_hz)
+    for seq in range(1, total + 1):
+        angle_q = int((90 + 45 * math.sin(seq * 2 * math.pi / rate_hz)) * 16)
+        stamp = int((time.monotonic() - start) * 1000)
+        flags = TELEOP_FLAG_START if restart.is_set() else 0
+        packet = struct.pack(TELEOP_FORMAT, TELEOP_MAGIC, flags, seq & 0xFFFF, stamp, angle_q, -1, -1, -1)
+        roll = random.random()
+        if roll < drop:
+            dropped += 1
+        elif roll < drop + reorder and held is None:
+            held = packet  # Sent after the next one, so it arrives stale
+            reordered += 1
+        else:
+            sock.sendto(packet, (ip, port))
+            sent += 1
+            restart.clear()
+            if held is not None:
+                sock.sendto(held, (ip, port))
+                sent += 1
+                held = None
+        # Keep the send schedule fixed rather than drifting with each loop
+        time.sleep(max(0.0, start + seq / rate_hz - time.monotonic()))
+    time.sleep(0.5)
+    stop.set()
+    receiver.join()
+    sock.close()
+
+    result = {
+        "rate_hz": rate_hz,
+        "sent": sent,
+        "dropped": dropped,
+        "reordered": reordered,
+        "applied": counts["applied"],
+        "stale": counts["stale"],
+        "malformed": counts["malformed"],
+        "stopped": counts["stopped"],
+        "unacknowledged": sent - counts["applied"] - counts["stale"] - counts["malformed"] - counts["stopped"],
+        "latency_ms_p50": percentile(latencies, 0.5),
+        "latency_ms_p95": percentile(latencies, 0.95),
+        "latency_ms_max": max(latencies) if latencies else None,
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+# Command server benchmark
+LATENCY_BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+def latency_summary(values):
+    """Percentiles, mean and a bucketed histogram of latencies in ms"""
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for value in values:
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and value > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        counts[index] += 1
+    labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    rounded = lambda value: None if value is None else round(value, 3)
+    return {
+        "count": len(values),
+        "p50": rounded(percentile(values, 0.5)),
+        "p90": rounded(percentile(values, 0.9)),
+        "p95": rounded(percentile(values, 0.95)),
+        "p99": rounded(percentile(values, 0.99)),
+        "max": rounded(max(values)) if values else None,
+        "mean": rounded(sum(values) / len(values)) if values else None,
+        "histogram": dict(zip(labels, counts)),
+    }
+
+class TextClient:
+    """Legacy protocol: a new connection per request, closed by the robot after its reply"""
+
+    def __init__(self, ip, port):
+        self.address = (ip, port)
+
+    def request(self, payload, start):
+        """Send one request; returns (connect_ms, first_byte_ms, total_ms, reply) timed from ``start``"""
+        with socket.create_connection(self.address, timeout=10) as sock:
+            connect_ms = (time.perf_counter() - start) * 1000
+            sock.sendall(payload)
+            chunks = [sock.recv(4096)]
+            first_byte_ms = (time.perf_counter() - start) * 1000
+            while chunks[-1]:
+                chunks.append(sock.recv(4096))
+        return connect_ms, first_byte_ms, (time.perf_counter() - start) * 1000, b"".join(chunks)
+
+    def close(self):
+        pass
+
+class HttpClient:
+    """HTTP/1.1 POSTs on one keep-alive connection, as the Android app sends them"""
+
+    def __init__(self, ip, port):
+        self.connection = http.client.HTTPConnection(ip, port, timeout=10)
+        self.connected = False
+
+    def request(self, payload, start):
+        connect_ms = None
+        if not self.connected:
+            self.connection.connect()
+            self.connected = True
+            connect_ms = (time.perf_counter() - start) * 1000
+        try:
+            self.connection.request("POST", "/", body=payload, headers={"Content-Type": "application/json"})
+            response = self.connection.getresponse()
+            first_byte_ms = (time.perf_counter() - start) * 1000
+            reply = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        return connect_ms, first_byte_ms, (time.perf_counter() - start) * 1000, reply
+
+    def close(self):
+        self.connection.close()
+        self.connected = False
+
+def benchmark(ip, port, message, clients=4, seconds=10.0, rate_hz=None, use_http=False):
+    """
+    Load the command server from ``clients`` threads and measure latency
+
+    Closed loop (no ``rate_hz``): each client sends its next request as soon
+    as the previous reply arrives. Open loop: requests are due at a fixed
+    total rate whatever the replies do, and latency is timed from when a
+    request was due, so a backed-up server shows up as latency instead of
+    silently lowering the load. Returns connect, first-byte and total
+    latency summaries in ms plus throughput.
+    """
+    payload = json.dumps(message).encode("utf-8")
+    lock = threading.Lock()
+    latencies = {"connect": [], "first_byte": [], "total": []}
+    counts = {"sent": 0, "ok": 0, "errors": 0}
+    errors = {}
+    next_index = [0]
+    begin = time.perf_counter()
+    end = begin + seconds
+
+    def worker():
+        client = (HttpClient if use_http else TextClient)(ip, port)
+        while True:
+            if rate_hz:
+                with lock:
+                    index = next_index[0]
+                    next_index[0] += 1
+                start = begin + index / rate_hz
+                if start >= end:
+                    break
+                time.sleep(max(0.0, start - time.perf_counter()))
+            else:
+                start = time.perf_counter()
+                if start >= end:
+                    break
+            try:
+                connect_ms, first_byte_ms, total_ms, reply = client.request(payload, start)
+                ok = json.loads(reply.decode("utf-8")).get("status") in ("success", "accepted")
+                error = None if ok else "status"
+            except Exception as e:
+                error = type(e).__name__
+            with lock:
+                counts["sent"] += 1
+                if error is None:
+                    counts["ok"] += 1
+                    if connect_ms is not None:
+                        latencies["connect"].append(connect_ms)
+                    latencies["first_byte"].append(first_byte_ms)
+                    latencies["total"].append(total_ms)
+                else:
+                    counts["errors"] += 1
+                    errors[error] = errors.get(error, 0) + 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    return {
+        "target": f"{ip}:{port}",
+        "protocol": "http" if use_http else "text",
+        "mode": "open" if rate_hz else "closed",
+        "clients": clients,
+        "rate_hz": rate_hz,
+        "seconds": round(elapsed, 3),
+        "message": message,
+        "sent": counts["sent"],
+        "ok": counts["ok"],
+        "errors": counts["errors"],
+        "error_kinds": errors,
+        "throughput_rps": round(counts["ok"] / elapsed, 2),
+        "latency_ms": {name: latency_summary(values) for name, values in latencies.items()},
+    }
+
+def benchmark_main(argv):
+    parser = argparse.ArgumentParser(prog="test_commands.py bench",
+                                     description="Load and latency benchmark of the command server")
+    parser.add_argument("ip", nargs="?", default=ROBOT_IP)
+    parser.add_argument("--port", type=int, default=ROBOT_PORT)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, help="open loop: requests per second in total")
+    parser.add_argument("--http", action="store_true", help="HTTP keep-alive instead of one connection per request")
+    parser.add_argument("--message", default='{"action": "queue"}',
+                        help="JSON message to send (default: queue, which never moves the arm)")
+    parser.add_argument("--sim", type=float, nargs="?", const=1.0, metavar="SPEED",
+                        help="benchmark a simulated server in this process instead of a robot")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    ip, port = args.ip, args.port
+    if args.sim is not None:
+        import sim  # Only needed here; run from the bot folder
+        ip, port = "127.0.0.1", sim.start_server(speed=args.sim)[1]
+    result = benchmark(ip, port, json.loads(args.message), args.clients, args.seconds, args.rate, args.http)
+    metrics = send_message(ip, port, {"action": "metrics"})
+    if metrics.get("status") == "success":
+        result["server_metrics"] = metrics
+    if args.sim is not None:
+        result["target"] = f"sim x{args.sim}"
+    print(json.dumps({key: value for key, value in result.items() if key != "server_metrics"}, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return result
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "sequence":
         test_sequence()
+    elif len(sys.argv) > 1 and sys.argv[1] == "teleop":
+        teleop_load_test(sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1")
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark_main(sys.argv[2:])
     else:
         main()
\ No newline at end of file
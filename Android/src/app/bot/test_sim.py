@@ -0,0 +1,225 @@
+"""
+Timing and robustness checks that run boot.py in the simulator
+
+Run from the bot folder: python -m pytest test_sim.py
+Each test loads its own robot on instant virtual time, so a minute of motion
+takes milliseconds and timing is exact.
+"""
+
+import asyncio
+import itertools
+import socket
+import struct
+import time
+
+import pytest
+
+import sim
+
+robot_names = itertools.count()
+
+@pytest.fixture
+def boot():
+    return sim.load_boot(name=f'test_robot{next(robot_names)}')
+
+def run_robot(boot, body):
+    """Run ``body()`` with the motion engine and motion task going; both must survive it"""
+    async def main():
+        engine = asyncio.create_task(boot.motion_engine.run())
+        motion = asyncio.create_task(boot.motion_task(boot.command_queue))
+        try:
+            result = await asyncio.wait_for(body(), 600)  # Virtual seconds: a wedged robot fails, not hangs
+            assert not engine.done(), "motion engine task died"
+            assert not motion.done(), "motion task died"
+            return result
+        finally:
+            engine.cancel()
+            motion.cancel()
+    return asyncio.run(main())
+
+def submit(boot, message):
+    """Queue a text command; returns its job"""
+    code, reply, job, watch = boot.route_message(message)
+    assert job is not None, reply
+    return job
+
+
+def test_dance_runs_on_virtual_time(boot):
+    player = boot.ChoreographyPlayer('dance')
+    player.scan()
+    player.close()
+    start_us = sim.clock.now_us()
+    wall = time.perf_counter()
+    boot.dance_movement()
+    elapsed_ms = (sim.clock.now_us() - start_us) // 1000
+    # Each keyframe may end up to one control period late, never early
+    assert player.total_ms <= elapsed_ms <= player.total_ms + player.total_keyframes * boot.CONTROL_PERIOD_MS
+    assert time.perf_counter() - wall < 5
+    assert not boot.motion_engine.busy()
+    assert all(joint.pwm.log for joint in boot.JOINTS)
+
+class Writer:
+    """Collects what a connection handler writes back"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def interrupt_dance(boot, interrupt):
+    """Five seconds into the dance, await ``interrupt()``; the dance must stop within two ticks"""
+    async def body():
+        job = submit(boot, '{"action": "play", "name": "dance"}')
+        await asyncio.sleep(5)
+        assert job.state == 'running'
+        assert 0 < job.snapshot()["progress"] < 1
+        stopped_us = sim.clock.now_us()
+        await interrupt()
+        result = await boot.wait_result(job)
+        return job, result, sim.clock.now_us() - stopped_us
+    job, result, stop_us = run_robot(boot, body)
+    assert job.state == 'cancelled'
+    assert result["message"] == "Preempted by stop/hold"
+    assert stop_us <= 2 * boot.CONTROL_PERIOD_MS * 1000
+    assert not boot.motion_engine.busy()
+
+@pytest.mark.parametrize('message', ['stop', 'Stop', ' HOLD ', '{"action": "STOP"}', '{"action": "Hold", "async": true}'])
+def test_stop_preempts_dance(boot, message):
+    async def interrupt():
+        code, reply, job, watch = boot.route_message(message)
+        assert job is None and reply["status"] == "success"
+    interrupt_dance(boot, interrupt)
+
+@pytest.mark.parametrize('action', ['stop', 'hold'])
+def test_binary_stop_preempts_dance(boot, action):
+    async def interrupt():
+        reader = asyncio.StreamReader()
+        reader.feed_data(boot.pack_binary_command(boot.OP_ACTION, [boot.ACTION_NAMES.index(action)]))
+        reader.feed_eof()
+        writer = Writer()
+        await boot.handle_client(reader, writer)
+        assert struct.unpack(boot.BINARY_REPLY_FORMAT, writer.data)[1] == 0
+    interrupt_dance(boot, interrupt)
+
+def test_late_tick_still_writes_the_target(boot):
+    claw = boot.JOINTS_BY_NAME['claw']
+    trajectory = boot.compile_trajectory([(claw, 0, 90, 45)])
+    boot.motion_engine.play(trajectory)
+    for now in (0, 20, 47):  # The last tick is past the duration, before the final frame
+        boot.motion_engine.tick(now)
+    assert boot.motion_engine.current is None and claw.position == 90
+    boot.motion_engine.tick(60)
+    assert boot.pwm_scheduler.written[claw.index] == trajectory.buffers[0][-1] == claw.angle_q_to_duty_ns(90 * 16)
+    assert not boot.motion_engine.busy()
+
+def test_preset_commands_coalesce(boot):
+    async def body():
+        start_us = sim.clock.now_us()
+        jobs = [submit(boot, action) for action in
+                ('turn_table_right', 'turn_table_left', 'turn_table_right', 'turn_table_left')]
+        results = [await boot.wait_result(job) for job in jobs]
+        return results, sim.clock.now_us() - start_us
+    results, elapsed_us = run_robot(boot, body)
+    assert [result["coalesced"] for result in results] == [4, 4, 4, 4]
+    assert all(result["status"] == "success" for result in results)
+    assert elapsed_us < 2 * boot.CONTROL_PERIOD_MS * 1000  # Left and right cancel out: no motion
+
+def test_pick_sequence_still_moves(boot):
+    # Each command moves other joints than the one before, so none may fold away
+    sequence = ('open_claw', 'extend_gripper', 'close_claw', 'retract_gripper')
+    async def body():
+        jobs = [submit(boot, action) for action in sequence]
+        return [await boot.wait_result(job) for job in jobs]
+    results = run_robot(boot, body)
+    assert all(result["status"] == "success" and "coalesced" not in result for result in results)
+    claw = boot.JOINTS_BY_NAME['claw']
+    duties = [duty_ns for _, duty_ns in claw.pwm.log]
+    assert max(duties) == claw.angle_q_to_duty_ns(90 * 16)  # Opened fully before closing again
+    assert duties[-1] == claw.angle_q_to_duty_ns(0)
+    for name in ('arm_c', 'arm_d'):
+        arm = boot.JOINTS_BY_NAME[name]
+        assert max(duty_ns for _, duty_ns in arm.pwm.log) == arm.angle_q_to_duty_ns(45 * 16)
+
+def test_bad_choreography_fails_before_moving(boot, tmp_path):
+    (tmp_path / 'bad.jsonl').write_text('{"move": {"turntable": 40}}\n{"move": {"elbow": 40}}\n')
+    boot.CHOREO_DIR = str(tmp_path)
+    async def body():
+        result = await boot.wait_result(submit(boot, '{"action": "play", "name": "bad"}'))
+        after = await boot.wait_result(submit(boot, 'open_claw'))
+        return result, after
+    result, after = run_robot(boot, body)
+    assert result["status"] == "error"
+    assert "Unknown joint elbow" in result["message"]
+    assert after["status"] == "success"
+    assert boot.JOINTS_BY_NAME['turntable'].position == 0
+
+def test_bad_line_during_playback_keeps_engine_alive(boot, tmp_path, monkeypatch):
+    # A line that goes bad after the up-front check, e.g. a file edited while it plays
+    (tmp_path / 'bad.jsonl').write_text('{"move": {"turntable": 40}}\n{"wait": 100}\n{oops\n')
+    boot.CHOREO_DIR = str(tmp_path)
+    monkeypatch.setattr(boot.ChoreographyPlayer, 'scan', lambda player: None)
+    async def body():
+        job = submit(boot, '{"action": "play", "name": "bad"}')
+        result = await boot.wait_result(job)
+        after = await boot.wait_result(submit(boot, 'open_claw'))
+        return job, result, after
+    job, result, after = run_robot(boot, body)
+    assert job.state == 'error'
+    assert "Bad keyframe 3 in bad" in result["message"]
+    assert after["status"] == "success"
+    assert not boot.motion_engine.busy()
+
+@pytest.fixture
+def teleop(boot):
+    """A UDP sender for the robot's teleop socket; yields (setpoint, last_ack_status)"""
+    robot = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    robot.bind(('127.0.0.1', 0))
+    port = robot.getsockname()[1]
+    robot.close()
+    boot.teleop.open(port)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.settimeout(1)
+    def setpoint(seq, flags=0):
+        """Send one setpoint and let the robot read it; returns whether teleop is active"""
+        sender.sendto(struct.pack(boot.TELEOP_FORMAT, boot.TELEOP_MAGIC, flags, seq, 0, 90 * 16, -1, -1, -1),
+                      ('127.0.0.1', port))
+        time.sleep(0.01)
+        boot.teleop.poll(boot.time.ticks_ms())
+        return boot.teleop.active
+    def ack_status():
+        return struct.unpack_from(boot.TELEOP_ACK_FORMAT, sender.recv(64))[1]
+    try:
+        yield setpoint, ack_status
+    finally:
+        sender.close()
+        boot.teleop.sock.close()
+
+def test_teleop_stays_stopped_until_a_new_session(boot, teleop):
+    setpoint, ack_status = teleop
+    assert setpoint(1)
+    boot.route_message('stop')
+    assert not boot.teleop.active
+    assert not setpoint(2)   # The stream is still sending: refused
+    assert ack_status() == boot.TELEOP_STOPPED
+    assert setpoint(1, boot.TELEOP_FLAG_START)  # A new session may restart its numbering
+
+def test_teleop_ignores_late_datagrams_after_deadman(boot, teleop):
+    setpoint, ack_status = teleop
+    assert setpoint(10, boot.TELEOP_FLAG_START)
+    boot.teleop.step(boot.time.ticks_ms() + boot.TELEOP_DEADMAN_MS + 1)
+    assert not boot.teleop.active
+    cancels = boot.motion_engine.cancels
+    for seq in (10, 9):      # A late duplicate, then an older setpoint
+        assert not setpoint(seq)
+        assert ack_status() == boot.TELEOP_STALE
+    assert boot.motion_engine.cancels == cancels  # Nothing was preempted
+    assert setpoint(11)      # The same session carrying on takes over again
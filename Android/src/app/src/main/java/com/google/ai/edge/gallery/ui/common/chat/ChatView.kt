@@ -745,7 +745,14 @@ suspend fun sendRobotCommand(ipAddress: String, command: String): Boolean {
         Log.d("RobotControl", "Could not read response message: ${e.message}")
       }
       
-      connection.disconnect()
+      // Drain and close the body instead of calling disconnect(), so the
+      // keep-alive connection goes back to the pool for the next command
+      try {
+        val stream = if (responseCode < 400) connection.inputStream else connection.errorStream
+        stream?.use { it.readBytes() }
+      } catch (e: Exception) {
+        Log.d("RobotControl", "Could not read response body: ${e.message}")
+      }
       val success = responseCode == HttpURLConnection.HTTP_OK
       Log.d("RobotControl", "Command send ${if (success) "successful" else "failed"}")
       success